@@ -0,0 +1,380 @@
+"""Charge/discharge cycles and capacity fade of the board's battery, from battery_logs.
+
+The firmware reports percentage and voltage but no health data, so both
+are estimated from the logged curves:
+
+- Cycles: the percentage series is split into charge and discharge
+  segments wherever it turns by more than ANALYTICS_HYSTERESIS points.
+  Equivalent cycles are the summed discharge depth / 100; a discharge of
+  at least ANALYTICS_FULL_DEPTH points also counts as a full cycle.
+- Capacity: for every discharge, seconds per percentage point (least
+  squares of time against percentage). Under a similar load this shrinks
+  with the capacity, so a line fitted through it against cumulative cycles
+  gives the fade rate and today's capacity relative to the first cycles.
+  The voltage at ANALYTICS_REF_PCT is tracked the same way as a sag figure.
+
+Rows are read in id order, ANALYTICS_CHUNK_ROWS at a time, and each chunk
+is collapsed with NumPy to one level per run of equal percentage before
+the segment walk. NumPy stops there: the fits are not np.polyfit over
+stored samples but closed-form least squares over running sums (n, sum x,
+sum x^2, sum y, sum xy; see level_sums and fit_line), updated one level at
+a time. That keeps the open segment and the totals the same size however
+long the board runs, and lets a refresh resume from a few numbers.
+Finished segments are appended to battery_cycles and the running state is
+stored in battery_analytics; a refresh only reads rows logged since the
+previous one, even across restarts.
+"""
+import json
+import math
+import time
+from threading import Lock
+import numpy as np
+from database import connect
+from log import get_logger
+from config import (ANALYTICS_CHUNK_ROWS, ANALYTICS_REFRESH_ROWS, ANALYTICS_HYSTERESIS, ANALYTICS_MAX_GAP,
+                    ANALYTICS_FULL_DEPTH, ANALYTICS_FIT_DEPTH, ANALYTICS_REF_PCT)
+
+log = get_logger("analytics")
+
+CHUNK_SQL = """
+    SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), percentage, voltage
+    FROM battery_logs
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+INSERT_CYCLE_SQL = """
+    INSERT INTO battery_cycles (direction, started_at, ended_at, from_pct, to_pct, depth, seconds_per_pct, volts_at_ref)
+    VALUES (:direction, :start, :end, :from_pct, :to_pct, :depth, :seconds_per_pct, :volts_at_ref)
+"""
+
+STATE_VERSION = 2
+
+# Voltage is fitted against percentage only this close to ANALYTICS_REF_PCT, where the curve is near linear
+REF_WINDOW = 10
+
+# Finished segments returned with each refresh
+RECENT_SEGMENTS = 10
+
+# Layout of a segment's running sums (see level_sums): time on percentage,
+# then voltage on percentage for levels near the reference, then the
+# percentage range those voltage levels cover
+N, SUM_P, SUM_PP, SUM_T, SUM_PT, V_N, V_SUM_P, V_SUM_PP, V_SUM_V, V_SUM_PV, V_MIN_P, V_MAX_P = range(12)
+
+
+def _empty_state():
+    return {
+        "version": STATE_VERSION,
+        "last_id": 0,
+        "last_ts": None,
+        # Open segment
+        "direction": 0,   # +1 charging, -1 discharging, 0 not known yet
+        "start": None,    # [percentage, time, voltage] where it began
+        "extreme": None,  # highest (charging) / lowest (discharging) level so far
+        "pct": None,      # latest percentage
+        "sums": None,     # level_sums of start..extreme
+        "tail": None,     # level_sums of the levels after extreme
+        # Finished segments
+        "totals": {
+            "equivalent_cycles": 0.0,
+            "full_cycles": 0,
+            "charges": 0,
+            "discharges": 0,
+            "voltage_at_ref": None,
+            "runtime_fit": [0.0] * 5,  # line_sums of (cycles, seconds per point)
+            "voltage_fit": [0.0] * 5   # line_sums of (cycles, volts at reference)
+        }
+    }
+
+
+def chunk_levels(rows, last_ts):
+    """Collapse (id, epoch, percentage, voltage) rows to one level per run of equal percentage.
+
+    Returns ((percentage, mean time, mean voltage, gap before) arrays, time of
+    the last sample); a gap is more than ANALYTICS_MAX_GAP seconds since the
+    previous sample.
+    """
+    data = np.array(rows, dtype=float)  # NULLs become NaN
+    data = data[~np.isnan(data[:, 1]) & ~np.isnan(data[:, 2])]
+    if not len(data):
+        return None, last_ts
+    ts, pct, volt = data[:, 1], data[:, 2], data[:, 3]
+
+    gap = np.empty(len(ts), dtype=bool)
+    gap[0] = last_ts is not None and ts[0] - last_ts > ANALYTICS_MAX_GAP
+    gap[1:] = np.diff(ts) > ANALYTICS_MAX_GAP
+    starts = np.flatnonzero(np.r_[True, (np.diff(pct) != 0) | gap[1:]])
+    counts = np.diff(np.r_[starts, len(ts)])
+
+    has_volt = ~np.isnan(volt)
+    volt_n = np.add.reduceat(has_volt, starts)
+    volt_sum = np.add.reduceat(np.where(has_volt, volt, 0.0), starts)
+    levels = (pct[starts],
+              np.add.reduceat(ts, starts) / counts,
+              np.where(volt_n > 0, volt_sum / np.maximum(volt_n, 1), np.nan),
+              gap[starts])
+    return levels, float(ts[-1])
+
+
+def level_sums(pct, ts, volt):
+    """Running least-squares sums contributed by one level."""
+    if volt is None or abs(pct - ANALYTICS_REF_PCT) > REF_WINDOW:
+        return [1.0, pct, pct * pct, ts, pct * ts, 0.0, 0.0, 0.0, 0.0, 0.0, math.inf, -math.inf]
+    return [1.0, pct, pct * pct, ts, pct * ts, 1.0, pct, pct * pct, volt, pct * volt, pct, pct]
+
+
+def merge_sums(*parts):
+    """Combine level_sums (None parts are skipped)."""
+    parts = [p for p in parts if p is not None]
+    merged = [sum(values) for values in zip(*(p[:V_MIN_P] for p in parts))]
+    return merged + [min(p[V_MIN_P] for p in parts), max(p[V_MAX_P] for p in parts)]
+
+
+def line_sums(x, y):
+    return [1.0, x, x * x, y, x * y]
+
+
+def fit_line(n, sum_x, sum_xx, sum_y, sum_xy):
+    """Least-squares (slope, intercept) from running sums; None below 3 points or without spread in x."""
+    if n < 3:
+        return None
+    spread = sum_xx - sum_x * sum_x / n
+    if spread <= 1e-9 * max(sum_xx, 1.0):
+        return None
+    slope = (sum_xy - sum_x * sum_y / n) / spread
+    return slope, (sum_y - slope * sum_x) / n
+
+
+def summarize_segment(direction, start, end, sums):
+    """One finished charge or discharge: span, depth, seconds per point and voltage at the reference."""
+    segment = {
+        "direction": "charge" if direction > 0 else "discharge",
+        "start": int(start[1]),
+        "end": int(end[1]),
+        "from_pct": start[0],
+        "to_pct": end[0],
+        "depth": round(abs(end[0] - start[0]), 2),
+        "seconds_per_pct": None,
+        "volts_at_ref": None
+    }
+    line = fit_line(*sums[N:SUM_PT + 1])
+    if line is not None:
+        segment["seconds_per_pct"] = round(abs(line[0]), 2)
+    if sums[V_MIN_P] <= ANALYTICS_REF_PCT <= sums[V_MAX_P]:
+        line = fit_line(*sums[V_N:V_SUM_PV + 1])
+        if line is not None:
+            segment["volts_at_ref"] = round(line[0] * ANALYTICS_REF_PCT + line[1], 4)
+    return segment
+
+
+def add_segment(totals, segment):
+    """Fold a finished segment into the cycle counts and fade fits."""
+    if segment["direction"] == "charge":
+        totals["charges"] += 1
+        return
+    totals["discharges"] += 1
+    totals["equivalent_cycles"] += segment["depth"] / 100
+    cycles = totals["equivalent_cycles"]
+    if segment["depth"] >= ANALYTICS_FULL_DEPTH:
+        totals["full_cycles"] += 1
+    if segment["depth"] >= ANALYTICS_FIT_DEPTH and segment["seconds_per_pct"] is not None:
+        totals["runtime_fit"] = [a + b for a, b in zip(totals["runtime_fit"], line_sums(cycles, segment["seconds_per_pct"]))]
+    if segment["volts_at_ref"] is not None:
+        totals["voltage_at_ref"] = segment["volts_at_ref"]
+        totals["voltage_fit"] = [a + b for a, b in zip(totals["voltage_fit"], line_sums(cycles, segment["volts_at_ref"]))]
+
+
+def fit_fade(totals):
+    """Cycle counts plus capacity and voltage trends from the running totals."""
+    equivalent = totals["equivalent_cycles"]
+    result = {
+        "equivalent_cycles": round(equivalent, 2),
+        "full_cycles": totals["full_cycles"],
+        "charges": totals["charges"],
+        "discharges": totals["discharges"],
+        "capacity_percent": None,
+        "fade_pct_per_100_cycles": None,
+        "cycles_to_80_percent": None,
+        "voltage_at_ref": totals["voltage_at_ref"],
+        "voltage_trend_mv_per_100_cycles": None,
+        "fit_points": 0
+    }
+
+    line = fit_line(*totals["runtime_fit"])
+    if line is not None and line[1] > 0:
+        slope, initial = line
+        result["fit_points"] = int(totals["runtime_fit"][0])
+        result["capacity_percent"] = round(100 * (initial + slope * equivalent) / initial, 1)
+        result["fade_pct_per_100_cycles"] = round(-slope / initial * 100 * 100, 2)
+        if slope < 0:
+            result["cycles_to_80_percent"] = max(round(-0.2 * initial / slope - equivalent, 1), 0.0)
+
+    line = fit_line(*totals["voltage_fit"])
+    if line is not None:
+        result["voltage_trend_mv_per_100_cycles"] = round(line[0] * 1000 * 100, 1)
+    return result
+
+
+class BatteryAnalytics:
+    """Incremental cycle and fade estimates over battery_logs."""
+
+    def __init__(self, chunk_rows=ANALYTICS_CHUNK_ROWS, refresh_rows=ANALYTICS_REFRESH_ROWS):
+        self.chunk_rows = chunk_rows
+        self.refresh_rows = refresh_rows
+        self._state = None
+        self._finished = []  # segments closed since the last save
+        self._lock = Lock()
+        self.stats = {"refreshes": 0, "rows_scanned": 0, "last_refresh_ms": None}
+
+    # ----- persistence -----
+
+    def _load(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS battery_analytics (id INTEGER PRIMARY KEY CHECK (id = 1), state TEXT)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS battery_cycles (
+                id INTEGER PRIMARY KEY,
+                direction TEXT,
+                started_at INTEGER,
+                ended_at INTEGER,
+                from_pct REAL,
+                to_pct REAL,
+                depth REAL,
+                seconds_per_pct REAL,
+                volts_at_ref REAL
+            )
+        """)
+        row = conn.execute("SELECT state FROM battery_analytics WHERE id = 1").fetchone()
+        state = json.loads(row[0]) if row else None
+        if not state or state.get("version") != STATE_VERSION:
+            state = self._reset(conn)
+        return state
+
+    def _reset(self, conn):
+        with conn:
+            conn.execute("DELETE FROM battery_cycles")
+            conn.execute("DELETE FROM battery_analytics")
+        self._finished.clear()
+        return _empty_state()
+
+    def _save(self, conn):
+        """Append the newly finished segments and replace the running state, in one transaction."""
+        with conn:
+            conn.executemany(INSERT_CYCLE_SQL, self._finished)
+            conn.execute("INSERT OR REPLACE INTO battery_analytics (id, state) VALUES (1, ?)", (json.dumps(self._state),))
+        self._finished.clear()
+
+    def _recent(self, conn):
+        rows = conn.execute("""
+            SELECT direction, started_at, ended_at, from_pct, to_pct, depth, seconds_per_pct, volts_at_ref
+            FROM battery_cycles ORDER BY id DESC LIMIT ?
+        """, (RECENT_SEGMENTS,)).fetchall()
+        keys = ("direction", "start", "end", "from_pct", "to_pct", "depth", "seconds_per_pct", "volts_at_ref")
+        return [dict(zip(keys, row)) for row in reversed(rows)]
+
+    # ----- segment walk -----
+
+    def _close(self):
+        """Finish the open segment at its extreme."""
+        state = self._state
+        if state["direction"] and state["extreme"][0] != state["start"][0]:
+            segment = summarize_segment(state["direction"], state["start"], state["extreme"], state["sums"])
+            add_segment(state["totals"], segment)
+            self._finished.append(segment)
+
+    def _feed(self, pct, ts, volt, gap):
+        """Advance the open segment by one level."""
+        state = self._state
+        if gap and state["start"] is not None:
+            # Nothing logged for a while: whatever was open ends at its extreme
+            self._close()
+            state["start"] = None
+
+        level = [pct, ts, None if math.isnan(volt) else volt]
+        sums = level_sums(*level)
+        state["pct"] = pct
+        if state["start"] is None:
+            state.update(direction=0, start=level, extreme=level, sums=sums, tail=None)
+            return
+
+        direction = state["direction"]
+        if direction == 0:
+            state["sums"] = merge_sums(state["sums"], sums)
+            moved = pct - state["start"][0]
+            if abs(moved) >= ANALYTICS_HYSTERESIS:
+                state["direction"] = 1 if moved > 0 else -1
+                state["extreme"] = level
+            return
+
+        extreme = state["extreme"]
+        if (pct - extreme[0]) * direction > 0:
+            state["sums"] = merge_sums(state["sums"], state["tail"], sums)
+            state["tail"] = None
+            state["extreme"] = level
+        elif (extreme[0] - pct) * direction >= ANALYTICS_HYSTERESIS:
+            # Turned: the segment ends at the extreme and the next one starts there. Every
+            # level since stayed within the hysteresis band, so this level is its first extreme.
+            self._close()
+            state.update(direction=-direction, start=extreme, extreme=level, tail=None,
+                         sums=merge_sums(level_sums(*extreme), state["tail"], sums))
+        else:
+            state["tail"] = merge_sums(state["tail"], sums)
+
+    def _scan(self, conn):
+        """Read rows past last_id in chunks; returns (rows read, whether more are waiting)."""
+        state = self._state
+        scanned = 0
+        while scanned < self.refresh_rows:
+            rows = conn.execute(CHUNK_SQL, (state["last_id"], self.chunk_rows)).fetchall()
+            if not rows:
+                return scanned, False
+            scanned += len(rows)
+            state["last_id"] = rows[-1][0]
+            levels, state["last_ts"] = chunk_levels(rows, state["last_ts"])
+            if levels is not None:
+                for pct, ts, volt, gap in zip(*(column.tolist() for column in levels)):
+                    self._feed(pct, ts, volt, gap)
+            if len(rows) < self.chunk_rows:
+                return scanned, False
+        return scanned, True
+
+    # ----- public -----
+
+    def refresh(self):
+        """Fold in rows logged since the last refresh and return the current estimates."""
+        with self._lock:
+            started = time.perf_counter()
+            conn = connect()
+            try:
+                if self._state is None:
+                    self._state = self._load(conn)
+                newest = conn.execute("SELECT max(id) FROM battery_logs").fetchone()[0] or 0
+                if newest < self._state["last_id"]:
+                    log.info("battery_logs was reset; starting over")
+                    self._state = self._reset(conn)
+                scanned, pending = self._scan(conn)
+                if scanned:
+                    self._save(conn)
+                recent = self._recent(conn)
+            finally:
+                conn.close()
+
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stats["refreshes"] += 1
+            self.stats["rows_scanned"] += scanned
+            self.stats["last_refresh_ms"] = round(elapsed, 3)
+            if scanned:
+                log.info("Scanned %d new rows in %.1f ms%s", scanned, elapsed, " (more pending)" if pending else "")
+            state = self._state
+            return dict(fit_fade(state["totals"]),
+                        in_progress=({"direction": "charge" if state["direction"] > 0 else "discharge",
+                                      "from_pct": state["start"][0],
+                                      "pct": state["pct"]}
+                                     if state["direction"] and state["start"] is not None else None),
+                        recent=recent,
+                        last_row_id=state["last_id"],
+                        pending=pending,
+                        refresh=dict(self.stats))
+
+
+battery_analytics = BatteryAnalytics()
@@ -1,14 +1,27 @@
-from flask import Flask, jsonify, request
-from threading import Thread
+from flask import Flask, Response, g, jsonify, request
+from threading import Thread, Event
+from collections import deque
 from datetime import datetime
 
-from globals import battery_data, data_lock
-from serial_handler import init_serial, read_serial, send_command
-from serial_handler import list_ports, is_connected, get_port, connect_port
-from database import init_db
-import psutil
-import wmi
+from globals import get_battery_data
+from serial_handler import init_serial, send_command, start_reader, get_command_stats
+from serial_handler import is_connected, get_port, get_protocol, connect_port
+from serial_handler import get_telemetry_interval, set_telemetry_interval
+from serial_handler import keep_reconnecting, set_reconnect_handler, is_reconnecting
+from database import init_db, get_writer_stats, query_history, ROLLUPS
+from health import get_health, get_capacity, start_health_refresher
+from sensors import SensorRegistry
+from devices import devices
+from ports import inventory as port_inventory
+from telemetry_rate import TelemetryRatePolicy
+from events import broker, publish
+from log import get_logger, setup_logging, stats as log_stats
+from metrics import counter, histogram, add_collector, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from config import SERIAL_PORT_OVERRIDE, SAMPLE_INTERVAL, SSE_HEARTBEAT, CONTROLLER_LATENCY_SAMPLES, SENSOR_BATCH_MAX, SENSOR_STALE_AFTER
+import json
+import queue
 import time
+import uuid
 
 app = Flask(__name__)
 
@@ -22,42 +35,79 @@ HIGH_THRESHOLD = 80
 CHECK_INTERVAL = 5
 
 # External sensor configuration
-SENSOR_SOURCES = {}  # {source_name: {"percentage": value, "timestamp": datetime, "device_type": "power_bank|phone|tablet"}}
+SENSOR_SOURCES = SensorRegistry()  # source_name -> latest reading + recent history (see sensors.py)
 ACTIVE_SENSOR_SOURCE = None  # Which sensor source to use for AUTO mode (None = use laptop battery)
 
+sampler_log = get_logger("sampler")
+ssr_log = get_logger("ssr")
+mode_log = get_logger("mode")
+sensor_log = get_logger("sensor")
+thresholds_log = get_logger("thresholds")
+controller_log = get_logger("controller")
+server_log = get_logger("flask")
+
+# /metrics instruments (see metrics.py)
+REQUEST_SECONDS = histogram("http_request_seconds", "Flask view time per route", ("method", "route", "status"))
+PSUTIL_SECONDS = histogram("psutil_sensors_battery_seconds", "psutil.sensors_battery() call")
+SENSOR_READINGS = counter("sensor_readings_total", "External sensor readings accepted", ("endpoint",))
+CONTROLLER_PASS_SECONDS = histogram("controller_pass_seconds", "One AUTO controller pass, including any command it sends")
+CONTROLLER_DECISION_SECONDS = histogram("controller_decision_latency_seconds", "State change to controller decision")
+CONTROLLER_TICK_JITTER = histogram("controller_tick_jitter_seconds", "How late fallback ticks fire after their scheduled time")
+
 
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-    response.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, If-None-Match'
+    response.headers['Access-Control-Allow-Methods'] = 'GET,POST,DELETE,OPTIONS'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
     return response
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_latency(error=None):
+    """Runs for every request, including ones whose view raised (recorded as 500)."""
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = 500 if error is not None else g.pop("response_status", 500)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, str(status))
+
 def seconds_to_hours(seconds):
     hours = seconds // 3600
     minutes = (seconds % 3600) // 60
     return f"{hours} jam {minutes} menit"
 
-def get_health():
+def parse_time_param(value, default):
+    """Accept epoch seconds or an ISO 8601 string; naive ISO times are local time."""
+    if value is None or value == "":
+        return default
     try:
-        c = wmi.WMI(namespace="root\\wmi")
-        full = c.BatteryFullChargedCapacity()[0].FullChargedCapacity
-        design = c.BatteryStaticData()[0].DesignedCapacity
-        health = round((full / design) * 100, 2)
-        return health
-    except:
-        return None
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
 
 def estimate_cycles(health):
     if health is None:
         return None
     return int((100 - health) * 5)
 
-@app.route("/api/battery")
-def battery():
+def build_battery_payload():
+    """Sample psutil once and build the /api/battery document (None if no battery)."""
+    import psutil  # deferred: first called from the sampler thread, after the server is up
+    started = time.perf_counter()
     b = psutil.sensors_battery()
+    PSUTIL_SECONDS.observe(time.perf_counter() - started)
     if not b:
-        return jsonify({"error": "Battery not detected"}), 404
+        return None
 
     health = get_health()
     cycles = estimate_cycles(health)
@@ -73,19 +123,144 @@ def battery():
         time_left = "Tidak diketahui"
 
 
-    return jsonify({
+    return {
         "status": {
             "percentage": b.percent,
             "plugged": b.power_plugged,
             "time_left": time_left
         },
         "health": {
-            "health_percent": health
+            "health_percent": health,
+            **get_capacity()
         },
         "estimated_cycles": cycles,
         "temperature_celsius": None
+    }
+
+
+_sampler_worker = None
+
+def _alive(worker):
+    """True for a running Thread or an unfinished asyncio Task (see async_app.py)."""
+    if worker is None:
+        return False
+    return not worker.done() if hasattr(worker, "done") else worker.is_alive()
+
+def battery_sampler_loop():
+    """One sampling pass per SAMPLE_INTERVAL, shared by every client via the broker."""
+    while True:
+        try:
+            publish("battery", build_battery_payload())
+        except Exception as e:
+            sampler_log.error("Error: %s", e)
+        time.sleep(SAMPLE_INTERVAL)
+
+def start_battery_sampler():
+    global _sampler_worker
+    if not _alive(_sampler_worker):
+        _sampler_worker = Thread(target=battery_sampler_loop, name="battery-sampler", daemon=True)
+        _sampler_worker.start()
+
+def latest_battery_payload():
+    if _alive(_sampler_worker):
+        return broker.latest("battery")
+    return build_battery_payload()
+
+@app.route("/api/battery")
+def battery():
+    data = latest_battery_payload()
+    if not data:
+        return jsonify({"error": "Battery not detected"}), 404
+    return jsonify(data)
+
+@app.route("/api/stream")
+def api_stream():
+    """Server-Sent Events: current state on connect, then only changes"""
+    q = broker.subscribe()
+
+    def generate():
+        try:
+            yield "retry: 2000\n\n"
+            for message in broker.current_messages():
+                yield message
+            while True:
+                try:
+                    yield q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(q)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
     })
 
+
+# Distinguishes ETags across restarts, since the broker version starts at 0 again
+_BOOT_ID = uuid.uuid4().hex[:8]
+_snapshot_cache = (None, None)  # (etag, body), replaced in one assignment so readers never mix the two
+
+@app.route("/api/snapshot")
+def api_snapshot():
+    """Battery, mode, thresholds and sensors in one document, with ETag/304 support
+
+    Sensors are listed without age_seconds/stale: those change as time passes,
+    not with the broker version, so a cached or 304'd copy would show old ages.
+    Clients derive the age from each sensor's timestamp.
+    """
+    global _snapshot_cache
+    if not _alive(_sampler_worker):
+        publish("battery", build_battery_payload())
+
+    # Every state change goes through the broker, so its version identifies the snapshot
+    version = broker.version
+    etag = f"{_BOOT_ID}-{version}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    cached_etag, body = _snapshot_cache
+    if cached_etag != etag:
+        body = json.dumps({
+            "version": version,
+            "battery": broker.latest("battery"),
+            "telemetry": broker.latest("telemetry"),
+            "ssr": broker.latest("ssr"),
+            "mode": current_mode,
+            "thresholds": thresholds_payload(),
+            "sensors": sensor_list_payload(ages=False)
+        })
+        _snapshot_cache = (etag, body)
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/telemetry")
+def telemetry():
+    """Latest telemetry frame published by the serial reader"""
+    return jsonify({
+        "connected": is_connected(),
+        "data": get_battery_data()
+    })
+
+def parse_ssr_state(state):
+    """Map a frontend relay state to ON/OFF; returns (cmd, error)."""
+    # Arduino expects simple ON/OFF commands for relay control
+    if isinstance(state, bool):
+        return ("ON" if state else "OFF"), None
+    if state is None:
+        return None, "state is required"
+    s = str(state).lower()
+    if s in ("on", "true", "1", "aktif", "activate"):
+        return "ON", None
+    if s in ("off", "false", "0", "nonaktif", "deactivate"):
+        return "OFF", None
+    return None, f"invalid state: {state}"
+
 @app.route("/api/ssr", methods=["GET", "POST", "OPTIONS"])
 def ssr():
     # Handle preflight CORS requests
@@ -96,28 +271,19 @@ def ssr():
     payload = request.get_json(silent=True) or {}
     state = payload.get("state")
 
-    print(f"[SSR] Received payload: {payload}, state type: {type(state)}, state value: {state}")
+    ssr_log.debug("Received payload: %s", payload)
 
-    # Arduino expects simple ON/OFF commands for relay control
-    if isinstance(state, bool):
-        cmd = "ON" if state else "OFF"
-    elif state is not None:
-        s = str(state).lower()
-        if s in ("on", "true", "1", "aktif", "activate"):
-            cmd = "ON"
-        elif s in ("off", "false", "0", "nonaktif", "deactivate"):
-            cmd = "OFF"
-        else:
-            print(f"[SSR] Invalid state: {state} (as string: '{s}')")
-            return jsonify({"success": False, "error": f"invalid state: {state}"}), 400
-    else:
-        print(f"[SSR] State is None or missing")
-        return jsonify({"success": False, "error": "state is required"}), 400
+    cmd, error = parse_ssr_state(state)
+    if error:
+        ssr_log.warning("%s", error)
+        return jsonify({"success": False, "error": error}), 400
 
-    print(f"[SSR] Sending command: {cmd}")
+    ssr_log.info("Sending command: %s", cmd)
     result = send_command(cmd)
-    # Read any immediate response from serial buffer
-    lines = read_serial()
+    if result.get("success"):
+        publish("ssr", {"state": cmd, "source": "manual"})
+    # Firmware reply matched to this command (if any)
+    lines = [json.dumps(result["response"])] if result.get("response") else []
     return jsonify({"result": result, "response_lines": lines})
 
 @app.route("/api/mode", methods=["GET"])
@@ -135,17 +301,18 @@ def set_mode():
     if new_mode not in ["MANUAL", "AUTO"]:
         return jsonify({"success": False, "error": "invalid mode"}), 400
     
-    print(f"[MODE] Switching from {current_mode} to {new_mode}")
+    mode_log.info("Switching from %s to %s", current_mode, new_mode)
     
     # Try to send mode command to Arduino
     result = send_command(f"MODE:{new_mode}")
     current_mode = new_mode
-    print(f"[MODE] current_mode now = {current_mode}")
+    publish("mode", {"mode": current_mode})
     
     # If switching to AUTO, immediately turn ON relay
     if new_mode == "AUTO":
-        print(f"[MODE] AUTO mode activated - turning relay ON")
-        send_command("ON")
+        mode_log.info("AUTO mode activated - turning relay ON")
+        if send_command("ON").get("success"):
+            publish("ssr", {"state": "ON", "source": "auto"})
     
     # Return success regardless of serial connection - mode is switched
     return jsonify({
@@ -157,17 +324,28 @@ def set_mode():
 
 @app.route('/api/serial/ports', methods=['GET'])
 def api_list_ports():
-    return jsonify({"ports": list_ports()})
+    """Serial ports with VID/PID metadata, from a short-lived cache (?refresh=1 rescans)"""
+    details = port_inventory.ports(refresh=request.args.get("refresh") in ("1", "true"))
+    return jsonify({"ports": [p["device"] for p in details], "details": details})
 
 
 @app.route('/api/serial/status', methods=['GET'])
 def api_serial_status():
     return jsonify({
         "connected": is_connected(),
-        "port": get_port()
+        "port": get_port(),
+        "protocol": get_protocol(),
+        "telemetry_interval_ms": get_telemetry_interval(),
+        "reconnecting": is_reconnecting()
     })
 
 
+@app.route('/api/serial/commands', methods=['GET'])
+def api_serial_commands():
+    """Command acknowledgement counters and last round-trip time"""
+    return jsonify(get_command_stats())
+
+
 @app.route('/api/serial/connect', methods=['POST'])
 def api_serial_connect():
     payload = request.get_json(silent=True) or {}
@@ -175,18 +353,125 @@ def api_serial_connect():
     if not port:
         return jsonify({"success": False, "error": "port required"}), 400
     result = connect_port(port)
+    if result.get('success'):
+        take_relay_control()
     status = 200 if result.get('success') else 400
     return jsonify(result), status
 
 
-@app.route('/api/thresholds', methods=['GET'])
-def get_thresholds():
-    """Get current AUTO mode thresholds"""
-    return jsonify({
+@app.route('/api/db/stats', methods=['GET'])
+def api_db_stats():
+    """Background DB writer queue depth and flush latency"""
+    return jsonify(get_writer_stats())
+
+
+@app.route('/api/history', methods=['GET'])
+def api_history():
+    """Logged telemetry for a time range, served from the coarsest rollup that fits"""
+    now = time.time()
+    try:
+        end = parse_time_param(request.args.get('to'), now)
+        start = parse_time_param(request.args.get('from'), end - 3600)
+    except ValueError:
+        return jsonify({"success": False, "error": "from/to must be epoch seconds or ISO 8601"}), 400
+
+    resolution = request.args.get('resolution', 'auto').lower()
+    if resolution not in ('auto', 'raw', *ROLLUPS):
+        return jsonify({"success": False, "error": f"invalid resolution: {resolution}"}), 400
+    if start > end:
+        return jsonify({"success": False, "error": "from must be before to"}), 400
+
+    return jsonify(query_history(start, end, resolution))
+
+
+@app.route('/api/battery/analytics', methods=['GET'])
+def api_battery_analytics():
+    """Charge cycles and capacity fade of the board's battery, estimated from battery_logs"""
+    from analytics import battery_analytics  # deferred: pulls in numpy
+    return jsonify(battery_analytics.refresh())
+
+
+def thresholds_payload():
+    return {
         "low_threshold": LOW_THRESHOLD,
         "high_threshold": HIGH_THRESHOLD,
         "check_interval": CHECK_INTERVAL
-    })
+    }
+
+
+def sensor_list_payload(ages=True):
+    return {
+        "sensors": SENSOR_SOURCES.snapshot(ages),
+        "active_source": ACTIVE_SENSOR_SOURCE,
+        "total_sensors": len(SENSOR_SOURCES)
+    }
+
+
+@app.route('/api/thresholds', methods=['GET'])
+def get_thresholds():
+    """Get current AUTO mode thresholds"""
+    return jsonify(thresholds_payload())
+
+
+def validate_sensor_reading(payload):
+    """Check one {source, percentage, device_type} reading; returns (reading, error)."""
+    if not isinstance(payload, dict):
+        return None, "reading must be an object"
+
+    source = payload.get('source', '')
+    percentage = payload.get('percentage')
+    device_type = payload.get('device_type', 'other')
+
+    if not isinstance(source, str) or not source.strip():
+        return None, "source is required"
+
+    if percentage is None or not isinstance(percentage, (int, float)) or percentage < 0 or percentage > 100:
+        return None, "percentage must be 0-100"
+
+    return (source.strip(), percentage, device_type), None
+
+
+def parse_sensor_batch():
+    """Readings from a JSON array, {"readings": [...]}, or an NDJSON body."""
+    body = request.get_data(cache=False, as_text=True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)  # reported per item
+        return items
+
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get('readings')
+    if not isinstance(data, list):
+        raise ValueError("body must be a JSON array of readings")
+    return data
+
+
+def publish_sensor(entry, is_new=False):
+    """Per-sensor change event; the full list only when membership changes."""
+    publish("sensor", entry.to_dict(), key=entry.source)
+    if is_new:
+        publish("sensors", sensor_list_payload())
+
+
+def expire_sensors(expired):
+    """Sweeper callback: sensors silent for SENSOR_EXPIRE_AFTER seconds were dropped."""
+    global ACTIVE_SENSOR_SOURCE
+    for source in expired:
+        broker.forget("sensor", key=source)
+        forget_rate(source)
+    # Same as remove_sensor: an expired active sensor hands AUTO back to the laptop battery
+    if ACTIVE_SENSOR_SOURCE in expired:
+        sensor_log.info("Active sensor %s expired, switched to laptop_battery", ACTIVE_SENSOR_SOURCE)
+        ACTIVE_SENSOR_SOURCE = None
+    publish("sensors", sensor_list_payload())  # also wakes the controller
+    sensor_log.info("Expired %d silent sensor(s): %s", len(expired), ", ".join(expired[:5]))
 
 
 @app.route('/api/sensor/update', methods=['POST'])
@@ -201,53 +486,105 @@ def update_sensor_data():
         "device_type": "power_bank|phone|tablet|other"  # optional
     }
     """
-    global SENSOR_SOURCES
     payload = request.get_json(silent=True) or {}
-    
-    source = payload.get('source', '').strip()
-    percentage = payload.get('percentage')
-    device_type = payload.get('device_type', 'other')
-    
-    if not source:
-        return jsonify({"success": False, "error": "source is required"}), 400
-    
-    if percentage is None or not isinstance(percentage, (int, float)) or percentage < 0 or percentage > 100:
-        return jsonify({"success": False, "error": "percentage must be 0-100"}), 400
-    
+
+    reading, error = validate_sensor_reading(payload)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    source, percentage, device_type = reading
+
     try:
-        SENSOR_SOURCES[source] = {
-            "percentage": float(percentage),
-            "timestamp": datetime.now().isoformat(),
-            "device_type": device_type
-        }
-        print(f"[SENSOR] Updated {source}: {percentage}% ({device_type})")
+        is_new = source not in SENSOR_SOURCES
+        entry = SENSOR_SOURCES.update(source, percentage, device_type)
+        if entry is None:
+            return jsonify({"success": False, "error": "sensor limit reached"}), 503
+        publish_sensor(entry, is_new)
+        SENSOR_READINGS.inc("update")
+        sensor_log.debug("Updated %s: %s%% (%s)", source, percentage, device_type)
         return jsonify({
             "success": True,
             "source": source,
             "percentage": percentage,
-            "timestamp": SENSOR_SOURCES[source]["timestamp"]
+            "timestamp": entry.to_dict()["timestamp"]
         })
     except Exception as e:
-        print(f"[SENSOR] Error updating {source}: {e}")
+        sensor_log.error("Error updating %s: %s", source, e)
         return jsonify({"success": False, "error": str(e)}), 400
 
 
+@app.route('/api/sensor/batch', methods=['POST'])
+def update_sensor_batch():
+    """
+    Receive many external sensor readings in one request
+
+    Body: JSON array of /api/sensor/update objects (or {"readings": [...]}),
+    or NDJSON with Content-Type application/x-ndjson. Readings are applied
+    in order, so the last reading per source wins.
+    """
+    try:
+        items = parse_sensor_batch()
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"invalid batch: {e}"}), 400
+
+    if len(items) > SENSOR_BATCH_MAX:
+        return jsonify({"success": False, "error": f"batch exceeds {SENSOR_BATCH_MAX} readings"}), 413
+
+    now = time.time()
+    results = []
+    readings = []
+    valid_results = []
+    for index, item in enumerate(items):
+        reading, error = validate_sensor_reading(item)
+        if error:
+            results.append({"index": index, "success": False, "error": error})
+            continue
+        result = {"index": index, "success": True, "source": reading[0]}
+        results.append(result)
+        readings.append(reading)
+        valid_results.append(result)
+
+    known = len(SENSOR_SOURCES)
+    touched = {}
+    for result, entry in zip(valid_results, SENSOR_SOURCES.update_many(readings, now)):
+        if entry is None:
+            result.update(success=False, error="sensor limit reached")
+        else:
+            touched[entry.source] = entry
+
+    for entry in touched.values():
+        publish("sensor", entry.to_dict(now), key=entry.source)
+    if len(SENSOR_SOURCES) != known:
+        publish("sensors", sensor_list_payload())
+
+    accepted = sum(1 for r in results if r["success"])
+    SENSOR_READINGS.inc("batch", amount=accepted)
+    timestamp = datetime.fromtimestamp(now).isoformat()
+    sensor_log.debug("Batch: %d/%d readings applied (%d sources)", accepted, len(items), len(touched))
+    return jsonify({
+        "success": accepted == len(items),
+        "accepted": accepted,
+        "rejected": len(items) - accepted,
+        "timestamp": timestamp,
+        "results": results
+    })
+
+
 @app.route('/api/sensor/list', methods=['GET'])
 def list_sensors():
     """Get list of all registered sensors and their current values"""
-    sensors_list = []
-    for source, data in SENSOR_SOURCES.items():
-        sensors_list.append({
-            "source": source,
-            "percentage": data["percentage"],
-            "device_type": data["device_type"],
-            "timestamp": data["timestamp"]
-        })
-    
+    return jsonify(sensor_list_payload())
+
+
+@app.route('/api/sensor/history', methods=['GET'])
+def sensor_history():
+    """Recent readings kept in memory for one sensor"""
+    source = request.args.get('source', '').strip()
+    entry = SENSOR_SOURCES.get(source)
+    if entry is None:
+        return jsonify({"success": False, "error": f"sensor '{source}' not found"}), 404
     return jsonify({
-        "sensors": sensors_list,
-        "active_source": ACTIVE_SENSOR_SOURCE,
-        "total_sensors": len(SENSOR_SOURCES)
+        "source": source,
+        "readings": [{"timestamp": t, "percentage": p} for t, p in entry.history()]
     })
 
 
@@ -272,7 +609,8 @@ def set_active_sensor():
         return jsonify({"success": False, "error": f"sensor '{source}' not found"}), 404
     
     ACTIVE_SENSOR_SOURCE = source
-    print(f"[SENSOR] Active sensor source set to: {source if source else 'laptop_battery'}")
+    publish("sensors", sensor_list_payload())
+    sensor_log.info("Active sensor source set to: %s", source or "laptop_battery")
     
     return jsonify({
         "success": True,
@@ -284,7 +622,7 @@ def set_active_sensor():
 @app.route('/api/sensor/remove', methods=['POST'])
 def remove_sensor():
     """Remove a sensor from the system"""
-    global ACTIVE_SENSOR_SOURCE, SENSOR_SOURCES
+    global ACTIVE_SENSOR_SOURCE
     payload = request.get_json(silent=True) or {}
     source = payload.get('source', '').strip()
     
@@ -297,10 +635,13 @@ def remove_sensor():
     # If this sensor is active, switch back to laptop battery
     if ACTIVE_SENSOR_SOURCE == source:
         ACTIVE_SENSOR_SOURCE = None
-        print(f"[SENSOR] Removed active sensor {source}, switched to laptop_battery")
+        sensor_log.info("Removed active sensor %s, switched to laptop_battery", source)
     
-    del SENSOR_SOURCES[source]
-    print(f"[SENSOR] Removed sensor {source}")
+    SENSOR_SOURCES.remove(source)
+    broker.forget("sensor", key=source)
+    forget_rate(source)
+    publish("sensors", sensor_list_payload())
+    sensor_log.info("Removed sensor %s", source)
     
     return jsonify({
         "success": True,
@@ -329,99 +670,438 @@ def set_thresholds():
         
         if low is not None:
             LOW_THRESHOLD = low
-            print(f"[THRESHOLDS] Updated LOW_THRESHOLD to {LOW_THRESHOLD}")
         if high is not None:
             HIGH_THRESHOLD = high
-            print(f"[THRESHOLDS] Updated HIGH_THRESHOLD to {HIGH_THRESHOLD}")
         if interval is not None:
             CHECK_INTERVAL = interval
-            print(f"[THRESHOLDS] Updated CHECK_INTERVAL to {CHECK_INTERVAL}")
-        
-        print(f"[THRESHOLDS] Current: LOW={LOW_THRESHOLD}, HIGH={HIGH_THRESHOLD}, INTERVAL={CHECK_INTERVAL}")
         
-        return jsonify({
-            "success": True,
-            "low_threshold": LOW_THRESHOLD,
-            "high_threshold": HIGH_THRESHOLD,
-            "check_interval": CHECK_INTERVAL
-        })
+        thresholds_log.info("Now LOW=%s, HIGH=%s, INTERVAL=%s", LOW_THRESHOLD, HIGH_THRESHOLD, CHECK_INTERVAL)
+        publish("thresholds", thresholds_payload())
+
+        return jsonify({"success": True, **thresholds_payload()})
     except Exception as e:
-        print(f"[THRESHOLDS] Error: {e}")
+        thresholds_log.error("Error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 400
 
-if __name__ == "__main__":
+# ===== Multi-charger devices =====
+# Each board has its own serial port, mode and thresholds; see devices.py.
+
+def device_or_404(device_id):
+    device = devices.get(device_id)
+    if device is None:
+        return None, (jsonify({"success": False, "error": f"unknown device: {device_id}"}), 404)
+    return device, None
+
+@app.route('/api/devices', methods=['GET'])
+def api_list_devices():
+    return jsonify({"devices": [d.to_dict() for d in devices.list()]})
+
+@app.route('/api/devices', methods=['POST'])
+def api_add_device():
+    """Open a serial port as a new device: {"id": "bench-1", "port": "/dev/ttyUSB1"}"""
+    payload = request.get_json(silent=True) or {}
+    device_id = payload.get("id")
+    port = payload.get("port")
+    if not isinstance(device_id, str) or not device_id.strip():
+        return jsonify({"success": False, "error": "id is required"}), 400
+    if not isinstance(port, str) or not port:
+        return jsonify({"success": False, "error": "port is required"}), 400
+
+    try:
+        device = devices.add_device(device_id.strip(), port)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    except OSError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "device": device.to_dict()}), 201
+
+@app.route('/api/devices/<device_id>', methods=['GET'])
+def api_get_device(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    return jsonify(device.to_dict())
+
+@app.route('/api/devices/<device_id>', methods=['DELETE'])
+def api_remove_device(device_id):
+    if not devices.remove_device(device_id):
+        return jsonify({"success": False, "error": f"unknown device: {device_id}"}), 404
+    return jsonify({"success": True})
+
+@app.route('/api/devices/<device_id>/telemetry', methods=['GET'])
+def api_device_telemetry(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    return jsonify({
+        "connected": device.connection.is_connected(),
+        "data": device.connection.telemetry
+    })
+
+@app.route('/api/devices/<device_id>/ssr', methods=['POST'])
+def api_device_ssr(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    payload = request.get_json(silent=True) or {}
+    cmd, error = parse_ssr_state(payload.get("state"))
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    return jsonify({"result": devices.set_relay(device, cmd)})
+
+@app.route('/api/devices/<device_id>/mode', methods=['GET'])
+def api_device_get_mode(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    return jsonify({"mode": device.mode})
+
+@app.route('/api/devices/<device_id>/mode', methods=['POST'])
+def api_device_set_mode(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    payload = request.get_json(silent=True) or {}
+    new_mode = str(payload.get("mode", "")).upper()
+    if new_mode not in ["MANUAL", "AUTO"]:
+        return jsonify({"success": False, "error": "invalid mode"}), 400
+    result = devices.set_mode(device, new_mode)
+    return jsonify({"success": True, "mode": device.mode, "serial_result": result})
+
+@app.route('/api/devices/<device_id>/thresholds', methods=['GET'])
+def api_device_get_thresholds(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    return jsonify({"low_threshold": device.low_threshold, "high_threshold": device.high_threshold})
+
+@app.route('/api/devices/<device_id>/thresholds', methods=['POST'])
+def api_device_set_thresholds(device_id):
+    device, error = device_or_404(device_id)
+    if error:
+        return error
+    payload = request.get_json(silent=True) or {}
+    low = payload.get('low_threshold')
+    high = payload.get('high_threshold')
+    for name, value in (("low_threshold", low), ("high_threshold", high)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 or value > 100):
+            return jsonify({"success": False, "error": f"{name} must be 0-100"}), 400
+    devices.set_thresholds(device, low, high)
+    return jsonify({"success": True, "low_threshold": device.low_threshold, "high_threshold": device.high_threshold})
+
+# ===== AUTO controller =====
+# Wakes on any state change that can affect the relay decision. Between
+# changes a fallback tick fires when the active source is predicted to be
+# getting close to a threshold (see predict.py), or after CHECK_INTERVAL
+# while there is no rate estimate yet.
+
+CONTROLLER_WAKE_EVENTS = {"battery", "telemetry", "sensors", "mode", "thresholds"}
+
+_controller_wake = Event()
+_controller_wake_time = None  # perf_counter() of the first unhandled change
+_controller_worker = None
+_controller_latencies = deque(maxlen=CONTROLLER_LATENCY_SAMPLES)
+controller_stats = {
+    "wakeups": 0,
+    "ticks": 0,
+    "commands": 0,
+    "last_state": None,
+    "last_pct": None,
+    "rate_pct_per_min": None,
+    "next_check_s": None
+}
+_rate_policy = TelemetryRatePolicy()
+_rates = None  # predict.RateEstimator, created on the first AUTO pass so numpy stays off the startup path
+_next_check = None  # seconds until the next fallback tick; None = CHECK_INTERVAL
+
+def rate_estimator():
+    global _rates
+    if _rates is None:
+        from predict import RateEstimator
+        _rates = RateEstimator()
+    return _rates
+
+def forget_rate(source):
+    """Drop a sensor's samples once it is removed or expires, so the estimator only holds live sources."""
+    if _rates is not None:
+        _rates.remove(source)
+
+def is_controller_event(event, data):
+    """Whether a broker event can change the AUTO decision."""
+    return event in CONTROLLER_WAKE_EVENTS or (
+        event == "sensor" and data.get("source") == ACTIVE_SENSOR_SOURCE
+    )
+
+def _on_state_change(event, data):
+    global _controller_wake_time
+    if is_controller_event(event, data) and not _controller_wake.is_set():
+        _controller_wake_time = time.perf_counter()
+        _controller_wake.set()
+
+broker.add_listener(_on_state_change)
+
+def controller_step(last_state):
+    """Run one AUTO decision and return the new relay state."""
+    # Read current mode (updated by /api/mode endpoint)
+    mode = current_mode
+    if mode != 'AUTO':
+        # Manual mode - reset state
+        if last_state is not None:
+            controller_log.info("Switched to MANUAL, resetting state")
+        return None
+
+    # Determine which battery percentage to use
+    pct = None
+    source_name = "unknown"
+    active = ACTIVE_SENSOR_SOURCE
+
+    if active:
+        # Use external sensor, but only while it keeps reporting
+        pct = SENSOR_SOURCES.fresh_percentage(active)
+        if pct is None:
+            controller_log.warning("Sensor '%s' silent for >%ss - holding %s", active, SENSOR_STALE_AFTER, last_state)
+            return last_state
+        source_name = active
+        controller_stats["last_pct"] = pct
+    else:
+        # Use laptop battery (latest sample, no psutil call here)
+        b = latest_battery_payload()
+        if b is None:
+            controller_log.warning("Battery not detected")
+            return last_state
+        pct = b["status"]["percentage"]
+        source_name = "laptop_battery"
+        controller_stats["last_pct"] = pct
+
+    rate_estimator().add(source_name, pct)
+
+    controller_log.debug("%s: %s%%, last state: %s, thresholds: %s%%-%s%%",
+                         source_name, pct, last_state, LOW_THRESHOLD, HIGH_THRESHOLD)
+
+    # Battery low - turn ON
+    if pct <= LOW_THRESHOLD and last_state != 'ON':
+        controller_log.info("%s %s%% <= %s%% -> Sending ON command", source_name, pct, LOW_THRESHOLD)
+        result = send_command('ON')
+        rate_estimator().reset(source_name)  # charging now; the discharge slope no longer applies
+        publish("ssr", {"state": "ON", "source": "auto"})
+        controller_stats["commands"] += 1
+        controller_log.debug("ON result: %s", result)
+        return 'ON'
+
+    # Battery high - turn OFF
+    if pct >= HIGH_THRESHOLD and last_state != 'OFF':
+        controller_log.info("%s %s%% >= %s%% -> Sending OFF command", source_name, pct, HIGH_THRESHOLD)
+        result = send_command('OFF')
+        rate_estimator().reset(source_name)
+        publish("ssr", {"state": "OFF", "source": "auto"})
+        controller_stats["commands"] += 1
+        controller_log.debug("OFF result: %s", result)
+        return 'OFF'
+
+    # In between thresholds - stay same state
+    if last_state:
+        controller_log.debug("%s %s%% - holding %s", source_name, pct, last_state)
+    return last_state
+
+def adapt_telemetry_rate():
+    """Faster board telemetry near an AUTO decision point, slower while things are steady.
+
+    In AUTO the percentage is the AUTO source's (controller_stats["last_pct"],
+    i.e. the laptop or an external sensor), not the board's own reading: the
+    board should report quickly when the relay is about to be switched, and
+    that is decided by the source. Outside AUTO the board's reading is used.
+    """
+    if not is_connected():
+        return
+    board = get_battery_data()
+    auto = current_mode == "AUTO"
+    pct = controller_stats["last_pct"] if auto else None
+    if pct is None and board.get("timestamp") is not None:
+        pct = board.get("percentage")
+    interval = _rate_policy.next_interval(
+        get_telemetry_interval(),
+        pct,
+        board.get("temperature") if board.get("timestamp") is not None else None,
+        (LOW_THRESHOLD, HIGH_THRESHOLD) if auto else None
+    )
+    if interval is not None:
+        controller_log.info("Telemetry interval -> %s ms", interval)
+        set_telemetry_interval(interval)
+
+def schedule_next_check():
+    """Time the next fallback tick from the active source's rate and distance to a threshold."""
+    global _next_check
+    pct = controller_stats["last_pct"]
+    if current_mode != "AUTO" or pct is None or _rates is None:
+        _next_check = None
+        controller_stats["rate_pct_per_min"] = controller_stats["next_check_s"] = None
+        return
+    from predict import next_check_in
+    rate = _rates.rate(ACTIVE_SENSOR_SOURCE or "laptop_battery")
+    _next_check = next_check_in(pct, rate, LOW_THRESHOLD, HIGH_THRESHOLD, None)
+    controller_stats["rate_pct_per_min"] = round(rate * 60, 3) if rate is not None else None
+    controller_stats["next_check_s"] = round(_next_check, 1) if _next_check is not None else None
+
+def next_check_interval():
+    """Seconds the controller may sleep before its next fallback tick."""
+    return CHECK_INTERVAL if _next_check is None else _next_check
+
+def run_controller_once(woke, last_state):
+    """One controller pass with bookkeeping; returns the new relay state."""
+    global _controller_wake_time
+    changed_at, _controller_wake_time = _controller_wake_time, None
+    started = time.perf_counter()
+    if woke:
+        controller_stats["wakeups"] += 1
+    else:
+        controller_stats["ticks"] += 1
+
+    try:
+        last_state = controller_step(last_state)
+        adapt_telemetry_rate()
+        schedule_next_check()
+    except Exception as e:
+        controller_log.exception("Error: %s", e)
+
+    controller_stats["last_state"] = last_state
+    finished = time.perf_counter()
+    CONTROLLER_PASS_SECONDS.observe(finished - started)
+    if changed_at is not None:
+        CONTROLLER_DECISION_SECONDS.observe(finished - changed_at)
+        _controller_latencies.append((finished - changed_at) * 1000)
+    return last_state
+
+def record_tick_jitter(waited_from, interval):
+    """A fallback tick fired; record how far past its interval it was."""
+    CONTROLLER_TICK_JITTER.observe(max(time.perf_counter() - waited_from - interval, 0.0))
+
+def controller_loop():
+    """Background controller to support AUTO mode when backend manages the relay."""
+    last_state = None
+    while True:
+        waited_from = time.perf_counter()
+        interval = next_check_interval()
+        woke = _controller_wake.wait(interval)
+        _controller_wake.clear()
+        if not woke:
+            record_tick_jitter(waited_from, interval)
+        last_state = run_controller_once(woke, last_state)
+
+def start_controller():
+    global _controller_worker
+    if not _alive(_controller_worker):
+        _controller_worker = Thread(target=controller_loop, name="controller", daemon=True)
+        _controller_worker.start()
+
+def controller_status_payload():
+    latencies = sorted(_controller_latencies)
+    def pct(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)], 3) if latencies else None
+    return {
+        "mode": current_mode,
+        "running": _alive(_controller_worker),
+        **controller_stats,
+        "decision_latency_ms": {
+            "samples": len(latencies),
+            "p50": pct(0.5),
+            "p99": pct(0.99),
+            "max": round(latencies[-1], 3) if latencies else None
+        }
+    }
+
+@app.route('/api/controller/status', methods=['GET'])
+def api_controller_status():
+    """AUTO controller counters and change-to-decision latency"""
+    return jsonify(controller_status_payload())
+
+
+@add_collector
+def _app_metrics():
+    yield "controller_passes_total", "counter", "Controller passes by trigger", [
+        ({"trigger": "change"}, controller_stats["wakeups"]),
+        ({"trigger": "tick"}, controller_stats["ticks"])]
+    yield "controller_commands_total", "counter", "Relay commands sent by the AUTO controller", [
+        ({}, controller_stats["commands"])]
+    yield "controller_next_check_seconds", "gauge", "Predicted wait before the next fallback tick", [
+        ({}, next_check_interval())]
+    yield "battery_rate_percent_per_minute", "gauge", "Least-squares charge (+) / discharge (-) rate of the AUTO source", [
+        ({}, controller_stats["rate_pct_per_min"])]
+    yield "sse_subscribers", "gauge", "Connected /api/stream clients", [({}, broker.subscriber_count())]
+    yield "sensor_sources", "gauge", "Registered external sensors", [({}, len(SENSOR_SOURCES))]
+    yield "log_records_dropped_total", "counter", "Log records dropped because the writer fell behind", [
+        ({}, log_stats["dropped"])]
+    yield "log_records_suppressed_total", "counter", "Log records held back by the per-subsystem rate limit", [
+        ({}, log_stats["suppressed"])]
+    yield "broker_events_total", "counter", "State changes published since start", [({}, broker.version)]
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Counters and latency histograms in Prometheus text format"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+def call_wsgi(environ):
+    """Run the app for one request outside a WSGI server; returns (status, headers, body)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = status
+        started["headers"] = headers
+
+    result = app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], body
+
+def init_state():
+    """Startup shared by every runtime: logging, storage, health, sensors and the initial broker state."""
+    setup_logging()
     init_db()
+    start_health_refresher()
+    SENSOR_SOURCES.start_sweeper(expire_sensors)
+    publish("mode", {"mode": current_mode})
+    publish("thresholds", thresholds_payload())
+    publish("sensors", sensor_list_payload())
+
+def connect_serial():
     try:
-        init_serial()  # auto-detect port
+        init_serial(SERIAL_PORT_OVERRIDE)  # None = auto-detect port
     except Exception as e:
-        print(f"[WARNING] Could not connect to serial: {e}")
-        print("[INFO] Flask app will still run but serial commands will fail")
-    
-    Thread(target=read_serial, daemon=True).start()
+        server_log.warning("Could not connect to serial: %s", e)
+        server_log.info("Flask app will still run; retrying the board in the background")
+        keep_reconnecting()
+        return
+    take_relay_control()
 
-    # background controller loop to support AUTO mode when backend manages the relay
-    def controller_loop():
-        global current_mode, LOW_THRESHOLD, HIGH_THRESHOLD, CHECK_INTERVAL, ACTIVE_SENSOR_SOURCE, SENSOR_SOURCES
-        last_state = None
-        while True:
-            try:
-                # Read current mode (updated by /api/mode endpoint)
-                mode = current_mode
-                if mode == 'AUTO':
-                    # Determine which battery percentage to use
-                    pct = None
-                    source_name = "unknown"
-                    
-                    if ACTIVE_SENSOR_SOURCE and ACTIVE_SENSOR_SOURCE in SENSOR_SOURCES:
-                        # Use external sensor
-                        pct = SENSOR_SOURCES[ACTIVE_SENSOR_SOURCE]["percentage"]
-                        source_name = ACTIVE_SENSOR_SOURCE
-                        print(f"[CONTROLLER] AUTO mode - Using external sensor '{source_name}': {pct}%")
-                    else:
-                        # Use laptop battery
-                        b = psutil.sensors_battery()
-                        if b is None:
-                            print('[CONTROLLER] Battery not detected')
-                            time.sleep(CHECK_INTERVAL)
-                            continue
-                        pct = b.percent
-                        source_name = "laptop_battery"
-                        print(f"[CONTROLLER] AUTO mode - Using laptop battery: {pct}%")
-                    
-                    print(f"[CONTROLLER] {source_name}: {pct}%, Last state: {last_state}, Thresholds: {LOW_THRESHOLD}%-{HIGH_THRESHOLD}%")
-                    
-                    # Battery low - turn ON
-                    if pct <= LOW_THRESHOLD and last_state != 'ON':
-                        print(f"[CONTROLLER] {source_name} {pct}% <= {LOW_THRESHOLD}% -> Sending ON command")
-                        result = send_command('ON')
-                        print(f"[CONTROLLER] ON result: {result}")
-                        last_state = 'ON'
-                    
-                    # Battery high - turn OFF
-                    elif pct >= HIGH_THRESHOLD and last_state != 'OFF':
-                        print(f"[CONTROLLER] {source_name} {pct}% >= {HIGH_THRESHOLD}% -> Sending OFF command")
-                        result = send_command('OFF')
-                        print(f"[CONTROLLER] OFF result: {result}")
-                        last_state = 'OFF'
-                    
-                    # In between thresholds - stay same state
-                    else:
-                        if last_state:
-                            print(f"[CONTROLLER] {source_name} {pct}% - holding {last_state}")
-                else:
-                    # Manual mode - reset state
-                    if last_state is not None:
-                        print(f"[CONTROLLER] Switched to MANUAL, resetting state")
-                        last_state = None
-                
-                time.sleep(CHECK_INTERVAL)
-            except Exception as e:
-                print('[CONTROLLER] Error:', e)
-                import traceback
-                traceback.print_exc()
-                time.sleep(CHECK_INTERVAL)
-
-    Thread(target=controller_loop, daemon=True).start()
-
-    print("[Flask] Starting server on http://localhost:5000")
-    app.run(port=5000, debug=False)
+def take_relay_control():
+    """Send the current mode: any MODE turns off the firmware's own charge control, so only the backend drives the relay."""
+    send_command(f"MODE:{current_mode}", wait=False)
+
+def restore_board_state(connection):
+    """The board was reopened after a disconnect (and has rebooted): put back mode and relay."""
+    send_command(f"MODE:{current_mode}")
+    ssr = broker.latest("ssr")
+    if ssr:
+        send_command(ssr["state"])
+    mode_log.info("Restored %s mode and relay %s after reconnect", current_mode, ssr["state"] if ssr else "unchanged")
+
+set_reconnect_handler(restore_board_state)
+
+def connect_serial_in_background():
+    """Open the board without holding up the HTTP server; /api/serial/status shows when it's up."""
+    Thread(target=connect_serial, name="serial-connect", daemon=True).start()
+
+
+if __name__ == "__main__":
+    init_state()
+    start_battery_sampler()
+    start_reader()  # attach first, so the ready banner is read as soon as the port opens
+    connect_serial_in_background()
+    start_controller()
+
+    server_log.info("Starting server on http://localhost:5000")
+    # threaded: each /api/stream subscriber holds a worker thread
+    app.run(port=5000, debug=False, threaded=True)
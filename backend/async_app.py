@@ -0,0 +1,303 @@
+"""asyncio runtime for the backend: python async_app.py instead of python app.py.
+
+Serves the same Flask routes from one event loop. Serial ports are read with
+loop.add_reader, /api/stream clients are plain coroutines fed by the broker,
+and the battery sampler and AUTO controller are tasks. Flask views still run
+synchronously, on a small fixed pool, since some wait for firmware acks.
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import app as backend
+import serial_handler
+from events import broker
+from log import get_logger
+from config import READ_CHUNK_SIZE, SAMPLE_INTERVAL, SSE_QUEUE_SIZE, SSE_HEARTBEAT
+from config import ASYNC_HTTP_WORKERS, ASYNC_MAX_REQUEST
+
+HOST = "127.0.0.1"
+PORT = 5000
+
+log = get_logger("asyncio")
+
+
+class AsyncSerialMultiplexer:
+    """Drop-in for serial_handler.SerialMultiplexer that reads ports on the event loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._connections = set()
+        self._watched = {}  # connection -> (fd, port)
+
+    @staticmethod
+    def supported():
+        return os.name == "posix"
+
+    def add(self, connection):
+        connection.reading = True
+        self.loop.call_soon_threadsafe(self._add, connection)
+
+    def remove(self, connection):
+        connection.reading = False
+        self.loop.call_soon_threadsafe(self._remove, connection)
+
+    def refresh(self):
+        self.loop.call_soon_threadsafe(self._sync)
+
+    def _add(self, connection):
+        self._connections.add(connection)
+        self._sync()
+
+    def _remove(self, connection):
+        self._connections.discard(connection)
+        self._sync()
+
+    def _unwatch(self, connection):
+        fd, _ = self._watched.pop(connection)
+        self.loop.remove_reader(fd)
+
+    def _sync(self):
+        for connection, (_, port) in list(self._watched.items()):
+            if connection not in self._connections or connection.ser is not port:
+                self._unwatch(connection)
+        for connection in self._connections:
+            port = connection.ser
+            if port is None or connection in self._watched:
+                continue
+            try:
+                fd = port.fileno()
+                self.loop.add_reader(fd, self._on_readable, connection, port)
+            except (OSError, ValueError) as e:
+                serial_handler.log.error("%s: cannot watch port: %s", connection.name, e)
+                continue
+            self._watched[connection] = (fd, port)
+
+    def _on_readable(self, connection, port):
+        if port is not connection.ser:
+            self._sync()  # reconnected
+            return
+        try:
+            chunk = port.read(min(max(port.in_waiting, 1), READ_CHUNK_SIZE))
+        except Exception as e:
+            serial_handler.log.error("%s: read error: %s", connection.name, e)
+            self._unwatch(connection)
+            connection.connection_lost(e, port)  # hand it to the reconnect supervisor, as the threaded reader does
+            return
+        if chunk:
+            connection.feed(chunk)
+
+
+class LoopQueue:
+    """Broker subscriber queue that hands messages to an asyncio.Queue on the loop."""
+
+    def __init__(self, loop, maxsize=SSE_QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            pass  # loop closed
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def _put(self, message):
+        if self.queue.full():
+            # Slow consumer: drop its oldest message, as the threaded server does
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+# ===== HTTP =====
+
+_views = ThreadPoolExecutor(max_workers=ASYNC_HTTP_WORKERS, thread_name_prefix="http-view")
+# Background work gets its own threads so it never queues behind slow requests
+_sampler_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="battery-sampler")
+_controller_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="controller")
+
+
+def build_environ(method, target, version, headers, body, peer):
+    path, _, query = target.partition("?")
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote(path, encoding="latin-1"),
+        "QUERY_STRING": query,
+        "SERVER_NAME": HOST,
+        "SERVER_PORT": str(PORT),
+        "SERVER_PROTOCOL": version,
+        "REMOTE_ADDR": peer[0] if peer else "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    for name, value in headers.items():
+        key = name.upper().replace("-", "_")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            environ["HTTP_" + key] = value
+    return environ
+
+
+async def read_request(reader):
+    """Parse one HTTP/1.x request; returns None at end of connection."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, version = line.decode("latin-1").split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().title()] = value.strip()
+
+    length = int(headers.get("Content-Length") or 0)
+    if length > ASYNC_MAX_REQUEST:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, version, headers, body
+
+
+async def stream_events(writer):
+    """/api/stream as a coroutine: current state on connect, then only changes."""
+    subscriber = LoopQueue(asyncio.get_running_loop())
+    broker.subscribe(subscriber)
+    try:
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"X-Accel-Buffering: no\r\n"
+                     b"Access-Control-Allow-Origin: *\r\n"
+                     b"Connection: close\r\n\r\n"
+                     b"retry: 2000\n\n")
+        for message in broker.current_messages():
+            writer.write(message.encode())
+        await writer.drain()
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                message = ": keep-alive\n\n"
+            writer.write(message.encode())
+            await writer.drain()
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def handle_client(reader, writer):
+    loop = asyncio.get_running_loop()
+    peer = writer.get_extra_info("peername")
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                break
+            if request is None:
+                break
+            method, target, version, headers, body = request
+
+            if method == "GET" and target.partition("?")[0] == "/api/stream":
+                await stream_events(writer)
+                break
+
+            environ = build_environ(method, target, version, headers, body, peer)
+            status, response_headers, payload = await loop.run_in_executor(_views, backend.call_wsgi, environ)
+
+            keep_alive = version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+            head = [f"HTTP/1.1 {status}"]
+            head += [f"{name}: {value}" for name, value in response_headers if name.lower() != "content-length"]
+            head.append(f"Content-Length: {len(payload)}")
+            head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    except Exception as e:
+        log.error("Error serving %s: %s", peer, e)
+    finally:
+        writer.close()
+
+
+# ===== Background tasks =====
+
+def sample_battery():
+    backend.publish("battery", backend.build_battery_payload())
+
+
+async def battery_sampler():
+    """Same job as app.battery_sampler_loop, as a task; psutil and sensor reads stay off the loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(_sampler_pool, sample_battery)
+        except Exception as e:
+            backend.sampler_log.error("Error: %s", e)
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def controller():
+    """AUTO controller as a task, woken by the same broker events as app.controller_loop."""
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+
+    def on_change(event, data):
+        if backend.is_controller_event(event, data):
+            loop.call_soon_threadsafe(wake.set)
+
+    broker.add_listener(on_change)
+    last_state = None
+    while True:
+        waited_from = time.perf_counter()
+        interval = backend.next_check_interval()
+        try:
+            await asyncio.wait_for(wake.wait(), interval)
+            woke = True
+        except asyncio.TimeoutError:
+            woke = False
+            backend.record_tick_jitter(waited_from, interval)
+        wake.clear()
+        # A decision may wait on the firmware's ack; keep that off the loop, and out of the views' queue
+        last_state = await loop.run_in_executor(_controller_pool, backend.run_controller_once, woke, last_state)
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    serial_handler.use_multiplexer(AsyncSerialMultiplexer(loop))
+
+    backend.init_state()
+    backend._sampler_worker = loop.create_task(battery_sampler())
+    serial_handler.start_reader()
+    # Not awaited: the server starts while the board boots
+    loop.run_in_executor(None, backend.connect_serial)
+    backend._controller_worker = loop.create_task(controller())
+
+    server = await asyncio.start_server(handle_client, HOST, PORT)
+    log.info("Starting server on http://localhost:%d", PORT)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,239 @@
+"""Micro-benchmarks for backend hot paths.
+
+    python benchmarks.py            run and compare with benchmarks_baseline.json
+    python benchmarks.py --save     run and record a new baseline
+    python benchmarks.py -k serial  only benchmarks whose name contains "serial"
+
+Serial ports and psutil are replaced by in-process fakes and the database
+lives in a temporary directory, so numbers depend only on this code and
+this machine. Baselines are per machine; don't compare across hosts.
+Exits with status 1 when a benchmark regresses beyond --tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+
+import psutil
+import app
+import database
+from serial_handler import SerialConnection, encode_frame, FRAME_SYNC, FRAME_TELEMETRY, FRAME_REPLY
+from serial_handler import COMMAND_STRUCT, REPLY_STRUCT, TELEMETRY_STRUCT
+
+# Latency changes smaller than this are scheduler noise, not regressions
+NOISE_FLOOR_US = 20
+
+FakeBattery = namedtuple("FakeBattery", "percent secsleft power_plugged")
+
+
+class FakeSerial:
+    """Stands in for serial.Serial: answers every JSON or binary command at once."""
+    is_open = True
+    in_waiting = 0
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def write(self, data):
+        if data[:2] == FRAME_SYNC:
+            cmd_id = COMMAND_STRUCT.unpack_from(data, 4)[0]
+            reply = encode_frame(FRAME_REPLY, REPLY_STRUCT.pack(cmd_id, 0, 0, 50))
+        else:
+            cmd_id = json.loads(data)["id"]
+            reply = b'{"status":"success","id":%d}\r\n' % cmd_id
+        self.connection.feed(reply)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def fake_connection(protocol="json"):
+    connection = SerialConnection(f"bench-{protocol}")
+    connection.ser = FakeSerial(connection)
+    connection.port = "fake"
+    connection.reading = True
+    connection.protocol = protocol
+    connection.queue.min_interval = 0
+    return connection
+
+
+# ===== Benchmarks: setup() returns the operation to time =====
+
+def bench_send_command_json():
+    connection = fake_connection("json")
+    return lambda: connection.send_command("PING")
+
+
+def bench_send_command_binary():
+    connection = fake_connection("binary")
+    return lambda: connection.send_command("PING")
+
+
+def bench_serial_parse_json():
+    connection = SerialConnection("bench-parse")
+    line = (b'{"percentage":57,"voltage":3.87,"temperature":31.4,'
+            b'"isCharging":true,"ssrStatus":true,"autoCharge":false}\r\n')
+    return lambda: connection.feed(line)
+
+
+def bench_serial_parse_binary():
+    connection = SerialConnection("bench-parse")
+    frame = encode_frame(FRAME_TELEMETRY, TELEMETRY_STRUCT.pack(57, 3870, 314, 3))
+    return lambda: connection.feed(frame)
+
+
+def bench_db_log_data():
+    sample = {"percentage": 57, "voltage": 3.87, "temperature": 31.4}
+    return lambda: database.log_data(sample)
+
+
+def bench_db_flush_200():
+    conn = database.connect()
+    now = time.time()
+    rows = [(now + i, 57, 3.87, 31.4) for i in range(200)]
+    return lambda: database.writer._flush(conn, rows)
+
+
+def bench_api_battery():
+    client = app.app.test_client()
+    return lambda: client.get("/api/battery")
+
+
+def bench_api_sensor_update():
+    client = app.app.test_client()
+    counter = iter(range(10 ** 9))
+    return lambda: client.post("/api/sensor/update", json={
+        "source": f"bench-{next(counter) % 100}", "percentage": 50, "device_type": "phone"})
+
+
+def bench_controller_decision():
+    app.current_mode = "AUTO"
+    app.ACTIVE_SENSOR_SOURCE = "bench-controller"
+    app.send_command = lambda cmd, *args, **kwargs: {"success": True, "cmd": cmd}
+    state = {"last": None, "flip": False}
+
+    def step():
+        # Alternate across both thresholds so every call makes a decision
+        state["flip"] = not state["flip"]
+        app.SENSOR_SOURCES.update("bench-controller", 10 if state["flip"] else 90)
+        state["last"] = app.run_controller_once(True, state["last"])
+    return step
+
+
+BENCHMARKS = [
+    ("send_command_json", bench_send_command_json, 2000),
+    ("send_command_binary", bench_send_command_binary, 2000),
+    ("serial_parse_json", bench_serial_parse_json, 50000),
+    ("serial_parse_binary", bench_serial_parse_binary, 50000),
+    ("db_log_data", bench_db_log_data, 5000),
+    ("db_flush_200", bench_db_flush_200, 200),
+    ("api_battery", bench_api_battery, 3000),
+    ("api_sensor_update", bench_api_sensor_update, 3000),
+    ("controller_decision", bench_controller_decision, 5000),
+]
+
+
+def measure(op, iterations, warmup=None):
+    """Time op individually; returns ops/sec and p50/p99 latency in microseconds."""
+    for _ in range(warmup if warmup is not None else max(iterations // 10, 1)):
+        op()
+    samples = []
+    clock = time.perf_counter_ns
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = clock()
+        op()
+        samples.append(clock() - t0)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "ops_per_sec": round(iterations / elapsed, 1),
+        "p50_us": round(samples[len(samples) // 2] / 1000, 2),
+        "p99_us": round(samples[min(int(len(samples) * 0.99), len(samples) - 1)] / 1000, 2),
+        "iterations": iterations
+    }
+
+
+def compare(result, base, tolerance):
+    """Regression messages for one benchmark (p99 gets double the tolerance, it is noisier)."""
+    problems = []
+    if result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+        problems.append(f"ops/sec {base['ops_per_sec']} -> {result['ops_per_sec']}")
+    if result["p50_us"] > max(base["p50_us"] * (1 + tolerance), base["p50_us"] + NOISE_FLOOR_US):
+        problems.append(f"p50 {base['p50_us']}us -> {result['p50_us']}us")
+    if result["p99_us"] > max(base["p99_us"] * (1 + 2 * tolerance), base["p99_us"] + NOISE_FLOOR_US):
+        problems.append(f"p99 {base['p99_us']}us -> {result['p99_us']}us")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend hot-path micro-benchmarks")
+    parser.add_argument("--save", action="store_true", help="record results as the new baseline")
+    parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks containing this text")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply iteration counts")
+    args = parser.parse_args()
+
+    # The benchmarks write battery_log.db relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="battery-bench-"))
+    # Warnings from the fakes (e.g. no sensor data) would be formatted on every call
+    logging.disable(logging.WARNING)
+    psutil.sensors_battery = lambda: FakeBattery(percent=57, secsleft=5400, power_plugged=False)
+    database.init_db()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    regressions = 0
+    print(f"{'benchmark':<22}{'ops/sec':>12}{'p50 us':>10}{'p99 us':>10}  vs baseline")
+    for name, setup, iterations in BENCHMARKS:
+        if args.pattern not in name:
+            continue
+        op = setup()
+        result = measure(op, max(int(iterations * args.scale), 10))
+        results[name] = result
+
+        base = baseline.get(name)
+        if base is None:
+            verdict = "(no baseline)"
+        else:
+            problems = compare(result, base, args.tolerance)
+            regressions += bool(problems)
+            change = (result["ops_per_sec"] / base["ops_per_sec"] - 1) * 100
+            verdict = f"{change:+.1f}%" + (f"  REGRESSION: {'; '.join(problems)}" if problems else "")
+        print(f"{name:<22}{result['ops_per_sec']:>12.1f}{result['p50_us']:>10.2f}{result['p99_us']:>10.2f}  {verdict}")
+
+    database.writer.stop()
+
+    if args.save:
+        saved = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                saved = json.load(f).get("results", {})
+        saved.update(results)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({
+                "machine": platform.node(),
+                "python": platform.python_version(),
+                "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": saved
+            }, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {BASELINE_FILE}")
+        return 0
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import time
 import psutil
 import serial
+from serial_ready import wait_for_ready
 
 # ===== CONFIG =====
 PORT = "COM3"
@@ -22,7 +23,7 @@ def main():
     global current_state
 
     ser = serial.Serial(PORT, BAUD, timeout=1)
-    time.sleep(2)
+    wait_for_ready(ser)
 
     print("✓ Connected to Arduino")
 
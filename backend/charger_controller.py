@@ -3,6 +3,7 @@ from config import BAUD_RATE, TIMEOUT, SERIAL_PORT, DB_NAME
 import time
 import psutil
 import serial
+from serial_ready import wait_for_ready
 
 # ===== CONFIG =====
 
@@ -116,7 +117,7 @@ def auto_mode(ser):
 
 def main():
     ser = serial.Serial(PORT, BAUD, timeout=1)
-    time.sleep(2)
+    wait_for_ready(ser)
 
     print("=== SMART CHARGER CONTROLLER ===")
     print("Select mode:")
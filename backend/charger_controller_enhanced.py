@@ -2,6 +2,7 @@ from config import BAUD_RATE, TIMEOUT, SERIAL_PORT, DB_NAME
 import time
 import psutil
 import serial
+from serial_ready import wait_for_ready
 
 
 
@@ -155,7 +156,8 @@ def main():
     
     try:
         ser = serial.Serial(PORT, BAUD, timeout=1)
-        time.sleep(2)
+        if not wait_for_ready(ser):
+            print("! No ready banner from Arduino, continuing anyway")
         print(f"✓ Arduino connected on {PORT}")
     except Exception as e:
         print(f"✗ Error connecting to {PORT}: {e}")
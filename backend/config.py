@@ -1,6 +1,105 @@
-  # config.py
+# config.py
+import os
+
 BAUD_RATE = 115200
 TIMEOUT = 1
 SERIAL_PORT = 'COM3'
+SERIAL_PORT_OVERRIDE = os.environ.get("BATTERY_SERIAL_PORT")  # e.g. the simulator's pty; None = auto-detect
 
 DB_NAME = "battery_log.db"
+
+# Serial reader
+READ_CHUNK_SIZE = 4096       # max bytes pulled from the port per read
+MAX_LINE_LENGTH = 1024       # discard runaway lines without a newline
+RESPONSE_BUFFER_SIZE = 100   # non-telemetry lines kept for read_serial()
+SERIAL_PROTOCOL = "binary"   # ask the firmware for binary frames ("json" = never ask)
+SERIAL_READY_TIMEOUT = 3.0   # max wait for {"status":"ready"} after opening a port (Arduino boot is ~1.6 s)
+
+# Serial reconnect (lost or unplugged boards)
+RECONNECT_INITIAL = 0.5      # seconds before the first reopen attempt
+RECONNECT_MAX = 30           # backoff doubles up to this many seconds between attempts
+RECONNECT_HOTPLUG = True     # on Linux, also retry as soon as a tty is plugged in
+
+# Port discovery (/api/serial/ports, auto-detect)
+PORT_CACHE_TTL = 5.0         # seconds a port scan is reused; hotplug events invalidate it sooner
+
+# Database writer
+DB_QUEUE_SIZE = 10000        # pending rows before log_data starts dropping
+DB_BATCH_SIZE = 200          # flush when this many rows are buffered...
+DB_FLUSH_INTERVAL = 1.0      # ...or when the oldest buffered row is this old (seconds)
+
+# History API
+HISTORY_MAX_POINTS = 1500    # /api/history picks the finest resolution under this
+
+# Battery health (WMI on Windows)
+HEALTH_TTL = 300             # seconds between background health refreshes
+
+# Battery analytics from battery_logs (analytics.py)
+ANALYTICS_CHUNK_ROWS = 5000      # rows read per query
+ANALYTICS_REFRESH_ROWS = 500000  # rows one refresh may scan; the rest waits for the next one
+ANALYTICS_HYSTERESIS = 3         # percentage points against the trend that end a charge or discharge
+ANALYTICS_MAX_GAP = 600          # seconds without samples that break a cycle (board off or unplugged)
+ANALYTICS_FULL_DEPTH = 70        # points a discharge must span to count as a full cycle
+ANALYTICS_FIT_DEPTH = 20         # shallowest discharge used in the capacity fade fit
+ANALYTICS_REF_PCT = 50           # state of charge at which voltage curves are compared
+
+# Live updates (/api/stream)
+SAMPLE_INTERVAL = 1.0        # seconds between laptop battery samples
+SSE_QUEUE_SIZE = 100         # per-subscriber backlog before old events are dropped
+SSE_HEARTBEAT = 15           # seconds between keep-alive comments
+
+# AUTO controller
+CONTROLLER_LATENCY_SAMPLES = 200  # recent decision latencies kept for /api/controller/status
+
+# Serial commands
+COMMAND_TIMEOUT = 0.5        # seconds to wait for the firmware's reply per attempt
+COMMAND_RETRIES = 2          # resends (same correlation id) before giving up
+COMMAND_MIN_INTERVAL = 0.05  # minimum spacing between writes to the board
+COMMAND_QUEUE_WAIT = 2.0     # extra time a caller may wait behind queued commands
+
+# External sensors
+SENSOR_BATCH_MAX = 5000      # readings accepted per /api/sensor/batch request
+SENSOR_MAX_SOURCES = 10000   # registry refuses new sources beyond this
+SENSOR_HISTORY_SIZE = 32     # recent readings kept per sensor
+SENSOR_STALE_AFTER = 60      # seconds without a reading before AUTO stops trusting a sensor
+SENSOR_EXPIRE_AFTER = 600    # seconds without a reading before a sensor is dropped
+SENSOR_SWEEP_INTERVAL = 30   # seconds between expiry sweeps
+
+# Multi-charger devices (/api/devices)
+DEVICE_MAX = 64              # boards one backend will keep open
+DEVICE_CHECK_INTERVAL = 5    # seconds between fallback AUTO checks across all boards
+
+# asyncio runtime (async_app.py)
+ASYNC_HTTP_WORKERS = 16      # threads running Flask views; SSE streams don't use one
+ASYNC_MAX_REQUEST = 1048576  # largest request body accepted (bytes)
+
+# Multi-process serving (serve.py)
+SERVE_WORKERS = 0            # HTTP worker processes; 0 = one per CPU core
+STATE_MIRROR_QUEUE = 10000   # broker changes buffered per worker before it is resynced
+
+# Adaptive telemetry rate (firmware set_interval)
+TELEMETRY_FAST_MS = 500      # near a threshold, or running hot
+TELEMETRY_NORMAL_MS = 2000   # firmware default
+TELEMETRY_SLOW_MS = 10000    # steady and far from any threshold
+TELEMETRY_NEAR_MARGIN = 5    # percentage points from a threshold that count as near
+TELEMETRY_TEMP_WARN = 40     # degrees C that count as running hot
+TELEMETRY_TEMP_RISE = 1.0    # degrees C gained within TELEMETRY_STEADY_AFTER that count as rising
+TELEMETRY_STEADY_AFTER = 60  # seconds without a percentage change before slowing down
+TELEMETRY_RATE_HOLD = 10     # minimum seconds at a rate before slowing down again
+
+# Logging (log.py)
+LOG_LEVEL = os.environ.get("BATTERY_LOG_LEVEL", "INFO")  # e.g. "INFO,controller=DEBUG,serial=DEBUG"
+LOG_JSON = os.environ.get("BATTERY_LOG_JSON") == "1"     # one JSON object per line instead of text
+LOG_FILE = os.environ.get("BATTERY_LOG_FILE")            # also append to this file; None = console only
+LOG_QUEUE_SIZE = 10000       # records waiting for the writer thread before new ones are dropped
+LOG_RATE_LIMIT = 20          # records per second per subsystem (below ERROR)...
+LOG_RATE_BURST = 100         # ...after an initial burst of this many
+
+# Predictive AUTO scheduling (predict.py)
+PREDICT_WINDOW = 32          # samples per source kept for the least-squares rate fit
+PREDICT_MAX_AGE = 1800       # seconds; older samples are left out of the fit
+PREDICT_MIN_SAMPLES = 3      # fewer usable samples -> no prediction, plain check interval
+PREDICT_SAMPLE_SPACING = 10  # seconds between samples while the percentage is unchanged
+PREDICT_LEAD = 0.5           # look again after this fraction of the predicted time to a threshold
+PREDICT_MIN_INTERVAL = 1.0   # closest spacing of checks right before a crossing
+PREDICT_MAX_INTERVAL = 300   # longest idle between checks far from any threshold
@@ -1,5 +1,70 @@
+import atexit
+import queue
 import sqlite3
-from config import DB_NAME
+import time
+from threading import Thread, Lock
+from metrics import histogram, add_collector
+from log import get_logger
+from config import DB_NAME, DB_QUEUE_SIZE, DB_BATCH_SIZE, DB_FLUSH_INTERVAL, HISTORY_MAX_POINTS
+
+INSERT_SQL = """
+    INSERT INTO battery_logs (timestamp, percentage, voltage, temperature)
+    VALUES (?, ?, ?, ?)
+"""
+
+METRICS = ("percentage", "voltage", "temperature")
+
+# Rollup table name -> bucket width in seconds
+ROLLUPS = {
+    "minute": ("battery_rollup_minute", 60),
+    "hour": ("battery_rollup_hour", 3600)
+}
+
+log = get_logger("db")
+
+FLUSH_SECONDS = histogram("db_flush_seconds", "One batched insert plus rollup upserts")
+FLUSH_ROWS = histogram("db_flush_rows", "Rows written per flush", buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000))
+
+# Nominal spacing of raw samples (firmware default 2 s); only a first guess, see count_raw_rows
+RAW_SAMPLE_SECONDS = 2
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _rollup_columns():
+    cols = []
+    for m in METRICS:
+        cols += [f"{m}_count", f"{m}_sum", f"{m}_min", f"{m}_max"]
+    return cols
+
+
+ROLLUP_COLUMNS = _rollup_columns()
+
+
+def _rollup_upsert_sql(table):
+    updates = []
+    for m in METRICS:
+        updates.append(f"{m}_count = {m}_count + excluded.{m}_count")
+        updates.append(f"{m}_sum = coalesce({m}_sum, 0) + coalesce(excluded.{m}_sum, 0)")
+        updates.append(f"{m}_min = min(coalesce({m}_min, excluded.{m}_min), coalesce(excluded.{m}_min, {m}_min))")
+        updates.append(f"{m}_max = max(coalesce({m}_max, excluded.{m}_max), coalesce(excluded.{m}_max, {m}_max))")
+    placeholders = ", ".join("?" * (len(ROLLUP_COLUMNS) + 2))
+    return f"""
+        INSERT INTO {table} (bucket, samples, {", ".join(ROLLUP_COLUMNS)})
+        VALUES ({placeholders})
+        ON CONFLICT(bucket) DO UPDATE SET
+            samples = samples + excluded.samples,
+            {", ".join(updates)}
+    """
+
+
+def connect():
+    """Open a connection tuned for a single long-lived writer."""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
 
 def init_db():
     conn = sqlite3.connect(DB_NAME)
@@ -9,23 +74,269 @@ def init_db():
             id INTEGER PRIMARY KEY,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
             percentage REAL,
-            voltage REAL, 
+            voltage REAL,
             temperature REAL
         )
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_battery_logs_timestamp ON battery_logs (timestamp)")
+
+    for table, width in ROLLUPS.values():
+        metric_cols = ", ".join(f"{c} REAL" for c in ROLLUP_COLUMNS)
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER PRIMARY KEY, samples INTEGER, {metric_cols})")
+
+        # One-time backfill for databases that already hold raw rows
+        if cur.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+            aggregates = ", ".join(
+                f"count({m}), sum({m}), min({m}), max({m})" for m in METRICS
+            )
+            cur.execute(f"""
+                INSERT INTO {table} (bucket, samples, {", ".join(ROLLUP_COLUMNS)})
+                SELECT (CAST(strftime('%s', timestamp) AS INTEGER) / {width}) * {width} AS b,
+                       count(*), {aggregates}
+                FROM battery_logs WHERE timestamp IS NOT NULL GROUP BY b
+            """)
     conn.commit()
     conn.close()
 
+
+def _aggregate(rows, width):
+    """Fold (epoch, pct, volt, temp) rows into per-bucket rollup rows."""
+    buckets = {}
+    for row in rows:
+        bucket = int(row[0]) // width * width
+        acc = buckets.get(bucket)
+        if acc is None:
+            acc = buckets[bucket] = [bucket, 0] + [0, None, None, None] * len(METRICS)
+        acc[1] += 1
+        for i, value in enumerate(row[1:]):
+            if value is None:
+                continue
+            base = 2 + i * 4
+            acc[base] += 1
+            acc[base + 1] = value if acc[base + 1] is None else acc[base + 1] + value
+            acc[base + 2] = value if acc[base + 2] is None or value < acc[base + 2] else acc[base + 2]
+            acc[base + 3] = value if acc[base + 3] is None or value > acc[base + 3] else acc[base + 3]
+    return list(buckets.values())
+
+
+class LogWriter:
+    """Background writer: callers enqueue rows, one thread batches them into SQLite."""
+
+    _STOP = object()
+
+    def __init__(self, queue_size=DB_QUEUE_SIZE, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._lock = Lock()
+        self._upserts = {name: _rollup_upsert_sql(table) for name, (table, _) in ROLLUPS.items()}
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "errors": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, row):
+        """Queue a row without blocking; returns False if the queue is full."""
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+        self.stats["enqueued"] += 1
+        return True
+
+    def _flush(self, conn, rows):
+        start = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany(INSERT_SQL, [
+                    (time.strftime(TIMESTAMP_FORMAT, time.gmtime(r[0])),) + r[1:] for r in rows
+                ])
+                for name, (_, width) in ROLLUPS.items():
+                    conn.executemany(self._upserts[name], _aggregate(rows, width))
+            self.stats["written"] += len(rows)
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            log.error("Flush of %d rows failed: %s", len(rows), e)
+        elapsed = time.perf_counter() - start
+        FLUSH_SECONDS.observe(elapsed)
+        FLUSH_ROWS.observe(len(rows))
+        elapsed *= 1000
+        self.stats["flushes"] += 1
+        self.stats["last_flush_ms"] = round(elapsed, 3)
+        self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], round(elapsed, 3))
+
+    def _run(self):
+        conn = connect()
+        rows = []
+        deadline = None
+        stopping = False
+        try:
+            while not stopping:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is self._STOP:
+                    stopping = True
+                elif item is not None:
+                    rows.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                if rows and (stopping or len(rows) >= self.batch_size or time.monotonic() >= deadline):
+                    self._flush(conn, rows)
+                    rows = []
+                    deadline = None
+        finally:
+            conn.close()
+
+    def stop(self, timeout=5.0):
+        """Flush everything queued so far and stop the writer thread."""
+        if not self.is_running():
+            return
+        # Blocking put: the writer is draining, so room frees up quickly
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        return dict(self.stats, queue_depth=self.queue.qsize(), running=self.is_running())
+
+
+writer = LogWriter()
+
+
+@add_collector
+def _writer_metrics():
+    stats = writer.stats
+    for stat, name, help in (
+        ("enqueued", "db_rows_enqueued_total", "Rows accepted by log_data"),
+        ("written", "db_rows_written_total", "Rows committed to battery_logs"),
+        ("dropped", "db_rows_dropped_total", "Rows dropped because the queue was full"),
+        ("errors", "db_flush_errors_total", "Failed flushes"),
+    ):
+        yield name, "counter", help, [({}, stats[stat])]
+    yield "db_queue_depth", "gauge", "Rows waiting for the writer", [({}, writer.queue.qsize())]
+
+
 def log_data(data):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO battery_logs (percentage, voltage, temperature)
-        VALUES (?, ?, ?)
-    """, (
+    """Queue one sample for the background writer; never blocks on disk."""
+    writer.start()
+    return writer.submit((
+        time.time(),
         data.get("percentage"),
         data.get("voltage"),
         data.get("temperature")
     ))
-    conn.commit()
-    conn.close()
+
+
+def pick_resolution(start, end, raw_rows=None):
+    """Finest resolution whose point count for [start, end] fits in HISTORY_MAX_POINTS.
+
+    raw_rows is the number of logged rows in the range when known; without it
+    the raw row count is guessed from RAW_SAMPLE_SECONDS, which undercounts
+    while the telemetry rate is raised.
+    """
+    span = max(end - start, 0)
+    if (span / RAW_SAMPLE_SECONDS if raw_rows is None else raw_rows) <= HISTORY_MAX_POINTS:
+        return "raw"
+    for name, (_, width) in ROLLUPS.items():
+        if span / width <= HISTORY_MAX_POINTS:
+            return name
+    return "hour"
+
+
+def _timestamp_range(start, end):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(start)), time.strftime(TIMESTAMP_FORMAT, time.gmtime(end))
+
+
+def count_raw_rows(conn, start, end, limit=HISTORY_MAX_POINTS + 1):
+    """Rows logged in [start, end], counted up to limit (an index range scan that stops early)."""
+    return conn.execute("""
+        SELECT count(*) FROM (
+            SELECT 1 FROM battery_logs WHERE timestamp BETWEEN ? AND ? LIMIT ?
+        )
+    """, (*_timestamp_range(start, end), limit)).fetchone()[0]
+
+
+def query_history(start, end, resolution="auto"):
+    """Return samples between two epoch timestamps, raw or from a rollup table.
+
+    At most HISTORY_MAX_POINTS points are returned; when a range holds more,
+    the newest are kept and "truncated" is set.
+    """
+    conn = connect()
+    try:
+        if resolution == "auto":
+            resolution = pick_resolution(start, end)
+            if resolution == "raw":
+                resolution = pick_resolution(start, end, count_raw_rows(conn, start, end))
+
+        if resolution == "raw":
+            cur = conn.execute("""
+                SELECT CAST(strftime('%s', timestamp) AS INTEGER), percentage, voltage, temperature
+                FROM battery_logs
+                WHERE timestamp BETWEEN ? AND ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (*_timestamp_range(start, end), HISTORY_MAX_POINTS + 1))
+            points = [
+                {"timestamp": r[0], "percentage": r[1], "voltage": r[2], "temperature": r[3]}
+                for r in cur
+            ]
+        else:
+            table, width = ROLLUPS[resolution]
+            cur = conn.execute(f"""
+                SELECT bucket, samples, {", ".join(ROLLUP_COLUMNS)}
+                FROM {table}
+                WHERE bucket BETWEEN ? AND ?
+                ORDER BY bucket DESC
+                LIMIT ?
+            """, (int(start) // width * width, int(end), HISTORY_MAX_POINTS + 1))
+            points = []
+            for r in cur:
+                point = {"timestamp": r[0], "samples": r[1]}
+                for i, m in enumerate(METRICS):
+                    count, total, low, high = r[2 + i * 4: 6 + i * 4]
+                    point[m] = {
+                        "min": low,
+                        "max": high,
+                        "avg": round(total / count, 3) if count else None
+                    }
+                points.append(point)
+    finally:
+        conn.close()
+
+    truncated = len(points) > HISTORY_MAX_POINTS
+    points = points[:HISTORY_MAX_POINTS]
+    points.reverse()
+    return {"resolution": resolution, "from": start, "to": end, "truncated": truncated, "points": points}
+
+
+def get_writer_stats():
+    return writer.get_stats()
+
+
+def shutdown():
+    writer.stop()
+
+
+atexit.register(shutdown)
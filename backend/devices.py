@@ -0,0 +1,307 @@
+import os
+import time
+from threading import Thread, Event, Lock
+from serial_handler import SerialConnection, attach_reader, detach_reader, supervisor, default_connection
+from events import publish
+from log import get_logger
+from telemetry_rate import TelemetryRatePolicy
+from config import DEVICE_CHECK_INTERVAL, DEVICE_MAX, COMMAND_TIMEOUT
+
+log = get_logger("devices")
+
+
+class Device:
+    """One charger board: its serial connection plus its own mode and thresholds."""
+
+    def __init__(self, device_id, port, low_threshold=20, high_threshold=80, on_telemetry=None, on_reconnect=None):
+        self.id = device_id
+        self.mode = "MANUAL"
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.last_state = None
+        self.commands = 0
+        self.connection = SerialConnection(device_id, on_telemetry=on_telemetry, on_reconnect=on_reconnect)
+        self.rate_policy = TelemetryRatePolicy()
+        self.requested_port = port
+        self.connecting = True  # until the board has been heard from and the protocol negotiated
+
+    @property
+    def status(self):
+        if not self.connection.is_connected():
+            return "disconnected"
+        return "connecting" if self.connecting else "connected"
+
+    def to_dict(self):
+        connection = self.connection
+        return {
+            "id": self.id,
+            "port": connection.port or self.requested_port,
+            "connected": connection.is_connected(),
+            "status": self.status,
+            "protocol": connection.protocol,
+            "mode": self.mode,
+            "low_threshold": self.low_threshold,
+            "high_threshold": self.high_threshold,
+            "relay": self.last_state,
+            "telemetry_interval_ms": connection.interval_ms,
+            "telemetry": connection.telemetry,
+            "commands": self.commands,
+            "reader": dict(connection.reader_stats),
+            "serial": connection.get_command_stats()
+        }
+
+
+def same_port(a, b):
+    """True if two port paths name the same device (e.g. a /dev/serial/by-id link and its tty)."""
+    return bool(a and b) and os.path.realpath(a) == os.path.realpath(b)
+
+
+class DeviceManager:
+    """Keeps N boards open at once.
+
+    All ports are read by the shared serial multiplexer and every device's
+    AUTO decision runs on one controller thread, woken by telemetry from
+    any board; only the boards that changed are re-evaluated. Between
+    changes each board is checked again when its own rate predicts it is
+    nearing a threshold (predict.py), with check_interval as the fallback.
+    """
+
+    def __init__(self, check_interval=DEVICE_CHECK_INTERVAL, max_devices=DEVICE_MAX):
+        self.check_interval = check_interval
+        self.max_devices = max_devices
+        self._devices = {}
+        self._lock = Lock()
+        self._dirty = set()
+        self._wake = Event()
+        self._thread = None
+        self._rates = None  # predict.RateEstimator over all boards, created by start()
+        self._due = {}  # device_id -> monotonic time of its next check
+
+    # ----- registry -----
+
+    def add_device(self, device_id, port):
+        """Open port as device_id; raises ValueError for bad ids, OSError for bad ports.
+
+        Returns once the port is open. Waiting for the board's ready banner and
+        negotiating the protocol happen in the background; until then the
+        device reports status "connecting".
+        """
+        with self._lock:
+            if device_id in self._devices:
+                raise ValueError(f"device '{device_id}' already exists")
+            if len(self._devices) >= self.max_devices:
+                raise ValueError(f"device limit reached ({self.max_devices})")
+            if same_port(default_connection.port, port):
+                raise ValueError(f"port {port} is the main board's port")
+            for other in self._devices.values():
+                if same_port(other.connection.port or other.requested_port, port):
+                    raise ValueError(f"port {port} already used by '{other.id}'")
+            device = Device(device_id, port,
+                            on_telemetry=lambda snapshot, changed: self._on_telemetry(device_id, snapshot, changed),
+                            on_reconnect=lambda connection: self._restore(device_id))
+            self._devices[device_id] = device
+
+        try:
+            device.connection.open(port)
+        except Exception as e:
+            with self._lock:
+                self._devices.pop(device_id, None)
+            raise OSError(f"could not open {port}: {e}")
+
+        attach_reader(device.connection)
+        supervisor.start()
+        self.start()
+        Thread(target=self._finish_connect, args=(device,), name=f"device-connect-{device_id}", daemon=True).start()
+        publish("devices", self.list_payload())
+        return device
+
+    def _finish_connect(self, device):
+        """Wait for the board and negotiate its protocol, off the request thread."""
+        device.connection.wait_ready()
+        device.connection.negotiate()
+        # Any MODE turns off the firmware's own charge control, so only this backend drives the relay
+        device.connection.send_command(f"MODE:{device.mode}", wait=False)
+        device.connecting = False
+        if self.get(device.id) is not device:
+            return  # removed meanwhile
+        log.info("%s connected on %s", device.id, device.connection.port)
+        publish("devices", self.list_payload())
+        self.mark(device.id)
+
+    def remove_device(self, device_id):
+        with self._lock:
+            device = self._devices.pop(device_id, None)
+            self._dirty.discard(device_id)
+            self._due.pop(device_id, None)
+        if device is None:
+            return False
+        if self._rates is not None:
+            self._rates.remove(device_id)
+        supervisor.forget(device.connection)
+        detach_reader(device.connection)
+        device.connection.close()
+        device.connection.queue.stop(timeout=COMMAND_TIMEOUT)
+        log.info("%s removed", device_id)
+        publish("devices", self.list_payload())
+        return True
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._devices.values())
+
+    def list_payload(self):
+        return [{"id": d.id, "port": d.connection.port, "connected": d.connection.is_connected(),
+                 "status": d.status, "mode": d.mode}
+                for d in self.list()]
+
+    # ----- per-device state -----
+
+    def set_mode(self, device, mode):
+        """Switch one board to MANUAL or AUTO; returns the firmware result."""
+        result = device.connection.send_command(f"MODE:{mode}")
+        device.mode = mode
+        if mode == "MANUAL":
+            device.last_state = None
+        publish("device_mode", {"id": device.id, "mode": mode}, key=device.id)
+        self.mark(device.id)
+        return result
+
+    def set_thresholds(self, device, low=None, high=None):
+        if low is not None:
+            device.low_threshold = low
+        if high is not None:
+            device.high_threshold = high
+        publish("device_thresholds", {"id": device.id, "low_threshold": device.low_threshold,
+                                      "high_threshold": device.high_threshold}, key=device.id)
+        self.mark(device.id)
+
+    def set_relay(self, device, cmd, source="manual"):
+        result = device.connection.send_command(cmd)
+        if result.get("success"):
+            device.last_state = cmd
+            publish("device_ssr", {"id": device.id, "state": cmd, "source": source}, key=device.id)
+        return result
+
+    def _restore(self, device_id):
+        """A board came back after a disconnect (and has rebooted): put back its mode and relay.
+
+        Runs on the reconnect supervisor's thread, so the commands are only
+        queued on the board's own writer; waiting for their acks here would
+        hold up every other board's reconnect.
+        """
+        device = self.get(device_id)
+        if device is None:
+            return
+        device.connection.send_command(f"MODE:{device.mode}", wait=False)
+        if device.last_state:
+            device.connection.send_command(device.last_state, wait=False)
+        log.info("%s restoring %s mode and relay %s after reconnect", device.id, device.mode, device.last_state)
+        publish("devices", self.list_payload())
+        self.mark(device.id)
+
+    # ----- controller -----
+
+    def _on_telemetry(self, device_id, snapshot, changed):
+        if self._rates is not None and snapshot.get("percentage") is not None:
+            self._rates.add(device_id, snapshot["percentage"])
+        if changed:
+            publish("device_telemetry", dict(snapshot, id=device_id), key=device_id)
+            self.mark(device_id)
+
+    def mark(self, device_id):
+        """Queue one device for re-evaluation by the controller."""
+        with self._lock:
+            self._dirty.add(device_id)
+        self._wake.set()
+
+    def step(self, device):
+        """Run one AUTO decision for a device using its own telemetry."""
+        if device.mode != "AUTO":
+            return
+        telemetry = device.connection.telemetry
+        if not telemetry or telemetry.get("percentage") is None:
+            return
+
+        pct = telemetry["percentage"]
+        if pct <= device.low_threshold and device.last_state != "ON":
+            cmd = "ON"
+        elif pct >= device.high_threshold and device.last_state != "OFF":
+            cmd = "OFF"
+        else:
+            return
+
+        log.info("%s %s%% -> %s", device.id, pct, cmd)
+        # Don't wait for the ack: one slow board must not stall the others
+        device.connection.send_command(cmd, wait=False)
+        device.last_state = cmd
+        device.commands += 1
+        self._rates.reset(device.id)
+        publish("device_ssr", {"id": device.id, "state": cmd, "source": "auto"}, key=device.id)
+
+    def adapt_rate(self, device):
+        """Per-board telemetry interval from its own percentage, temperature and thresholds."""
+        connection = device.connection
+        telemetry = connection.telemetry
+        if not connection.is_connected() or not telemetry:
+            return
+        thresholds = (device.low_threshold, device.high_threshold) if device.mode == "AUTO" else None
+        interval = device.rate_policy.next_interval(
+            connection.interval_ms, telemetry.get("percentage"), telemetry.get("temperature"), thresholds)
+        if interval is not None:
+            connection.set_telemetry_interval(interval)
+
+    def schedule(self, devices, now):
+        """Next check time for each device, from one vectorized rate fit over all boards."""
+        from predict import next_check_in
+        rates = self._rates.rates(now)
+        due = {}
+        for device in devices:
+            percentage = (device.connection.telemetry or {}).get("percentage")
+            delay = self.check_interval
+            if device.mode == "AUTO":
+                delay = next_check_in(percentage, rates.get(device.id), device.low_threshold,
+                                      device.high_threshold, self.check_interval)
+            due[device.id] = now + delay
+        with self._lock:
+            self._due.update((i, t) for i, t in due.items() if i in self._devices)
+
+    def _evaluate(self):
+        """One controller pass over the changed and due devices."""
+        now = time.monotonic()
+        with self._lock:
+            ids, self._dirty = self._dirty, set()
+            ids.update(i for i in self._devices if self._due.get(i, now) <= now)
+            devices = [self._devices[i] for i in ids if i in self._devices]
+
+        for device in devices:
+            try:
+                self.step(device)
+                self.adapt_rate(device)
+            except Exception as e:
+                log.exception("%s controller error: %s", device.id, e)
+        if devices:
+            self.schedule(devices, now)
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                wait = min(self._due.values(), default=now + self.check_interval) - now
+            self._wake.wait(max(wait, 0))
+            self._wake.clear()
+            self._evaluate()  # a separate frame, so no removed device stays referenced while waiting
+
+    def start(self):
+        if self._rates is None:
+            from predict import RateEstimator  # deferred so numpy loads with the first board, not at startup
+            self._rates = RateEstimator()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="device-controller", daemon=True)
+                self._thread.start()
+
+
+devices = DeviceManager()
@@ -0,0 +1,144 @@
+import json
+import queue
+from threading import Lock
+from log import get_logger
+from config import SSE_QUEUE_SIZE
+
+log = get_logger("events")
+
+
+class EventBroker:
+    """Fan-out publisher for state changes.
+
+    Each publish is serialized once into an SSE message and handed to every
+    subscriber queue. Identical consecutive payloads for the same event are
+    dropped, so subscribers only ever see changes.
+    """
+
+    def __init__(self, queue_size=SSE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.version = 0
+        self._subscribers = set()
+        self._listeners = []  # in-process callbacks: fn(event, data)
+        self._mirrors = []    # replication callbacks: fn(op, event, key, data, message, version)
+        self._last = {}      # (event, key) -> latest payload
+        self._messages = {}  # (event, key) -> latest serialized SSE message
+        self._lock = Lock()
+
+    def publish(self, event, data, key=None):
+        """Publish data under an event name; returns False if nothing changed.
+
+        key separates independent streams of the same event (e.g. one per
+        sensor) so each keeps its own latest value for new subscribers.
+        """
+        slot = (event, key)
+        with self._lock:
+            if self._last.get(slot) == data:
+                return False
+            self.version += 1
+            message = f"id: {self.version}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            self._last[slot] = data
+            self._messages[slot] = message
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+            for mirror in self._mirrors:
+                mirror("publish", event, key, data, message, self.version)
+
+        self._deliver(event, data, message, listeners, subscribers)
+        return True
+
+    def apply(self, op, event, key, data, message, version):
+        """Replay a change made by another process's broker (see Replica in serve.py).
+
+        The version is taken over as-is, so ETags and SSE ids match the owner's.
+        """
+        slot = (event, key)
+        with self._lock:
+            self.version = version
+            if op == "forget":
+                self._last.pop(slot, None)
+                self._messages.pop(slot, None)
+                return
+            self._last[slot] = data
+            self._messages[slot] = message
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+
+        self._deliver(event, data, message, listeners, subscribers)
+
+    def _deliver(self, event, data, message, listeners, subscribers):
+        for listener in listeners:
+            try:
+                listener(event, data)
+            except Exception as e:
+                log.exception("Listener error on '%s': %s", event, e)
+
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Slow consumer: drop its oldest message rather than block the publisher
+                try:
+                    q.get_nowait()
+                    q.put_nowait(message)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscribe(self, q=None):
+        """Register a subscriber queue; q may be any object with put_nowait/get_nowait."""
+        if q is None:
+            q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def add_listener(self, fn):
+        """Call fn(event, data) synchronously on every change; keep it cheap."""
+        with self._lock:
+            self._listeners.append(fn)
+
+    def current_messages(self):
+        """Latest message per event, used to sync a new subscriber."""
+        with self._lock:
+            return list(self._messages.values())
+
+    def latest(self, event, default=None, key=None):
+        return self._last.get((event, key), default)
+
+    def forget(self, event, key=None):
+        """Drop the retained value for an event/key (e.g. a removed sensor)."""
+        with self._lock:
+            self._last.pop((event, key), None)
+            self._messages.pop((event, key), None)
+            for mirror in self._mirrors:
+                mirror("forget", event, key, None, None, self.version)
+
+    def add_mirror(self, fn):
+        """Call fn(op, event, key, data, message, version) under the broker lock on every change.
+
+        Returns the full current state as a list of ("publish", ...) records,
+        taken atomically with the registration so no change is missed.
+        """
+        with self._lock:
+            self._mirrors.append(fn)
+            return [("publish", event, key, data, self._messages[(event, key)], self.version)
+                    for (event, key), data in self._last.items()]
+
+    def remove_mirror(self, fn):
+        with self._lock:
+            if fn in self._mirrors:
+                self._mirrors.remove(fn)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+broker = EventBroker()
+
+
+def publish(event, data, key=None):
+    return broker.publish(event, data, key)
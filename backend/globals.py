@@ -5,15 +5,33 @@ import threading
 # Serial connection object
 ser = None
 
-# Battery data dictionary
+# Battery data dictionary (latest telemetry snapshot from the firmware).
+# Never mutated in place: the serial reader builds a new dict and swaps the
+# reference, so readers can use it without holding the lock.
 battery_data = {
     "percentage": 0.0,
     "voltage": 0.0,
-    "temperature": 0.0
+    "temperature": 0.0,
+    "isCharging": False,
+    "ssrStatus": False,
+    "autoCharge": False,
+    "timestamp": None
 }
 
 # Thread lock for data synchronization
 data_lock = threading.Lock()
 
 # Connection status
-connection_status = False
\ No newline at end of file
+connection_status = False
+
+
+def publish_battery_data(snapshot):
+    """Atomically replace the latest telemetry snapshot."""
+    global battery_data
+    with data_lock:
+        battery_data = snapshot
+
+
+def get_battery_data():
+    """Return the latest telemetry snapshot (do not mutate it)."""
+    return battery_data
@@ -0,0 +1,127 @@
+import sys
+import time
+from threading import Thread, Event, Lock
+from metrics import histogram
+from log import get_logger
+from config import HEALTH_TTL
+
+log = get_logger("health")
+
+PROVIDER_SECONDS = histogram("health_provider_read_seconds", "Battery health provider query (WMI on Windows)", ("provider",))
+
+
+class NullHealthProvider:
+    """Provider for hosts without a health source: always reports None."""
+    name = "none"
+
+    def read(self):
+        return None
+
+
+class WMIHealthProvider:
+    """Windows provider: full-charge vs design capacity from the root\\wmi namespace."""
+    name = "wmi"
+
+    def __init__(self):
+        self._conn = None
+
+    def _connect(self):
+        # Imported lazily so the backend starts on hosts without pywin32/WMI
+        import wmi
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()  # COM must be initialised on the refresher thread
+        except ImportError:
+            pass
+        return wmi.WMI(namespace="root\\wmi")
+
+    def read(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        try:
+            full = self._conn.BatteryFullChargedCapacity()[0].FullChargedCapacity
+            design = self._conn.BatteryStaticData()[0].DesignedCapacity
+        except Exception:
+            self._conn = None  # reconnect on the next refresh
+            raise
+        return {"full_capacity": full, "design_capacity": design}
+
+
+def default_provider():
+    """Pick the best provider for this host."""
+    if sys.platform == "win32":
+        try:
+            import wmi  # noqa: F401
+            return WMIHealthProvider()
+        except ImportError:
+            pass
+    return NullHealthProvider()
+
+
+class HealthCache:
+    """Serves battery health from memory; a background thread refreshes it every ttl seconds."""
+
+    def __init__(self, provider=None, ttl=HEALTH_TTL):
+        self.provider = provider
+        self.ttl = ttl
+        self._value = {"health_percent": None, "full_capacity": None, "design_capacity": None, "updated_at": None}
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread = None
+
+    def refresh(self):
+        """Query the provider once and swap in the result."""
+        if self.provider is None:
+            self.provider = default_provider()
+        try:
+            with PROVIDER_SECONDS.time(self.provider.name):
+                data = self.provider.read()
+        except Exception as e:
+            log.warning("%s provider failed: %s", self.provider.name, e)
+            data = None
+
+        value = {"health_percent": None, "full_capacity": None, "design_capacity": None, "updated_at": time.time()}
+        if data and data.get("design_capacity"):
+            value.update(data)
+            value["health_percent"] = round((data["full_capacity"] / data["design_capacity"]) * 100, 2)
+        with self._lock:
+            self._value = value
+        return value
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._wake.wait(self.ttl)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, name="health-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def set_provider(self, provider):
+        """Swap the provider and refresh as soon as possible."""
+        self.provider = provider
+        self._wake.set()
+
+    def get(self):
+        return self._value
+
+
+health_cache = HealthCache()
+
+
+def start_health_refresher():
+    return health_cache.start()
+
+
+def get_health():
+    """Cached battery health percentage, or None if unknown."""
+    return health_cache.get()["health_percent"]
+
+
+def get_capacity():
+    """Cached full-charge and design capacity."""
+    value = health_cache.get()
+    return {"full_capacity": value["full_capacity"], "design_capacity": value["design_capacity"]}
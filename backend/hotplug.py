@@ -0,0 +1,70 @@
+"""Serial hotplug events from the Linux kernel (netlink uevents, no udev library needed).
+
+The connection supervisor uses these to retry a lost board the moment a
+tty appears, and to notice an unplugged board before the next read fails.
+On other platforms start_hotplug_monitor returns None and the supervisor
+falls back to its backoff timer alone.
+"""
+import socket
+import sys
+from threading import Thread
+from log import get_logger
+
+log = get_logger("hotplug")
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_EVENTS = 1  # multicast group the kernel sends uevents to
+
+
+def parse_uevent(data):
+    """b"add@/devices/...\\0ACTION=add\\0SUBSYSTEM=tty\\0DEVNAME=ttyACM0..." -> dict of fields."""
+    fields = {}
+    for part in data.split(b"\0")[1:]:
+        key, sep, value = part.partition(b"=")
+        if sep:
+            fields[key.decode(errors="replace")] = value.decode(errors="replace")
+    return fields
+
+
+class HotplugMonitor:
+    """Calls on_event(action, device_path) for every tty added or removed."""
+
+    def __init__(self, on_event):
+        self.on_event = on_event
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self._sock.bind((0, KERNEL_EVENTS))
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except OSError as e:
+                log.error("Hotplug monitor stopped: %s", e)
+                return
+            fields = parse_uevent(data)
+            if fields.get("SUBSYSTEM") != "tty" or fields.get("ACTION") not in ("add", "remove"):
+                continue
+            device = "/dev/" + fields.get("DEVNAME", "")
+            log.info("%s %s", fields["ACTION"], device)
+            try:
+                self.on_event(fields["ACTION"], device)
+            except Exception as e:
+                log.exception("Hotplug handler failed: %s", e)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, name="hotplug", daemon=True)
+            self._thread.start()
+        return self
+
+
+def start_hotplug_monitor(on_event):
+    """Start watching for tty hotplug events; None where that isn't available."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return HotplugMonitor(on_event).start()
+    except OSError as e:
+        log.warning("Hotplug events unavailable (%s); relying on reconnect backoff", e)
+        return None
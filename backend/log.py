@@ -0,0 +1,169 @@
+"""Structured logging that never blocks the caller.
+
+Records go through a bounded queue to one writer thread (QueueHandler /
+QueueListener), so a slow console or log file cannot stall the serial
+reader, the controller or a request. When the queue is full records are
+dropped and counted. Each subsystem (controller, serial, sensor, ...) is
+rate limited separately below ERROR, and has its own level:
+
+    BATTERY_LOG_LEVEL="INFO,serial=DEBUG" python app.py
+    BATTERY_LOG_JSON=1 python app.py          # one JSON object per line
+
+Per-sample messages are logged at DEBUG with %-style arguments, so while
+DEBUG is off they cost one level check and are never formatted.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from threading import Lock
+from config import LOG_LEVEL, LOG_JSON, LOG_FILE, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_BURST
+
+ROOT = "battery"
+
+# Attributes every LogRecord has; anything else came in through extra= and is a structured field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "suppressed", "tag"}
+
+stats = {"dropped": 0, "suppressed": 0}
+
+_listener = None
+_listener_pid = None
+_setup_lock = Lock()
+
+
+def get_logger(subsystem):
+    """Logger for one subsystem, e.g. get_logger("controller")."""
+    return logging.getLogger(f"{ROOT}.{subsystem}")
+
+
+def _subsystem(record):
+    return record.name[len(ROOT) + 1:] if record.name.startswith(ROOT + ".") else record.name
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per subsystem; ERROR and above always pass."""
+
+    def __init__(self, rate=LOG_RATE_LIMIT, burst=LOG_RATE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # logger name -> [tokens, last refill, suppressed since last pass]
+        self._lock = Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not self.rate:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                stats["suppressed"] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking or raising when full."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+class TextFormatter(logging.Formatter):
+    """The console format the backend has always used: [SUBSYSTEM] message."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(tag)s] %(message)s")
+
+    def format(self, record):
+        record.tag = _subsystem(record).upper()
+        line = super().format(record)
+        if getattr(record, "suppressed", 0):
+            line += f" ({record.suppressed} earlier message(s) suppressed)"
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record; extra= fields are included as-is."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "subsystem": _subsystem(record),
+            "msg": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        return json.dumps(entry, default=str)
+
+
+def parse_levels(spec):
+    """"INFO,serial=DEBUG" -> {"": INFO, "serial": DEBUG}."""
+    levels = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, level = part.rpartition("=")
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+
+def setup_logging(level=LOG_LEVEL, json_output=LOG_JSON, log_file=LOG_FILE):
+    """Route the backend's loggers through the background writer; safe to call again (e.g. after fork)."""
+    global _listener, _listener_pid
+    with _setup_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+        formatter = JSONFormatter() if json_output else TextFormatter()
+        outputs = [logging.StreamHandler(sys.stdout)]
+        if log_file:
+            outputs.append(logging.FileHandler(log_file, encoding="utf-8"))
+        for output in outputs:
+            output.setFormatter(formatter)
+
+        records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = DroppingQueueHandler(records)
+        handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger(ROOT)
+        for old in list(root.handlers):
+            root.removeHandler(old)  # inherited across fork; its writer thread did not survive
+        root.addHandler(handler)
+        root.propagate = False
+
+        levels = parse_levels(level)
+        root.setLevel(levels.pop("", logging.INFO))
+        for subsystem, subsystem_level in levels.items():
+            get_logger(subsystem).setLevel(subsystem_level)
+
+        _listener = logging.handlers.QueueListener(records, *outputs, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def shutdown_logging():
+    """Write out whatever is still queued."""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -1,19 +1,16 @@
-import time
-
 from config import SERIAL_PORT
-from serial_handler import init_serial, send_command, read_serial
+from serial_handler import init_serial, send_command, start_reader
 
 
 def main():
     init_serial(SERIAL_PORT)
-    time.sleep(0.2)
+    start_reader()  # matches firmware replies to commands
 
     print("Connected to Arduino")
     print("Commands: ON | OFF | STATUS | EXIT")
 
     # SET MODE MANUAL SEKALI SAAT START
     send_command("MODE:MANUAL")
-    time.sleep(0.2)
 
     while True:
         cmd = input(">> ").strip().upper()
@@ -22,19 +19,19 @@ def main():
             break
 
         if cmd in ("ON", "OFF", "STATUS"):
-            send_command(cmd)
+            result = send_command(cmd)
         else:
             print("Invalid command")
             continue
 
-        # baca respon Arduino
-        time.sleep(0.2)
-        lines = read_serial()
-        for response in lines:
-            print("Arduino:", response)
+        # respon Arduino (sudah dicocokkan dengan perintahnya)
+        if result.get("acked"):
+            print(f"Arduino: {result['response']} ({result['rtt_ms']} ms)")
+        else:
+            print("Error:", result.get("error"))
 
     print("Disconnected")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,161 @@
+"""In-process metrics rendered for GET /metrics (Prometheus text format).
+
+Counters and histograms are updated on hot paths, so they are plain dicts
+behind one lock each and keep no per-observation history. Values that
+already live in a stats dict (serial reader, DB writer, ...) are not
+copied: collectors registered with add_collector read them at scrape time.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from log import get_logger
+
+log = get_logger("metrics")
+
+# Seconds; covers sub-millisecond parsing up to multi-second serial timeouts
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_collectors = []
+_registry_lock = Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic count, optionally split by label values."""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, tuple(zip(self.labels, labels)), value
+
+
+class Histogram:
+    """Bucketed distribution of observations (seconds unless the name says otherwise)."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> per-bucket counts (last one is +Inf), then the sum
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a with-block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        for labels, values in series:
+            named = tuple(zip(self.labels, labels))
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                total += count
+                yield self.name + "_bucket", named + (("le", bound),), total
+            yield self.name + "_sum", named, values[-1]
+            yield self.name + "_count", named, total
+
+
+def _register(metric):
+    with _registry_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def add_collector(fn):
+    """Register fn() -> iterable of (name, kind, help, [(labels dict, value), ...]), called per scrape."""
+    with _registry_lock:
+        _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, help):
+        lines.append(f"# HELP {name} {_escape(help)}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+
+    for metric in metrics:
+        family(metric.name, metric.kind, metric.help)
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for collect in collectors:
+        try:
+            families = list(collect())
+        except Exception as e:
+            log.exception("Collector %s failed: %s", getattr(collect, "__name__", collect), e)
+            continue
+        for name, kind, help, samples in families:
+            family(name, kind, help)
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
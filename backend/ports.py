@@ -0,0 +1,121 @@
+import time
+from threading import Lock
+from log import get_logger
+from metrics import add_collector
+from config import PORT_CACHE_TTL
+
+log = get_logger("ports")
+
+# USB vendor/product ids of boards the firmware runs on, best match first.
+# A (vid, None) entry matches every product from that vendor.
+BOARD_IDS = (
+    ((0x2341, None), "arduino"),   # Arduino SA
+    ((0x2A03, None), "arduino"),   # Arduino.org
+    ((0x1A86, 0x7523), "ch340"),   # QinHeng CH340 (most Nano/Uno clones)
+    ((0x1A86, 0x5523), "ch340"),   # QinHeng CH341
+    ((0x1A86, 0x55D4), "ch340"),   # QinHeng CH9102
+    ((0x0403, 0x6001), "ftdi"),    # FTDI FT232R
+    ((0x10C4, 0xEA60), "cp210x"),  # Silicon Labs CP210x
+)
+
+# Fallback when the VID/PID is unknown (e.g. some Windows drivers only give a description)
+BOARD_DESCRIPTIONS = (("arduino", "arduino"), ("ch340", "ch340"), ("ch341", "ch340"),
+                      ("usb-serial", "usb-serial"), ("usb serial", "usb-serial"))
+
+# Lower is a better candidate for auto-detection
+BOARD_RANK = {"arduino": 0, "ch340": 1, "ftdi": 2, "cp210x": 2, "usb-serial": 3, "usb": 4, None: 5}
+
+
+def classify(vid, pid, description):
+    """Board kind for a port: arduino, ch340, ftdi, cp210x, usb-serial, usb, or None."""
+    if vid is not None:
+        for (board_vid, board_pid), kind in BOARD_IDS:
+            if vid == board_vid and board_pid in (None, pid):
+                return kind
+    text = (description or "").lower()
+    for needle, kind in BOARD_DESCRIPTIONS:
+        if needle in text:
+            return kind
+    return "usb" if vid is not None else None
+
+
+def describe(info):
+    """Plain-dict view of a pyserial ListPortInfo."""
+    return {
+        "device": info.device,
+        "description": info.description,
+        "hwid": info.hwid,
+        "vid": info.vid,
+        "pid": info.pid,
+        "serial_number": info.serial_number,
+        "manufacturer": info.manufacturer,
+        "product": info.product,
+        "location": info.location,
+        "board": classify(info.vid, info.pid, info.description)
+    }
+
+
+class PortInventory:
+    """comports() result cached for ttl seconds, or until invalidate() (hotplug).
+
+    Concurrent callers share one scan instead of each walking sysfs.
+    """
+
+    def __init__(self, ttl=PORT_CACHE_TTL):
+        self.ttl = ttl
+        self._ports = []
+        self._scanned_at = None
+        self._generation = 0  # bumped by invalidate(), so a scan that straddles a hotplug isn't trusted
+        self._lock = Lock()
+        self.stats = {"scans": 0, "hits": 0, "last_scan_ms": None}
+
+    def invalidate(self):
+        self._generation += 1
+        self._scanned_at = None
+
+    def ports(self, refresh=False):
+        """Every serial port with its metadata, best board candidates first."""
+        scanned_at = self._scanned_at
+        if not refresh and scanned_at is not None and time.monotonic() - scanned_at < self.ttl:
+            self.stats["hits"] += 1
+            return self._ports
+        with self._lock:
+            # Someone else may have rescanned while we waited for the lock
+            if not refresh and self._scanned_at is not None and self._scanned_at != scanned_at:
+                self.stats["hits"] += 1
+                return self._ports
+            import serial.tools.list_ports  # deferred: only needed once something asks for ports
+            generation = self._generation
+            started = time.perf_counter()
+            found = [describe(info) for info in serial.tools.list_ports.comports()]
+            found.sort(key=lambda p: (BOARD_RANK[p["board"]], p["device"]))
+            self._ports = found
+            self._scanned_at = time.monotonic() if generation == self._generation else None
+            self.stats["scans"] += 1
+            self.stats["last_scan_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            return found
+
+    def devices(self):
+        return [p["device"] for p in self.ports()]
+
+    def find_board(self):
+        """Most likely charger board: Arduino or common USB-serial chips first, else any port."""
+        ports = self.ports()
+        if not ports:
+            return None
+        best = ports[0]
+        if best["board"] is None:
+            log.info("No USB serial board found; falling back to %s", best["device"])
+        return best["device"]
+
+    def get_stats(self):
+        return dict(self.stats, cached=len(self._ports), ttl=self.ttl)
+
+
+inventory = PortInventory()
+
+
+@add_collector
+def _port_metrics():
+    yield "serial_port_scans_total", "counter", "comports() scans", [({}, inventory.stats["scans"])]
+    yield "serial_port_cache_hits_total", "counter", "Port lookups answered from the cache", [({}, inventory.stats["hits"])]
@@ -0,0 +1,157 @@
+"""Charge/discharge rate estimates and threshold-crossing predictions for AUTO.
+
+Every source (the laptop battery, an external sensor, a board managed by
+DeviceManager) gets a row in one pair of NumPy ring buffers. The rate is the
+least-squares slope of percentage over time across the row's recent
+samples; rates() fits all rows in one vectorized pass. Slot order does not
+matter to a least-squares fit, so the ring is never unrolled.
+
+next_check_in() turns a rate into a wait: a fraction of the predicted time
+to the next threshold, so checks close in as a crossing approaches and stay
+far apart while the battery is nowhere near one.
+"""
+import math
+import time
+from threading import Lock
+import numpy as np
+from config import (PREDICT_WINDOW, PREDICT_MAX_AGE, PREDICT_MIN_SAMPLES, PREDICT_SAMPLE_SPACING,
+                    PREDICT_LEAD, PREDICT_MIN_INTERVAL, PREDICT_MAX_INTERVAL)
+
+
+class RateEstimator:
+    """Rolling percentage-per-second estimate for any number of sources."""
+
+    def __init__(self, window=PREDICT_WINDOW, max_age=PREDICT_MAX_AGE,
+                 min_samples=PREDICT_MIN_SAMPLES, spacing=PREDICT_SAMPLE_SPACING, rows=8):
+        self.window = window
+        self.max_age = max_age
+        self.min_samples = max(min_samples, 2)
+        self.spacing = spacing
+        self._epoch = time.monotonic()  # times are stored relative to this to keep float64 precision
+        self._times = np.zeros((rows, window))
+        self._values = np.zeros((rows, window))
+        self._next = np.zeros(rows, dtype=np.intp)
+        self._count = np.zeros(rows, dtype=np.intp)
+        self._last = np.full(rows, np.nan)  # last stored percentage per row
+        self._rows = {}  # source -> row index
+        self._free = []
+        self._lock = Lock()
+
+    def _row(self, source):
+        row = self._rows.get(source)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = len(self._rows)
+            if row == len(self._count):
+                self._grow()
+        self._rows[source] = row
+        return row
+
+    def _grow(self):
+        rows = len(self._count)
+        self._times = np.vstack((self._times, np.zeros((rows, self.window))))
+        self._values = np.vstack((self._values, np.zeros((rows, self.window))))
+        self._next = np.concatenate((self._next, np.zeros(rows, dtype=np.intp)))
+        self._count = np.concatenate((self._count, np.zeros(rows, dtype=np.intp)))
+        self._last = np.concatenate((self._last, np.full(rows, np.nan)))
+
+    def add(self, source, percentage, now=None):
+        """Record a sample; an unchanged percentage is kept at most once per spacing seconds."""
+        t = (time.monotonic() if now is None else now) - self._epoch
+        with self._lock:
+            row = self._row(source)
+            count = self._count[row]
+            if count and self._last[row] == percentage:
+                newest = self._times[row, (self._next[row] - 1) % self.window]
+                if t - newest < self.spacing:
+                    return
+            slot = self._next[row]
+            self._times[row, slot] = t
+            self._values[row, slot] = percentage
+            self._next[row] = (slot + 1) % self.window
+            self._count[row] = min(count + 1, self.window)
+            self._last[row] = percentage
+
+    def reset(self, source):
+        """Forget a source's samples, e.g. after its relay flipped and the old slope no longer applies."""
+        with self._lock:
+            row = self._rows.get(source)
+            if row is not None:
+                self._count[row] = 0
+                self._next[row] = 0
+                self._last[row] = np.nan
+
+    def remove(self, source):
+        with self._lock:
+            row = self._rows.pop(source, None)
+            if row is not None:
+                self._count[row] = 0
+                self._next[row] = 0
+                self._last[row] = np.nan
+                self._free.append(row)
+
+    def _slopes(self, rows, now):
+        """Least-squares slope per row (NaN where there is too little data), vectorized over rows."""
+        times = self._times[rows]
+        values = self._values[rows]
+        usable = np.arange(self.window) < self._count[rows, None]
+        usable &= times >= (now - self._epoch) - self.max_age
+        n = usable.sum(axis=1)
+        safe_n = np.maximum(n, 1)
+        mean_t = np.where(usable, times, 0.0).sum(axis=1) / safe_n
+        mean_v = np.where(usable, values, 0.0).sum(axis=1) / safe_n
+        dt = np.where(usable, times - mean_t[:, None], 0.0)
+        dv = np.where(usable, values - mean_v[:, None], 0.0)
+        sxx = (dt * dt).sum(axis=1)
+        sxy = (dt * dv).sum(axis=1)
+        ok = (n >= self.min_samples) & (sxx > 0)
+        return np.where(ok, sxy / np.where(ok, sxx, 1.0), np.nan)
+
+    def rates(self, now=None):
+        """{source: percent per second} for every source with enough recent samples."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._rows:
+                return {}
+            sources = list(self._rows)
+            slopes = self._slopes(np.fromiter(self._rows.values(), dtype=np.intp, count=len(sources)), now)
+        return {source: float(slope) for source, slope in zip(sources, slopes) if not math.isnan(slope)}
+
+    def rate(self, source, now=None):
+        """Percent per second for one source, or None while it has too few samples."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            row = self._rows.get(source)
+            if row is None:
+                return None
+            slope = float(self._slopes(slice(row, row + 1), now)[0])
+        return None if math.isnan(slope) else slope
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def seconds_until_crossing(percentage, rate, low, high):
+    """Predicted seconds until percentage reaches the threshold it is heading for; inf if never."""
+    if rate is None or rate == 0:
+        return math.inf
+    if rate < 0:
+        return max((percentage - low) / -rate, 0.0)
+    return max((high - percentage) / rate, 0.0)
+
+
+def next_check_in(percentage, rate, low, high, default):
+    """Seconds until the controller should look again; default while there is no estimate.
+
+    Already past the threshold it is heading for means the controller has
+    just acted on it, so there is nothing to predict until the trend turns.
+    """
+    if percentage is None or rate is None:
+        return default
+    eta = seconds_until_crossing(percentage, rate, low, high)
+    if eta == 0:
+        return default
+    return min(max(eta * PREDICT_LEAD, PREDICT_MIN_INTERVAL), PREDICT_MAX_INTERVAL)
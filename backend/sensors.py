@@ -0,0 +1,139 @@
+import time
+from array import array
+from datetime import datetime
+from threading import Thread, Lock
+from config import SENSOR_HISTORY_SIZE, SENSOR_STALE_AFTER, SENSOR_EXPIRE_AFTER, SENSOR_SWEEP_INTERVAL, SENSOR_MAX_SOURCES
+
+
+class SensorEntry:
+    """Latest reading plus a fixed-size ring buffer of recent (timestamp, percentage) pairs."""
+    __slots__ = ("source", "device_type", "percentage", "updated_at", "_times", "_values", "_next", "_count")
+
+    def __init__(self, source, device_type, history_size):
+        self.source = source
+        self.device_type = device_type
+        self.percentage = None
+        self.updated_at = 0.0
+        self._times = array("d", bytes(8 * history_size))
+        self._values = array("d", bytes(8 * history_size))
+        self._next = 0
+        self._count = 0
+
+    def record(self, percentage, timestamp):
+        self.percentage = percentage
+        self.updated_at = timestamp
+        self._times[self._next] = timestamp
+        self._values[self._next] = percentage
+        self._next = (self._next + 1) % len(self._times)
+        self._count = min(self._count + 1, len(self._times))
+
+    def history(self):
+        """Readings oldest first."""
+        size = len(self._times)
+        start = (self._next - self._count) % size
+        return [(self._times[(start + i) % size], self._values[(start + i) % size]) for i in range(self._count)]
+
+    def to_dict(self, now=None, ages=True):
+        """ages=False leaves out age_seconds and stale, which change without a new reading."""
+        entry = {
+            "source": self.source,
+            "percentage": self.percentage,
+            "device_type": self.device_type,
+            "timestamp": datetime.fromtimestamp(self.updated_at).isoformat()
+        }
+        if ages:
+            now = time.time() if now is None else now
+            entry["age_seconds"] = round(now - self.updated_at, 3)
+            entry["stale"] = now - self.updated_at > SENSOR_STALE_AFTER
+        return entry
+
+
+class SensorRegistry:
+    """Thread-safe store of external sensors with bounded memory and stale expiry."""
+
+    def __init__(self, history_size=SENSOR_HISTORY_SIZE, max_sources=SENSOR_MAX_SOURCES):
+        self.history_size = history_size
+        self.max_sources = max_sources
+        self._entries = {}
+        self._lock = Lock()
+        self._sweeper = None
+
+    def update(self, source, percentage, device_type="other", timestamp=None):
+        """Record a reading; returns the entry, or None if the registry is full."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is None:
+                if len(self._entries) >= self.max_sources:
+                    return None
+                entry = self._entries[source] = SensorEntry(source, device_type, self.history_size)
+            entry.device_type = device_type
+            entry.record(float(percentage), timestamp)
+            return entry
+
+    def update_many(self, readings, timestamp=None):
+        """Apply (source, percentage, device_type) readings under one lock.
+
+        Returns a list of entries (None where the registry was full).
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        applied = []
+        with self._lock:
+            for source, percentage, device_type in readings:
+                entry = self._entries.get(source)
+                if entry is None:
+                    if len(self._entries) >= self.max_sources:
+                        applied.append(None)
+                        continue
+                    entry = self._entries[source] = SensorEntry(source, device_type, self.history_size)
+                entry.device_type = device_type
+                entry.record(float(percentage), timestamp)
+                applied.append(entry)
+        return applied
+
+    def remove(self, source):
+        with self._lock:
+            return self._entries.pop(source, None) is not None
+
+    def __contains__(self, source):
+        return source in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, source):
+        return self._entries.get(source)
+
+    def fresh_percentage(self, source, max_age=SENSOR_STALE_AFTER):
+        """Latest percentage for source, or None if unknown or silent for max_age seconds."""
+        entry = self._entries.get(source)
+        if entry is None or time.time() - entry.updated_at > max_age:
+            return None
+        return entry.percentage
+
+    def snapshot(self, ages=True):
+        now = time.time()
+        with self._lock:
+            return [entry.to_dict(now, ages) for entry in self._entries.values()]
+
+    def sweep(self, max_age=SENSOR_EXPIRE_AFTER):
+        """Drop sensors silent for more than max_age seconds; returns their names."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            expired = [s for s, e in self._entries.items() if e.updated_at < cutoff]
+            for source in expired:
+                del self._entries[source]
+        return expired
+
+    def start_sweeper(self, on_expired=None, interval=SENSOR_SWEEP_INTERVAL):
+        """Background expiry; on_expired(list_of_sources) is called when something expires."""
+        def run():
+            while True:
+                time.sleep(interval)
+                expired = self.sweep()
+                if expired and on_expired:
+                    on_expired(expired)
+
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._sweeper = Thread(target=run, name="sensor-sweeper", daemon=True)
+            self._sweeper.start()
@@ -1,91 +1,1042 @@
-from config import BAUD_RATE, TIMEOUT
+from config import BAUD_RATE, TIMEOUT, READ_CHUNK_SIZE, MAX_LINE_LENGTH, RESPONSE_BUFFER_SIZE
+from config import COMMAND_TIMEOUT, COMMAND_RETRIES, COMMAND_MIN_INTERVAL, COMMAND_QUEUE_WAIT
+from config import SERIAL_PROTOCOL, SERIAL_READY_TIMEOUT, RECONNECT_INITIAL, RECONNECT_MAX, RECONNECT_HOTPLUG
+from globals import publish_battery_data
+from events import publish
+from database import log_data
+from metrics import histogram, add_collector
+from log import get_logger
+from hotplug import start_hotplug_monitor
+from ports import inventory
+from collections import deque, OrderedDict
+from threading import Thread, Event, Lock, Condition, current_thread
+from binascii import crc_hqx
+import heapq
+import itertools
+import json
+import os
+import selectors
 import serial
-import serial.tools.list_ports
+import socket
+import struct
 import time
+import weakref
 
-ser = None
-_port = None
+TELEMETRY_FIELDS = ("percentage", "voltage", "temperature", "isCharging", "ssrStatus", "autoCharge")
 
+# Backend command -> firmware JSON command (see processCommand in firmware/src/main.cpp)
+FIRMWARE_COMMANDS = {
+    "ON": {"command": "ssr_on"},
+    "OFF": {"command": "ssr_off"},
+    "MODE:AUTO": {"command": "set_mode", "mode": "AUTO"},
+    "MODE:MANUAL": {"command": "set_mode", "mode": "MANUAL"},
+    "STATUS": {"command": "status"},
+    "PING": {"command": "ping"},
+    "TOGGLE_AUTO": {"command": "toggle_auto"},
+    "PROTOCOL:BINARY": {"command": "set_protocol", "protocol": "binary"},
+    "PROTOCOL:JSON": {"command": "set_protocol", "protocol": "json"}
+}
 
-def find_available_port():
-    """Auto-detect Arduino/serial device port"""
-    ports = serial.tools.list_ports.comports()
-    if not ports:
+# Binary frames (after PROTOCOL:BINARY is acked; JSON lines stay accepted both ways):
+#   A5 5A | type:u8 | len:u8 | payload[len] | crc16:u16le
+# crc16 is CRC-CCITT (0x1021, init 0xFFFF) over type, len and payload.
+FRAME_SYNC = b"\xa5\x5a"
+FRAME_HEADER = 4
+FRAME_OVERHEAD = FRAME_HEADER + 2
+FRAME_TELEMETRY = 0x01
+FRAME_COMMAND = 0x02
+FRAME_REPLY = 0x03
+
+TELEMETRY_STRUCT = struct.Struct("<BHhB")  # percentage, voltage mV, temperature 0.1 C, flags
+COMMAND_STRUCT = struct.Struct("<IBB")     # id, opcode, argument
+REPLY_STRUCT = struct.Struct("<IBBB")      # id, status (0 = success), flags, percentage
+CRC_STRUCT = struct.Struct("<H")
+
+FLAG_CHARGING = 0x01
+FLAG_SSR = 0x02
+FLAG_AUTO = 0x04
+
+# Backend command -> (opcode, argument); see runCommand in firmware/src/main.cpp
+BINARY_OPCODES = {
+    "ON": (1, 0),
+    "OFF": (2, 0),
+    "TOGGLE_AUTO": (3, 0),
+    "MODE:AUTO": (4, 1),
+    "MODE:MANUAL": (4, 0),
+    "STATUS": (5, 0),
+    "PING": (6, 0)
+}
+OP_SET_INTERVAL = 7  # argument: interval in 100 ms units
+
+# Commands that replace an earlier queued command of the same group.
+# Idempotent commands are their own group, so queued duplicates merge.
+COMMAND_GROUPS = {
+    "ON": "relay",
+    "OFF": "relay",
+    "MODE:AUTO": "mode",
+    "MODE:MANUAL": "mode",
+    "STATUS": "STATUS",
+    "PING": "PING"
+}
+
+# Parameterised commands (PREFIX:value) -> group
+COMMAND_PREFIX_GROUPS = {
+    "INTERVAL": "interval"
+}
+
+# Lower runs first; relay changes are safety-relevant
+COMMAND_PRIORITIES = {"relay": 0, "mode": 1}
+DEFAULT_PRIORITY = 2
+
+_command_ids = itertools.count(1)
+
+
+class PendingCommand:
+    """A queued command; callers wait on done, the writer fills result."""
+    __slots__ = ("id", "cmd", "group", "priority", "timeout", "retries",
+                 "event", "done", "response", "result", "sent_at", "acked_at",
+                 "superseded_by")
+
+    def __init__(self, cmd_id, cmd, timeout, retries):
+        self.id = cmd_id
+        self.cmd = cmd
+        self.group = COMMAND_GROUPS.get(cmd) or COMMAND_PREFIX_GROUPS.get(cmd.partition(":")[0])
+        self.priority = COMMAND_PRIORITIES.get(self.group, DEFAULT_PRIORITY)
+        self.timeout = timeout
+        self.retries = retries
+        self.event = Event()  # firmware reply received
+        self.done = Event()   # result available
+        self.response = None
+        self.result = None
+        self.sent_at = None
+        self.acked_at = None
+        self.superseded_by = None
+
+    def wait(self, timeout):
+        """Block until this command, or whatever superseded it, has a result."""
+        deadline = time.monotonic() + timeout
+        pending = self
+        while True:
+            if not pending.done.wait(max(deadline - time.monotonic(), 0)):
+                return {"success": False, "cmd": self.cmd, "id": self.id, "error": "timed out in command queue"}
+            if pending.superseded_by is None:
+                return pending.result
+            pending = pending.superseded_by
+
+
+class CommandQueue:
+    """Single writer for one serial port.
+
+    Commands are sent one at a time in priority order, at least
+    COMMAND_MIN_INTERVAL apart. A queued command is dropped when a later one
+    of the same group supersedes it (OFF after a queued ON, a second
+    MODE:...), and its callers receive the later command's result.
+    """
+
+    def __init__(self, connection, min_interval=COMMAND_MIN_INTERVAL):
+        self.connection = connection
+        self.min_interval = min_interval
+        self._heap = []
+        self._queued = {}  # group -> unsent PendingCommand
+        self._cond = Condition()
+        self._seq = itertools.count()
+        self._thread = None
+        self._stopping = False
+        self._last_write = 0.0
+
+    def submit(self, pending):
+        stats = self.connection.command_stats
+        with self._cond:
+            previous = self._queued.get(pending.group) if pending.group else None
+            if previous is not None:
+                if previous.cmd == pending.cmd:
+                    # Identical command already waiting: share it
+                    stats["coalesced"] += 1
+                    return previous
+                previous.superseded_by = pending
+                previous.done.set()
+                stats["coalesced"] += 1
+            if pending.group:
+                self._queued[pending.group] = pending
+            heapq.heappush(self._heap, (pending.priority, next(self._seq), pending))
+            stats["queued"] += 1
+            self._cond.notify()
+        return pending
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while not self._heap and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return None
+                pending = heapq.heappop(self._heap)[2]
+                if pending.superseded_by is not None:
+                    continue
+                if pending.group and self._queued.get(pending.group) is pending:
+                    del self._queued[pending.group]
+                return pending
+
+    def _run(self):
+        while True:
+            pending = self._next()
+            if pending is None:
+                return
+            wait = self._last_write + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                pending.result = self.connection.execute(pending)
+            except Exception as e:
+                pending.result = {"success": False, "cmd": pending.cmd, "id": pending.id, "error": str(e)}
+            self._last_write = time.monotonic()
+            pending.done.set()
+
+    def start(self):
+        with self._cond:
+            self._stopping = False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name=f"serial-writer-{self.connection.name}", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """End the writer thread once its current command is done; queued commands fail.
+
+        With a timeout, also wait that long for the thread to exit.
+        """
+        with self._cond:
+            self._stopping = True
+            heap, self._heap = self._heap, []
+            self._queued.clear()
+            self._cond.notify_all()
+            thread = self._thread
+        for _, _, pending in heap:
+            if not pending.done.is_set():
+                pending.result = {"success": False, "cmd": pending.cmd, "id": pending.id, "error": "connection closed"}
+                pending.done.set()
+        if timeout is not None and thread is not None and thread is not current_thread():
+            thread.join(timeout)
+
+    def depth(self):
+        return len(self._heap)
+
+
+def encode_command(cmd, cmd_id=None):
+    """Translate a backend command (ON, OFF, MODE:AUTO, INTERVAL:500, ...) into a firmware JSON line."""
+    name, _, value = cmd.upper().partition(":")
+    if name == "INTERVAL":
+        message = {"command": "set_interval", "ms": int(value)}
+    else:
+        message = dict(FIRMWARE_COMMANDS.get(cmd.upper(), {"command": cmd.lower()}))
+    if cmd_id is not None:
+        message["id"] = cmd_id
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+
+def encode_frame(frame_type, payload):
+    body = bytes((frame_type, len(payload))) + payload
+    return FRAME_SYNC + body + CRC_STRUCT.pack(crc_hqx(body, 0xFFFF))
+
+
+def encode_binary_command(cmd, cmd_id):
+    """Binary COMMAND frame, or None if cmd has no opcode (send it as JSON)."""
+    name, _, value = cmd.upper().partition(":")
+    opcode = BINARY_OPCODES.get(cmd.upper())
+    if name == "INTERVAL" and int(value) % 100 == 0 and 0 < int(value) <= 25500:
+        opcode = (OP_SET_INTERVAL, int(value) // 100)
+    if opcode is None:
         return None
-    
-    # Prefer Arduino ports, fallback to first available
-    for port_info in ports:
-        if 'arduino' in port_info.description.lower() or 'ch340' in port_info.description.lower():
-            return port_info.device
-    
-    return ports[0].device if ports else None
+    return encode_frame(FRAME_COMMAND, COMMAND_STRUCT.pack(cmd_id & 0xFFFFFFFF, *opcode))
 
 
-def init_serial(port=None):
-    global ser
-    if ser:
+log = get_logger("serial")
+
+COMMAND_RTT = histogram("serial_command_rtt_seconds", "Command write to firmware reply", ("connection",))
+
+_connections = weakref.WeakSet()  # every SerialConnection, for the /metrics collector
+
+
+@add_collector
+def _serial_metrics():
+    connections = sorted(_connections, key=lambda c: c.name)
+    for stat, name, help in (
+        ("bytes_read", "serial_bytes_read_total", "Bytes read from the port"),
+        ("lines_read", "serial_lines_read_total", "Text lines parsed"),
+        ("telemetry_frames", "serial_telemetry_frames_total", "Telemetry frames (JSON or binary)"),
+        ("parse_errors", "serial_parse_errors_total", "Unparseable lines or corrupt frames"),
+    ):
+        yield name, "counter", help, [({"connection": c.name}, c.reader_stats[stat]) for c in connections]
+    for stat, name, help in (
+        ("sent", "serial_commands_sent_total", "Command writes, including retries"),
+        ("acked", "serial_commands_acked_total", "Commands the firmware replied to"),
+        ("timeouts", "serial_command_timeouts_total", "Commands that got no reply after all retries"),
+        ("coalesced", "serial_commands_coalesced_total", "Queued commands superseded before sending"),
+        ("orphan_replies", "serial_orphan_replies_total", "Replies that matched no waiting command"),
+    ):
+        yield name, "counter", help, [({"connection": c.name}, c.command_stats[stat]) for c in connections]
+    for stat, name, help in (
+        ("disconnects", "serial_disconnects_total", "Times the port failed and was closed"),
+        ("reconnects", "serial_reconnects_total", "Times the supervisor reopened the port"),
+    ):
+        yield name, "counter", help, [({"connection": c.name}, c.link_stats[stat]) for c in connections]
+    yield "serial_command_queue_depth", "gauge", "Commands waiting for the writer", [
+        ({"connection": c.name}, c.queue.depth()) for c in connections]
+    yield "serial_connected", "gauge", "1 while the port is open", [
+        ({"connection": c.name}, c.is_connected()) for c in connections]
+
+
+class SerialConnection:
+    """One serial port: incremental line parser, reply matching and a command queue.
+
+    Bytes are fed in by a reader (the shared multiplexer, or a dedicated
+    thread); telemetry frames go to on_telemetry(snapshot, changed). When
+    the port fails the supervisor reopens it and calls on_reconnect(self).
+    """
+
+    def __init__(self, name="default", on_telemetry=None, on_reconnect=None):
+        _connections.add(self)
+        self.name = name
+        self.on_telemetry = on_telemetry
+        self.on_reconnect = on_reconnect
+        self.ser = None
+        self.port = None
+        self.auto_detect = False  # reconnect may rescan for the board instead of reopening self.port
+        self.telemetry = None
+        self.reading = False  # a reader is consuming this port, so replies can be matched
+        self.protocol = "json"  # "binary" once the firmware has acked PROTOCOL:BINARY
+        self.interval_ms = None  # telemetry interval last requested (None = firmware default)
+        self.ready = Event()  # set once the firmware has been heard from since open()
+        self._buf = bytearray()
+        self._responses = deque(maxlen=RESPONSE_BUFFER_SIZE)  # non-telemetry lines (command replies, status)
+        self._pending = OrderedDict()  # id -> PendingCommand awaiting a reply, oldest first
+        self._pending_lock = Lock()
+        self._reader_thread = None
+        self.queue = CommandQueue(self)
+        self.reader_stats = {
+            "bytes_read": 0,
+            "lines_read": 0,
+            "telemetry_frames": 0,
+            "parse_errors": 0
+        }
+        self.command_stats = {
+            "queued": 0,
+            "coalesced": 0,
+            "sent": 0,
+            "acked": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "orphan_replies": 0,
+            "last_rtt_ms": None
+        }
+        self.link_stats = {
+            "disconnects": 0,
+            "reconnects": 0
+        }
+
+    # ----- connection -----
+
+    def open(self, port):
+        """Open the port without waiting for the board; see wait_ready."""
+        self.close()
+        self._buf.clear()
+        self.protocol = "json"
+        self.interval_ms = None
+        self.ready.clear()
+        self.ser = serial.Serial(port, BAUD_RATE, timeout=TIMEOUT)
+        self.port = port
+
+    def wait_ready(self, timeout=SERIAL_READY_TIMEOUT):
+        """Wait until the firmware's ready banner (or any telemetry) arrives; False after timeout.
+
+        Opening the port resets most Arduinos, which then boot and print
+        {"status":"ready"}. Boards that don't reset (or the simulator) are
+        taken as ready at their first telemetry frame.
+        """
+        started = time.monotonic()
+        if self.reading:
+            ready = self.ready.wait(timeout)
+        else:
+            # Nobody else is reading this port yet: read it here until the banner shows up
+            deadline = started + timeout
+            port = self.ser
+            while port is not None and not self.ready.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                port.timeout = min(remaining, TIMEOUT)
+                try:
+                    chunk = port.read(min(max(port.in_waiting, 1), READ_CHUNK_SIZE))
+                except Exception as e:
+                    log.error("%s: read error: %s", self.name, e)
+                    break
+                if chunk:
+                    self.feed(chunk)
+            if port is not None:
+                port.timeout = TIMEOUT
+            ready = self.ready.is_set()
+        if ready:
+            log.info("%s: firmware ready after %.2fs", self.name, time.monotonic() - started)
+        else:
+            log.warning("%s: no ready banner within %.1fs, continuing anyway", self.name, timeout)
+        return ready
+
+    def close(self):
+        self.queue.stop()
+        port, self.ser = self.ser, None
+        if port is not None:
+            try:
+                port.close()
+            except Exception:
+                pass
+
+    def is_connected(self):
+        return self.ser is not None and getattr(self.ser, 'is_open', False)
+
+    def connection_lost(self, error, port=None):
+        """The port failed (unplugged, board gone): close it and hand it to the supervisor."""
+        if self.ser is None or (port is not None and port is not self.ser):
+            return  # already handled, or the error is from a port we've since replaced
+        log.warning("%s: connection lost: %s", self.name, error)
+        self.link_stats["disconnects"] += 1
+        self.close()
+        self.ready.clear()
+        multiplexer.refresh()
+        supervisor.watch(self)
+
+    def reconnect(self):
+        """Reopen the board (rescanning if it was auto-detected) and restore it; raises if still gone."""
+        port = self.port
+        if self.auto_detect and port not in list_ports():
+            port = find_available_port()
+        if not port:
+            raise OSError("no serial ports found")
+        self.open(port)
+        multiplexer.refresh()
+        self.wait_ready()
+        self.negotiate()
+        self.link_stats["reconnects"] += 1
+        log.info("%s: reconnected on %s", self.name, port)
+        if self.on_reconnect:
+            try:
+                self.on_reconnect(self)
+            except Exception as e:
+                log.exception("%s: restoring state after reconnect failed: %s", self.name, e)
+
+    # ----- reading -----
+
+    def feed(self, chunk):
+        """Append raw bytes and handle every complete line or binary frame."""
+        self.reader_stats["bytes_read"] += len(chunk)
+        buf = self._buf
+        buf += chunk
+
+        if FRAME_SYNC[0] in buf:
+            self._feed_mixed()
+            return
+
+        end = buf.rfind(b"\n")
+        if end < 0:
+            if len(buf) > MAX_LINE_LENGTH:
+                buf.clear()
+            return
+
+        for raw in bytes(buf[:end]).split(b"\n"):
+            self.handle_line(raw)
+        del buf[:end + 1]
+
+    def _feed_mixed(self):
+        """Walk a buffer holding binary frames and possibly JSON lines, in order."""
+        buf = self._buf
+        size = len(buf)
+        pos = 0
+        view = memoryview(buf)
+        try:
+            while pos < size:
+                if buf[pos] == FRAME_SYNC[0]:
+                    if size - pos < FRAME_OVERHEAD:
+                        break
+                    end = pos + FRAME_OVERHEAD + buf[pos + 3]
+                    if buf[pos + 1] != FRAME_SYNC[1]:
+                        pos += 1
+                        continue
+                    if end > size:
+                        break
+                    if crc_hqx(view[pos + 2:end - 2], 0xFFFF) != CRC_STRUCT.unpack_from(buf, end - 2)[0]:
+                        # Corrupt or false sync: resynchronise on the next byte
+                        self.reader_stats["parse_errors"] += 1
+                        pos += 1
+                        continue
+                    self.handle_frame(buf[pos + 2], view[pos + FRAME_HEADER:end - 2])
+                    pos = end
+                    continue
+
+                newline = buf.find(b"\n", pos)
+                sync = buf.find(FRAME_SYNC, pos)
+                if newline < 0 or 0 <= sync < newline:
+                    if sync < 0:
+                        if size - pos > MAX_LINE_LENGTH:
+                            pos = size
+                        break
+                    pos = sync  # text noise in front of a frame
+                    continue
+                self.handle_line(bytes(view[pos:newline]))
+                pos = newline + 1
+        finally:
+            view.release()
+        del buf[:pos]
+
+    def handle_frame(self, frame_type, payload):
+        """Decode one CRC-checked binary frame; payload is a memoryview into the read buffer."""
+        if frame_type == FRAME_TELEMETRY and len(payload) >= TELEMETRY_STRUCT.size:
+            percentage, millivolts, decidegrees, flags = TELEMETRY_STRUCT.unpack_from(payload)
+            self._telemetry({
+                "percentage": percentage,
+                "voltage": round(millivolts / 1000, 2),
+                "temperature": decidegrees / 10,
+                "isCharging": bool(flags & FLAG_CHARGING),
+                "ssrStatus": bool(flags & FLAG_SSR),
+                "autoCharge": bool(flags & FLAG_AUTO)
+            })
+        elif frame_type == FRAME_REPLY and len(payload) >= REPLY_STRUCT.size:
+            cmd_id, status, flags, percentage = REPLY_STRUCT.unpack_from(payload)
+            self.resolve_pending({
+                "id": cmd_id,
+                "status": "success" if status == 0 else "error",
+                "ssr": "on" if flags & FLAG_SSR else "off",
+                "autoCharge": bool(flags & FLAG_AUTO),
+                "percentage": percentage
+            })
+        else:
+            self.reader_stats["parse_errors"] += 1
+
+    def handle_line(self, raw):
+        """Parse one line from the firmware: telemetry is published, replies are matched."""
+        self.reader_stats["lines_read"] += 1
+        line = raw.strip()
+        if not line:
+            return
+        log.debug("%s RX %s", self.name, line)
+
+        if line[:1] == b"{":
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                self.reader_stats["parse_errors"] += 1
+                frame = None
+
+            if isinstance(frame, dict) and "status" in frame and self.resolve_pending(frame):
+                return
+
+            if isinstance(frame, dict) and frame.get("status") in ("success", "error"):
+                # A reply nobody waits for (late after a timeout, or a duplicate id); a STATUS
+                # reply carries a percentage but must not be taken for telemetry
+                self.command_stats["orphan_replies"] += 1
+                self._responses.append(line.decode(errors='ignore'))
+                return
+
+            if isinstance(frame, dict) and frame.get("status") == "ready":
+                # Board reset: it is back to JSON until asked again
+                self.ready.set()
+                self.interval_ms = None
+                if self.protocol != "json":
+                    self.protocol = "json"
+                    Thread(target=self.negotiate, name=f"serial-negotiate-{self.name}", daemon=True).start()
+
+            elif isinstance(frame, dict) and "percentage" in frame:
+                self._telemetry(frame)
+                return
+
+        self._responses.append(line.decode(errors='ignore'))
+
+    def _telemetry(self, frame):
+        snapshot = {key: frame.get(key) for key in TELEMETRY_FIELDS}
+        previous = self.telemetry or {}
+        changed = any(previous.get(key) != snapshot[key] for key in TELEMETRY_FIELDS)
+        snapshot["timestamp"] = time.time()
+        self.telemetry = snapshot
+        self.reader_stats["telemetry_frames"] += 1
+        self.ready.set()
+        if self.on_telemetry:
+            self.on_telemetry(snapshot, changed)
+
+    def negotiate(self):
+        """Switch the port to binary frames if configured and the firmware agrees."""
+        if SERIAL_PROTOCOL != "binary" or not self.reading or self.ser is None:
+            return self.protocol
+        result = self.send_command("PROTOCOL:BINARY", retries=0)
+        if result.get("success"):
+            self.protocol = "binary"
+        log.info("%s: protocol %s", self.name, self.protocol)
+        return self.protocol
+
+    def reader_loop(self):
+        """Blocking reader for platforms without select() on serial ports."""
+        current = None
+        while True:
+            port = self.ser
+            if port is None:
+                time.sleep(0.5)
+                continue
+
+            # Drop partial data left over from a previous connection
+            if port is not current:
+                current = port
+                self._buf.clear()
+
+            try:
+                # Blocks up to TIMEOUT for the first byte, then takes whatever is buffered
+                chunk = port.read(min(max(port.in_waiting, 1), READ_CHUNK_SIZE))
+            except Exception as e:
+                log.error("%s: read error: %s", self.name, e)
+                self.connection_lost(e, port)
+                continue
+
+            if chunk:
+                self.feed(chunk)
+
+    def start_reader_thread(self):
+        if self._reader_thread is None or not self._reader_thread.is_alive():
+            self._reader_thread = Thread(target=self.reader_loop, name=f"serial-reader-{self.name}", daemon=True)
+            self._reader_thread.start()
+        self.reading = True
+
+    def read_serial(self):
+        """Return pending non-telemetry serial lines. Non-blocking; returns list of lines."""
+        if self.reading:
+            lines = []
+            while True:
+                try:
+                    lines.append(self._responses.popleft())
+                except IndexError:
+                    return lines
+
+        if not self.ser:
+            return []
+
+        lines = []
         try:
-            ser.close()
-        except Exception:
+            while self.ser.in_waiting:
+                line = self.ser.readline().decode(errors='ignore').strip()
+                if line:
+                    lines.append(line)
+        except Exception as e:
+            log.error("%s: error reading serial: %s", self.name, e)
+
+        return lines
+
+    # ----- commands -----
+
+    def resolve_pending(self, frame):
+        """Hand a firmware reply to the command waiting for it. Returns True if matched."""
+        cmd_id = frame.get("id")
+        with self._pending_lock:
+            if cmd_id is not None:
+                pending = self._pending.pop(cmd_id, None)
+            elif self._pending and frame.get("status") in ("success", "error"):
+                # Firmware without id echo: replies arrive in command order
+                pending = self._pending.popitem(last=False)[1]
+            else:
+                pending = None
+        if pending is None:
+            return False
+        pending.response = frame
+        pending.acked_at = time.perf_counter()
+        pending.event.set()
+        return True
+
+    def execute(self, pending):
+        """Write one command (writer thread only) and wait for its reply, with retries."""
+        port = self.ser
+        stats = self.command_stats
+        if port is None:
+            return {"success": False, "cmd": pending.cmd, "id": pending.id, "error": "Serial not connected"}
+
+        if not self.reading:
+            # Without a reader nothing can match replies: fire-and-forget
+            try:
+                port.write(encode_command(pending.cmd))
+            except (serial.SerialException, OSError) as e:
+                self.connection_lost(e, port)
+                return {"success": False, "cmd": pending.cmd, "id": pending.id, "error": f"write failed: {e}"}
+            stats["sent"] += 1
+            return {"success": True, "cmd": pending.cmd, "id": pending.id, "acked": None}
+
+        data = None
+        if self.protocol == "binary":
+            data = encode_binary_command(pending.cmd, pending.id)
+        if data is None:
+            data = encode_command(pending.cmd, pending.id)
+        try:
+            for attempt in range(pending.retries + 1):
+                with self._pending_lock:
+                    self._pending[pending.id] = pending
+                pending.sent_at = time.perf_counter()
+                try:
+                    port.write(data)
+                except (serial.SerialException, OSError) as e:
+                    # One failed write per outage: the port is closed until the supervisor reopens it
+                    self.connection_lost(e, port)
+                    return {"success": False, "cmd": pending.cmd, "id": pending.id, "error": f"write failed: {e}"}
+                log.debug("%s TX %s (id %d)", self.name, pending.cmd, pending.id)
+                stats["sent"] += 1
+
+                if pending.event.wait(pending.timeout):
+                    break
+                stats["retries" if attempt < pending.retries else "timeouts"] += 1
+            else:
+                return {
+                    "success": False,
+                    "cmd": pending.cmd,
+                    "id": pending.id,
+                    "error": f"no reply after {pending.retries + 1} attempt(s)"
+                }
+        finally:
+            with self._pending_lock:
+                self._pending.pop(pending.id, None)
+
+        rtt_ms = round((pending.acked_at - pending.sent_at) * 1000, 3)
+        stats["acked"] += 1
+        stats["last_rtt_ms"] = rtt_ms
+        COMMAND_RTT.observe(pending.acked_at - pending.sent_at, self.name)
+        response = pending.response
+        result = {
+            "success": response.get("status") == "success",
+            "cmd": pending.cmd,
+            "id": pending.id,
+            "acked": True,
+            "rtt_ms": rtt_ms,
+            "attempts": attempt + 1,
+            "response": response
+        }
+        if not result["success"]:
+            result["error"] = response.get("error", "command rejected by firmware")
+        return result
+
+    def send_command(self, cmd: str, timeout=COMMAND_TIMEOUT, retries=COMMAND_RETRIES, wait=True):
+        """Queue a command for this port's writer and (by default) wait for its result.
+
+        Replies are matched by correlation id. Without a running reader there is
+        nothing to match replies, so the command is sent fire-and-forget.
+        """
+        if not self.ser:
+            msg = "Serial not connected"
+            log.warning("%s: %s, dropping %s", self.name, msg, cmd)
+            return {"success": False, "error": msg}
+
+        self.queue.start()
+        cmd = cmd.upper()
+        pending = self.queue.submit(PendingCommand(next(_command_ids), cmd, timeout, retries))
+        if not wait:
+            return {"success": True, "cmd": cmd, "id": pending.id, "queued": True}
+        return pending.wait((retries + 1) * timeout + COMMAND_QUEUE_WAIT)
+
+    def set_telemetry_interval(self, ms, wait=False):
+        """Ask the firmware to report every ms milliseconds."""
+        self.interval_ms = ms
+        return self.send_command(f"INTERVAL:{ms}", wait=wait)
+
+    def get_command_stats(self):
+        return dict(self.command_stats, queue_depth=self.queue.depth())
+
+
+class SerialMultiplexer:
+    """One thread reading every registered port via select().
+
+    Per-port cost is a registered file descriptor rather than a thread.
+    Only usable where serial ports are selectable file descriptors (POSIX).
+    """
+
+    def __init__(self):
+        self._connections = set()
+        self._lock = Lock()
+        self._thread = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+
+    @staticmethod
+    def supported():
+        return os.name == "posix"
+
+    def add(self, connection):
+        with self._lock:
+            self._connections.add(connection)
+        connection.reading = True
+        self.start()
+        self.refresh()
+
+    def remove(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+        connection.reading = False
+        self.refresh()
+
+    def refresh(self):
+        """Re-read registrations (call after a port is opened or closed)."""
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
             pass
 
+    def _register_all(self, selector):
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not self._wake_r:
+                selector.unregister(key.fileobj)
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            port = connection.ser
+            if port is not None:
+                try:
+                    selector.register(port.fileno(), selectors.EVENT_READ, (connection, port))
+                except (OSError, ValueError) as e:
+                    log.error("%s: cannot watch port: %s", connection.name, e)
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._register_all(selector)
+        while True:
+            key = connection = port = None  # don't keep a removed connection alive while blocked
+            for key, _ in selector.select():
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    self._register_all(selector)
+                    break
+
+                connection, port = key.data
+                if port is not connection.ser:
+                    continue  # reconnected; picked up on the next refresh
+                try:
+                    chunk = port.read(min(max(port.in_waiting, 1), READ_CHUNK_SIZE))
+                except Exception as e:
+                    log.error("%s: read error: %s", connection.name, e)
+                    selector.unregister(key.fileobj)
+                    connection.connection_lost(e, port)
+                    continue
+                if chunk:
+                    connection.feed(chunk)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="serial-mux", daemon=True)
+                self._thread.start()
+
+
+multiplexer = SerialMultiplexer()
+
+
+class ConnectionSupervisor:
+    """Reopens lost ports in the background with exponential backoff.
+
+    A lost connection is retried after RECONNECT_INITIAL seconds, then at
+    doubling intervals up to RECONNECT_MAX. On Linux a tty hotplug event
+    retries every lost port at once, and unplugging an open port marks it
+    lost straight away instead of waiting for the next read or write to fail.
+    """
+
+    def __init__(self, initial=RECONNECT_INITIAL, max_delay=RECONNECT_MAX):
+        self.initial = initial
+        self.max_delay = max_delay
+        self._lost = {}  # connection -> [next attempt (monotonic), current delay]
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread = None
+        self._hotplug = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="serial-supervisor", daemon=True)
+                self._thread.start()
+            if RECONNECT_HOTPLUG and self._hotplug is None:
+                self._hotplug = start_hotplug_monitor(self._on_hotplug) or False
+        return self
+
+    def watch(self, connection):
+        """Start retrying a connection that has no open port."""
+        with self._lock:
+            if connection not in self._lost:
+                self._lost[connection] = [time.monotonic() + self.initial, self.initial]
+        self.start()
+        self._wake.set()
+
+    def forget(self, connection):
+        """Stop retrying (the port was reopened by hand, or the device was removed)."""
+        with self._lock:
+            self._lost.pop(connection, None)
+
+    def retry_soon(self):
+        """A port appeared: retry everything shortly (udev may still be creating the node) with fresh backoff."""
+        with self._lock:
+            for entry in self._lost.values():
+                entry[:] = [time.monotonic() + self.initial, self.initial]
+        self._wake.set()
+
+    def lost(self):
+        with self._lock:
+            return [c.name for c in self._lost]
+
+    def _on_hotplug(self, action, device):
+        inventory.invalidate()
+        if action == "add":
+            self.retry_soon()
+            return
+        for connection in list(_connections):
+            if connection.port and os.path.realpath(connection.port) == device:
+                connection.connection_lost(f"{device} unplugged")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = [c for c, (at, _) in self._lost.items() if at <= now]
+                upcoming = min((at for at, _ in self._lost.values()), default=None)
+            if not due:
+                self._wake.wait(None if upcoming is None else max(upcoming - now, 0))
+                self._wake.clear()
+                continue
+
+            for connection in due:
+                try:
+                    connection.reconnect()
+                except Exception as e:
+                    connection.close()
+                    with self._lock:
+                        entry = self._lost.get(connection)
+                        if entry is not None:
+                            entry[1] = min(entry[1] * 2, self.max_delay)
+                            entry[0] = time.monotonic() + entry[1]
+                            log.info("%s: reconnect failed (%s); next try in %.1fs", connection.name, e, entry[1])
+                else:
+                    self.forget(connection)
+
+
+supervisor = ConnectionSupervisor()
+
+
+def use_multiplexer(mux):
+    """Replace the shared reader; the asyncio runtime reads ports from its event loop."""
+    global multiplexer
+    multiplexer = mux
+
+
+def attach_reader(connection):
+    """Start reading a connection: through the multiplexer if possible, else its own thread."""
+    if connection.reading:
+        return
+    if multiplexer.supported():
+        multiplexer.add(connection)
+    else:
+        connection.start_reader_thread()
+
+
+def detach_reader(connection):
+    multiplexer.remove(connection)
+
+
+# ===== Default connection (the single board driven by app.py) =====
+
+def _publish_default_telemetry(snapshot, changed):
+    publish_battery_data(snapshot)
+    log_data(snapshot)
+    if changed:
+        publish("telemetry", snapshot)
+
+
+default_connection = SerialConnection("default", on_telemetry=_publish_default_telemetry)
+reader_stats = default_connection.reader_stats
+command_stats = default_connection.command_stats
+
+
+def find_available_port():
+    """Auto-detect Arduino/serial device port (Arduino and USB-serial VID/PIDs first, see ports.py)"""
+    return inventory.find_board()
+
+
+def init_serial(port=None):
+    default_connection.auto_detect = not port
     if not port:
         port = find_available_port()
         if not port:
             raise Exception("No serial ports found")
-        print(f"[Serial] Auto-detected port: {port}")
+        log.info("Auto-detected port: %s", port)
 
-    ser = serial.Serial(port, BAUD_RATE, timeout=TIMEOUT)
-    _port = port
-    time.sleep(2)
-    print(f"[Serial] Connected: {port}")
+    default_connection.port = port  # kept even if opening fails, for the supervisor
+    default_connection.open(port)
+    supervisor.forget(default_connection)
+    supervisor.start()  # hotplug: notice an unplug before the next write fails
+    multiplexer.refresh()
+    log.info("Connected: %s", port)
+    default_connection.wait_ready()
+    if default_connection.reading:
+        default_connection.negotiate()
 
 
-def send_command(cmd: str):
-    """Send a command to the serial device and return a result dict."""
-    if not ser:
-        msg = "Serial not connected"
-        print(msg)
-        return {"success": False, "error": msg}
+def keep_reconnecting():
+    """Retry the default board in the background, e.g. when none was attached at startup."""
+    if not default_connection.is_connected():
+        supervisor.watch(default_connection)
 
-    try:
-        ser.write((cmd + "\n").encode())
-        print(f">> SENT: {cmd}")
-        return {"success": True, "cmd": cmd}
-    except Exception as e:
-        print("Failed to send command:", e)
-        return {"success": False, "error": str(e)}
 
+def set_reconnect_handler(fn):
+    """fn(connection) runs after the default board has been reopened by the supervisor."""
+    default_connection.on_reconnect = fn
 
-def read_serial():
-    """Read and print any pending serial lines. Non-blocking; returns list of lines."""
-    if not ser:
-        return []
 
-    lines = []
-    try:
-        while ser.in_waiting:
-            line = ser.readline().decode(errors='ignore').strip()
-            if line:
-                print("<<", line)
-                lines.append(line)
-    except Exception as e:
-        print("Error reading serial:", e)
+def send_command(cmd: str, timeout=COMMAND_TIMEOUT, retries=COMMAND_RETRIES, wait=True):
+    """Queue a command for the default board; see SerialConnection.send_command."""
+    return default_connection.send_command(cmd, timeout, retries, wait)
+
 
-    return lines
+def get_command_stats():
+    return default_connection.get_command_stats()
+
+
+def start_reader():
+    """Start reading the default port in the background (idempotent)."""
+    if default_connection.reading:
+        return
+    attach_reader(default_connection)
+    default_connection.negotiate()
+
+
+def read_serial():
+    """Return pending non-telemetry serial lines. Non-blocking; returns list of lines."""
+    return default_connection.read_serial()
 
 
 def list_ports():
-    ports = serial.tools.list_ports.comports()
-    return [p.device for p in ports]
+    return inventory.devices()
 
 
 def is_connected():
-    return ser is not None and getattr(ser, 'is_open', False)
+    return default_connection.is_connected()
 
 
 def get_port():
-    return _port
+    return default_connection.port
+
+
+def is_reconnecting():
+    return default_connection.name in supervisor.lost()
+
+
+def get_protocol():
+    return default_connection.protocol
+
+
+def get_telemetry_interval():
+    return default_connection.interval_ms
+
+
+def set_telemetry_interval(ms):
+    """Ask the default board to report every ms milliseconds (does not wait for the ack)."""
+    return default_connection.set_telemetry_interval(ms)
 
 
 def connect_port(port: str):
@@ -94,4 +1045,4 @@ def connect_port(port: str):
         init_serial(port)
         return {"success": True, "port": port}
     except Exception as e:
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,16 @@
+"""Ready-banner wait shared by the standalone charger scripts (charger*.py).
+
+The backend itself uses SerialConnection.wait_ready, which works off its reader thread.
+"""
+import time
+from config import SERIAL_READY_TIMEOUT
+
+
+def wait_for_ready(ser, timeout=SERIAL_READY_TIMEOUT):
+    """Return once the board prints {"status":"ready"} or telemetry, instead of sleeping blindly."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        line = ser.readline()
+        if b'"ready"' in line or b'"percentage"' in line:
+            return True
+    return False
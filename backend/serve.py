@@ -0,0 +1,278 @@
+"""Multi-process serving: python serve.py instead of python app.py.
+
+One owner process holds all state (serial port, controller, sensors, DB
+writer). HTTP is served by SERVE_WORKERS worker processes sharing the
+listening socket. Each worker keeps a replica of the owner's event broker,
+fed over a local authenticated socket, and uses it to answer /api/stream
+and cached reads (/api/snapshot with its ETag, /api/battery, ...) by itself.
+Everything else is forwarded to the owner and runs the normal Flask views.
+"""
+import io
+import os
+import queue
+import socket
+import sys
+import time
+from multiprocessing import get_context
+from multiprocessing.connection import Listener, Client
+from threading import Thread, Lock, local
+
+from events import broker
+from log import get_logger, setup_logging
+from config import SERVE_WORKERS, STATE_MIRROR_QUEUE, SSE_HEARTBEAT
+
+HOST = "127.0.0.1"
+PORT = 5000
+
+log = get_logger("serve")
+
+# Worker-answered GETs, valid for as long as the broker version is unchanged
+CACHED_ROUTES = {"/api/snapshot", "/api/battery", "/api/mode", "/api/thresholds"}
+
+
+# ===== Owner side =====
+
+class StateServer:
+    """Runs requests forwarded by workers and streams broker changes to them."""
+
+    def __init__(self, authkey=None):
+        self.authkey = authkey or os.urandom(16)
+        self.listener = Listener((HOST, 0), authkey=self.authkey)
+        self.address = self.listener.address
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._accept, name="state-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                log.warning("Rejected state connection: %s", e)
+                continue
+            Thread(target=self._serve, args=(conn,), name="state-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            if conn.recv() == "mirror":
+                self._mirror(conn)
+                return
+            while True:
+                cgi, body = conn.recv()
+                conn.send(self._call(cgi, body))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _call(self, cgi, body):
+        import app as backend  # owner only; workers never import the Flask app
+        environ = dict(cgi)
+        environ.update({
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False
+        })
+        try:
+            return backend.call_wsgi(environ)
+        except Exception as e:
+            log.exception("Forwarded request failed: %s", e)
+            return "500 INTERNAL SERVER ERROR", [("Content-Type", "text/plain")], b"internal error"
+
+    def _mirror(self, conn):
+        import app as backend
+        changes = queue.Queue(maxsize=STATE_MIRROR_QUEUE)
+
+        def push(*change):
+            try:
+                changes.put_nowait(change)
+            except queue.Full:
+                pass  # the sender notices and drops the replica, which then resyncs
+
+        state = broker.add_mirror(push)
+        try:
+            conn.send(("reset", backend._BOOT_ID, state))
+            while True:
+                if changes.full():
+                    log.warning("Worker fell behind; forcing a resync")
+                    return
+                conn.send(changes.get())
+        finally:
+            broker.remove_mirror(push)
+
+
+# ===== Worker side =====
+
+class Replica:
+    """Keeps the local broker in step with the owner's; reconnects and resyncs on loss."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.boot_id = None
+        self.synced = False
+        self._slots = set()
+
+    def _run(self):
+        while True:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+                conn.send("mirror")
+                _, self.boot_id, state = conn.recv()
+                self._reset(state)
+                self.synced = True
+                while True:
+                    op, event, key, data, message, version = conn.recv()
+                    broker.apply(op, event, key, data, message, version)
+                    if op == "forget":
+                        self._slots.discard((event, key))
+                    else:
+                        self._slots.add((event, key))
+            except (EOFError, OSError) as e:
+                if self.synced:
+                    log.warning("Worker %d lost owner state feed: %s", os.getpid(), e)
+                self.synced = False
+                time.sleep(1)
+
+    def _reset(self, state):
+        fresh = {(event, key) for _, event, key, *_ in state}
+        for event, key in self._slots - fresh:
+            broker.apply("forget", event, key, None, None, broker.version)
+        for change in state:
+            broker.apply(*change)
+        self._slots = fresh
+
+    def start(self):
+        Thread(target=self._run, name="state-replica", daemon=True).start()
+        return self
+
+
+class OwnerClient:
+    """Forwards requests to the owner, one connection per worker thread."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = local()
+
+    def forward(self, environ, body):
+        cgi = {k: v for k, v in environ.items() if k.isupper() and isinstance(v, str)}
+        conn = getattr(self._local, "conn", None)
+        try:
+            if conn is None:
+                conn = self._local.conn = Client(self.address, authkey=self.authkey)
+                conn.send("call")
+            conn.send((cgi, body))
+            return conn.recv()
+        except (EOFError, OSError) as e:
+            self._local.conn = None
+            return "502 BAD GATEWAY", [("Content-Type", "text/plain")], f"owner unavailable: {e}".encode()
+
+
+def make_worker_app(replica, owner):
+    from werkzeug.wrappers import Request, Response
+
+    cache = {}  # path -> (version, status, headers, body)
+    cache_lock = Lock()
+
+    def stream():
+        q = broker.subscribe()
+        try:
+            yield "retry: 2000\n\n"
+            for message in broker.current_messages():
+                yield message
+            while True:
+                try:
+                    yield q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(q)
+
+    @Request.application
+    def worker_app(request):
+        path = request.path
+        if path == "/api/stream":
+            # Never forwarded: the owner buffers whole responses and an event stream never ends
+            if not replica.synced:
+                return Response("state replica not synced yet", status=503, mimetype="text/plain",
+                                headers={"Retry-After": "1", "Access-Control-Allow-Origin": "*"})
+            return Response(stream(), mimetype="text/event-stream", headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+                "Access-Control-Allow-Origin": "*"
+            })
+
+        if request.method == "GET" and replica.synced:
+            if path in CACHED_ROUTES and not request.query_string:
+                version = broker.version
+                # Same ETag the owner's /api/snapshot would produce
+                etag = f"{replica.boot_id}-{version}"
+                if path == "/api/snapshot" and etag in request.if_none_match:
+                    response = Response(status=304, headers={"Access-Control-Allow-Origin": "*",
+                                                             "Access-Control-Expose-Headers": "ETag"})
+                    response.set_etag(etag)
+                    return response
+                hit = cache.get(path)
+                if hit is None or hit[0] != version:
+                    status, headers, body = owner.forward(request.environ, b"")
+                    if not status.startswith("200"):
+                        return Response(body, status=status, headers=headers)
+                    hit = (version, status, headers, body)
+                    with cache_lock:
+                        cache[path] = hit
+                return Response(hit[3], status=hit[1], headers=hit[2])
+
+        status, headers, body = owner.forward(request.environ, request.get_data())
+        return Response(body, status=status, headers=headers)
+
+    return worker_app
+
+
+def run_worker(sock, address, authkey):
+    from werkzeug.serving import make_server
+    setup_logging()
+    replica = Replica(address, authkey).start()
+    app = make_worker_app(replica, OwnerClient(address, authkey))
+    server = make_server(HOST, PORT, app, threaded=True, fd=sock.fileno())
+    log.info("Worker %d serving", os.getpid())
+    server.serve_forever()
+
+
+def main():
+    import app as backend
+    backend.init_state()
+    backend.start_battery_sampler()
+    backend.start_reader()
+    backend.connect_serial_in_background()
+    backend.start_controller()
+
+    state = StateServer().start()
+    sock = socket.create_server((HOST, PORT))
+    workers = SERVE_WORKERS or os.cpu_count() or 1
+    # Spawned, not forked: the owner's threads are already running, and a fork taken while
+    # one of them holds a lock (broker, log queue, serial) leaves it locked in the worker
+    spawn = get_context("spawn")
+    processes = [spawn.Process(target=run_worker, args=(sock, state.address, state.authkey), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    log.info("%d worker(s) on http://localhost:%d", workers, PORT)
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
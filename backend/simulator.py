@@ -0,0 +1,332 @@
+"""Virtual charger board on a Linux pseudo-terminal, for testing without hardware.
+
+    python simulator.py --link /tmp/ttyCHARGER --speed 60
+    BATTERY_SERIAL_PORT=/tmp/ttyCHARGER python app.py
+
+Implements the firmware in firmware/src/main.cpp: the ready banner, JSON and
+binary telemetry, every command (with id echo), autoControlCharger and the
+over-temperature cutoff. The analog front end is replaced by a battery
+model, and --speed runs battery time faster than wall-clock time. --noise
+adds ADC jitter to the voltage reading (and so to the percentage), and
+--count N starts N boards for load tests.
+"""
+import argparse
+import json
+import os
+import random
+import selectors
+import time
+import tty
+
+from serial_handler import encode_frame, FRAME_SYNC, FRAME_OVERHEAD, FRAME_TELEMETRY, FRAME_COMMAND, FRAME_REPLY
+from serial_handler import TELEMETRY_STRUCT, COMMAND_STRUCT, REPLY_STRUCT, CRC_STRUCT, OP_SET_INTERVAL
+from serial_handler import FLAG_CHARGING, FLAG_SSR, FLAG_AUTO
+from binascii import crc_hqx
+
+# Firmware constants (main.cpp)
+BATTERY_MAX_VOLTAGE = 4.2
+BATTERY_MIN_VOLTAGE = 3.0
+CHARGE_START = 20
+CHARGE_STOP = 95
+TEMP_MAX = 45
+SEND_INTERVAL_MIN = 100
+SEND_INTERVAL_MAX = 60000
+
+# Li-ion open-circuit voltage by state of charge
+OCV_CURVE = [(0.0, 3.00), (0.05, 3.45), (0.10, 3.60), (0.20, 3.68), (0.40, 3.75),
+             (0.60, 3.85), (0.80, 3.98), (0.90, 4.07), (1.0, 4.20)]
+
+
+class Battery:
+    """Single Li-ion cell: coulomb counting, CC/CV charge taper, I^2R heating."""
+
+    def __init__(self, capacity_mah=2000, soc=0.5, charge_ma=1000, discharge_ma=300,
+                 resistance=0.08, ambient=28.0, heating=6.0, thermal_tau=300.0):
+        self.capacity_mah = capacity_mah
+        self.soc = soc
+        self.charge_ma = charge_ma
+        self.discharge_ma = discharge_ma
+        self.resistance = resistance
+        self.ambient = ambient
+        self.heating = heating          # degrees C above ambient at 1 A, steady state
+        self.thermal_tau = thermal_tau  # seconds
+        self.temperature = ambient
+        self.current_ma = -discharge_ma
+
+    def ocv(self):
+        for (s0, v0), (s1, v1) in zip(OCV_CURVE, OCV_CURVE[1:]):
+            if self.soc <= s1:
+                return v0 + (v1 - v0) * (self.soc - s0) / (s1 - s0)
+        return OCV_CURVE[-1][1]
+
+    def voltage(self):
+        return self.ocv() + self.current_ma / 1000 * self.resistance
+
+    def step(self, dt, charging):
+        """Advance dt simulated seconds with the charger on or off."""
+        if charging:
+            # Constant current up to 80 %, then the CV phase tapers to 5 %
+            taper = 1.0 if self.soc < 0.8 else max(0.05, (1.0 - self.soc) / 0.2)
+            self.current_ma = self.charge_ma * taper
+        else:
+            self.current_ma = -self.discharge_ma
+        self.soc = min(1.0, max(0.0, self.soc + self.current_ma * dt / 3600 / self.capacity_mah))
+
+        target = self.ambient + self.heating * (self.current_ma / 1000) ** 2
+        self.temperature += (target - self.temperature) * min(1.0, dt / self.thermal_tau)
+
+
+class VirtualBoard:
+    """Firmware behaviour on the master side of a pty."""
+
+    def __init__(self, battery, speed=1.0, noise=0.0):
+        self.battery = battery
+        self.speed = speed
+        self.noise = noise  # ADC noise on the voltage divider, standard deviation in volts
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+
+        self.ssr_enabled = False
+        self.auto_charge = True
+        self.backend_auto = False
+        self.binary = False
+        self.send_interval = 2.0
+        self._rx = bytearray()
+        self._last_step = time.monotonic()
+        self._last_send = 0.0
+        self.stats = {"frames_sent": 0, "commands": 0, "dropped_bytes": 0}
+        self.write(b'{"status":"ready"}\r\n')
+
+    # ----- firmware -----
+
+    def read_voltage(self):
+        """One reading of the voltage divider, with ADC noise when enabled."""
+        v = self.battery.voltage()
+        return v + random.gauss(0.0, self.noise) if self.noise else v
+
+    def percentage(self, v=None):
+        v = self.read_voltage() if v is None else v
+        pct = int((v - BATTERY_MIN_VOLTAGE) / (BATTERY_MAX_VOLTAGE - BATTERY_MIN_VOLTAGE) * 100)
+        return min(100, max(0, pct))
+
+    def is_charging(self):
+        return self.ssr_enabled and self.battery.soc < 1.0
+
+    def auto_control(self):
+        pct = self.percentage()
+        if pct <= CHARGE_START and not self.ssr_enabled:
+            self.ssr_enabled = True
+        if pct >= CHARGE_STOP and self.ssr_enabled:
+            self.ssr_enabled = False
+
+    def over_temperature_cutoff(self):
+        if self.battery.temperature > TEMP_MAX and self.ssr_enabled:
+            self.ssr_enabled = False
+
+    def flags(self):
+        return ((FLAG_CHARGING if self.is_charging() else 0) | (FLAG_SSR if self.ssr_enabled else 0)
+                | (FLAG_AUTO if self.auto_charge else 0))
+
+    def set_interval(self, ms):
+        if ms < SEND_INTERVAL_MIN or ms > SEND_INTERVAL_MAX:
+            return False
+        self.send_interval = ms / 1000
+        return True
+
+    def run_command(self, op, arg):
+        """runCommand() from main.cpp; returns False for unknown opcodes."""
+        self.stats["commands"] += 1
+        if op == 1:
+            self.ssr_enabled = True
+        elif op == 2:
+            self.ssr_enabled = False
+        elif op == 3:
+            self.auto_charge = not self.auto_charge
+        elif op == 4:
+            # The backend drives the relay from now on; the mode is only recorded
+            self.backend_auto = arg == 1
+            self.auto_charge = False
+        elif op == OP_SET_INTERVAL:
+            return self.set_interval(arg * 100)
+        elif op not in (5, 6):
+            return False
+        return True
+
+    def process_command(self, line):
+        try:
+            doc = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(doc, dict):
+            return
+        cmd = doc.get("command")
+        reply = {"status": "success"}
+        if cmd == "ssr_on":
+            self.run_command(1, 0)
+            reply["ssr"] = "on"
+        elif cmd == "ssr_off":
+            self.run_command(2, 0)
+            reply["ssr"] = "off"
+        elif cmd == "toggle_auto":
+            self.run_command(3, 0)
+            reply["autoCharge"] = self.auto_charge
+        elif cmd == "set_mode":
+            self.run_command(4, 1 if doc.get("mode") == "AUTO" else 0)
+            reply["mode"] = "AUTO" if self.backend_auto else "MANUAL"
+            reply["autoCharge"] = self.auto_charge
+        elif cmd == "status":
+            reply.update(ssr="on" if self.ssr_enabled else "off", autoCharge=self.auto_charge,
+                         percentage=self.percentage())
+        elif cmd == "ping":
+            reply["pong"] = True
+        elif cmd == "set_interval":
+            if self.set_interval(int(doc.get("ms") or 0)):
+                reply["interval"] = int(self.send_interval * 1000)
+            else:
+                reply.update(status="error", error="interval out of range")
+        elif cmd == "set_protocol":
+            self.binary = doc.get("protocol") == "binary"
+            reply["protocol"] = "binary" if self.binary else "json"
+        else:
+            reply.update(status="error", error="unknown command")
+        if isinstance(doc.get("id"), int) and doc["id"] >= 0:
+            reply["id"] = doc["id"]
+        self.write(json.dumps(reply, separators=(",", ":")).encode() + b"\r\n")
+
+    def process_frame(self, frame):
+        length = frame[3]
+        if (frame[2] != FRAME_COMMAND or length < COMMAND_STRUCT.size
+                or CRC_STRUCT.unpack_from(frame, len(frame) - 2)[0] != crc_hqx(frame[2:-2], 0xFFFF)):
+            return
+        cmd_id, op, arg = COMMAND_STRUCT.unpack_from(frame, 4)
+        ok = self.run_command(op, arg)
+        self.write(encode_frame(FRAME_REPLY, REPLY_STRUCT.pack(cmd_id, 0 if ok else 1, self.flags(), self.percentage())))
+
+    def send_data(self):
+        self.stats["frames_sent"] += 1
+        voltage = self.read_voltage()
+        pct = self.percentage(voltage)
+        if self.binary:
+            millivolts = int(voltage * 1000 + 0.5)
+            self.write(encode_frame(FRAME_TELEMETRY, TELEMETRY_STRUCT.pack(
+                pct, millivolts, round(self.battery.temperature * 10), self.flags())))
+            return
+        self.write(json.dumps({
+            "percentage": pct,
+            "voltage": round(voltage, 2),
+            "temperature": round(self.battery.temperature, 1),
+            "isCharging": self.is_charging(),
+            "ssrStatus": self.ssr_enabled,
+            "autoCharge": self.auto_charge
+        }, separators=(",", ":")).encode() + b"\r\n")
+
+    # ----- I/O -----
+
+    def write(self, data):
+        try:
+            os.write(self.master, data)
+        except (BlockingIOError, OSError):
+            # Nobody reading the port: a UART would drop it too
+            self.stats["dropped_bytes"] += len(data)
+
+    def on_readable(self):
+        try:
+            self._rx += os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        rx = self._rx
+        while rx:
+            if rx[0] == FRAME_SYNC[0]:
+                if len(rx) < FRAME_OVERHEAD or len(rx) < FRAME_OVERHEAD + rx[3]:
+                    break
+                end = FRAME_OVERHEAD + rx[3]
+                if rx[1] == FRAME_SYNC[1]:
+                    self.process_frame(bytes(rx[:end]))
+                    del rx[:end]
+                else:
+                    del rx[:1]
+                continue
+            newline = min((i for i in (rx.find(b"\n"), rx.find(b"\r")) if i >= 0), default=-1)
+            if newline < 0:
+                break
+            line = bytes(rx[:newline]).strip()
+            del rx[:newline + 1]
+            if line:
+                self.process_command(line)
+
+    def tick(self, now):
+        """Advance the battery and send telemetry when due; returns seconds until the next send."""
+        self.battery.step((now - self._last_step) * self.speed, self.is_charging())
+        self._last_step = now
+        if self.auto_charge:
+            self.auto_control()
+        # Safety cutoff applies in every mode, with or without a backend
+        self.over_temperature_cutoff()
+        if now - self._last_send >= self.send_interval:
+            self.send_data()
+            self._last_send = now
+        return self._last_send + self.send_interval - now
+
+
+def run(boards, report_every=10.0):
+    selector = selectors.DefaultSelector()
+    for board in boards:
+        selector.register(board.master, selectors.EVENT_READ, board)
+
+    last_report = time.monotonic()
+    while True:
+        now = time.monotonic()
+        wait = min(board.tick(now) for board in boards)
+        for key, _ in selector.select(max(0.0, min(wait, 0.05))):
+            key.data.on_readable()
+
+        if report_every and now - last_report >= report_every:
+            last_report = now
+            for i, board in enumerate(boards):
+                b = board.battery
+                print(f"[SIM {i}] soc={b.soc * 100:.1f}% pct={board.percentage()} v={b.voltage():.3f} "
+                      f"t={b.temperature:.1f}C ssr={'ON' if board.ssr_enabled else 'OFF'} "
+                      f"auto={board.auto_charge} every={board.send_interval}s {board.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual charger board on a pseudo-terminal")
+    parser.add_argument("--count", type=int, default=1, help="number of boards")
+    parser.add_argument("--link", help="symlink to the pty (index appended when --count > 1)")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--interval", type=int, default=2000, help="initial telemetry interval (ms)")
+    parser.add_argument("--soc", type=float, default=50, help="initial state of charge (%%)")
+    parser.add_argument("--capacity", type=float, default=2000, help="capacity (mAh)")
+    parser.add_argument("--charge-current", type=float, default=1000, help="charge current (mA)")
+    parser.add_argument("--discharge-current", type=float, default=300, help="load current (mA)")
+    parser.add_argument("--noise", type=float, default=0.0, help="ADC noise on the voltage reading (V, std dev)")
+    parser.add_argument("--report", type=float, default=10.0, help="seconds between status lines (0 = quiet)")
+    args = parser.parse_args()
+
+    boards = []
+    for i in range(args.count):
+        battery = Battery(capacity_mah=args.capacity, soc=args.soc / 100,
+                          charge_ma=args.charge_current, discharge_ma=args.discharge_current)
+        board = VirtualBoard(battery, speed=args.speed, noise=args.noise)
+        board.set_interval(args.interval)
+        boards.append(board)
+
+        name = board.path
+        if args.link:
+            link = args.link if args.count == 1 else f"{args.link}{i}"
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(board.path, link)
+            name = f"{board.path} -> {link}"
+        print(f"[SIM {i}] Board on {name}")
+
+    try:
+        run(boards, args.report)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
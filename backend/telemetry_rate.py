@@ -0,0 +1,70 @@
+import time
+from config import TELEMETRY_FAST_MS, TELEMETRY_NORMAL_MS, TELEMETRY_SLOW_MS, TELEMETRY_NEAR_MARGIN
+from config import TELEMETRY_TEMP_WARN, TELEMETRY_TEMP_RISE, TELEMETRY_STEADY_AFTER, TELEMETRY_RATE_HOLD
+
+
+class TelemetryRatePolicy:
+    """Picks a board's telemetry interval from how close it is to a decision.
+
+    Fast near LOW/HIGH thresholds or when temperature is high or rising,
+    slow once the percentage has not moved for a while, normal otherwise.
+    Speeding up is immediate; slowing down waits TELEMETRY_RATE_HOLD.
+
+    The percentage is whatever the caller decides on: in AUTO, app.py passes
+    the AUTO source's (laptop or sensor) percentage, compared against the
+    thresholds it switches on; DeviceManager passes each board's own reading.
+    """
+
+    def __init__(self):
+        self._pct = None
+        self._pct_since = None   # when the percentage last changed
+        self._temp_ref = None    # (time, temperature) baseline for the rise check
+        self._changed_at = 0.0
+        self._at_default = False  # last seen at the firmware's default rate (current None)
+
+    def choose(self, pct, temperature=None, thresholds=None, now=None):
+        """Desired interval in ms; thresholds is (low, high) or None outside AUTO."""
+        now = time.monotonic() if now is None else now
+        if pct != self._pct:
+            self._pct = pct
+            self._pct_since = now
+
+        rising = False
+        if temperature is not None:
+            if self._temp_ref is None or now - self._temp_ref[0] > TELEMETRY_STEADY_AFTER:
+                self._temp_ref = (now, temperature)
+            rising = temperature - self._temp_ref[1] >= TELEMETRY_TEMP_RISE
+            if temperature >= TELEMETRY_TEMP_WARN or rising:
+                return TELEMETRY_FAST_MS
+
+        if pct is None:
+            return TELEMETRY_NORMAL_MS
+        if thresholds and any(abs(pct - t) <= TELEMETRY_NEAR_MARGIN for t in thresholds):
+            return TELEMETRY_FAST_MS
+        if now - self._pct_since >= TELEMETRY_STEADY_AFTER:
+            return TELEMETRY_SLOW_MS
+        return TELEMETRY_NORMAL_MS
+
+    def next_interval(self, current, pct, temperature=None, thresholds=None, now=None):
+        """Interval to request now, or None to leave the board as it is.
+
+        current None means the firmware default (just connected, or the board
+        reset), which counts as a fresh rate: slowing down from it waits
+        TELEMETRY_RATE_HOLD like any other.
+        """
+        now = time.monotonic() if now is None else now
+        if current is None:
+            current = TELEMETRY_NORMAL_MS
+            if not self._at_default:
+                self._at_default = True
+                self._changed_at = now
+        else:
+            self._at_default = False
+        desired = self.choose(pct, temperature, thresholds, now)
+        if desired == current:
+            return None
+        slowing = desired > current
+        if slowing and now - self._changed_at < TELEMETRY_RATE_HOLD:
+            return None
+        self._changed_at = now
+        return desired
@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+# The backend is a flat set of modules run from backend/ (python app.py); import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh battery_log.db in a temporary directory (DB_NAME is relative to the working directory)."""
+    import database
+    monkeypatch.chdir(tmp_path)
+    database.init_db()
+    conn = database.connect()
+    yield conn
+    conn.close()
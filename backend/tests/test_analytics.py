@@ -0,0 +1,141 @@
+import math
+import pytest
+import database
+from analytics import (BatteryAnalytics, chunk_levels, fit_line, level_sums, merge_sums, line_sums,
+                       summarize_segment, SUM_PT, N)
+from config import ANALYTICS_MAX_GAP, ANALYTICS_REF_PCT
+
+START = 1_699_999_200
+SAMPLE = 60                # seconds between samples
+SECONDS_PER_PCT = 120.0    # discharge rate of the new battery
+FADE_PER_CYCLE = 0.002     # capacity lost per full-depth cycle
+
+
+def battery_rows(cycles, start=START):
+    """Samples for full cycles 100 -> 20 -> 100, discharging faster as the capacity fades."""
+    rows, t = [], start
+    for cycle in range(cycles):
+        capacity = 1 - FADE_PER_CYCLE * cycle * 0.8
+        level = 100.0
+        while level > 20:
+            rows.append((t, float(round(level)), 3.3 + level / 100, 30.0))
+            level -= SAMPLE / (SECONDS_PER_PCT * capacity)
+            t += SAMPLE
+        while level < 100:
+            rows.append((t, float(round(level)), 3.4 + level / 100, 32.0))
+            level += 1
+            t += SAMPLE
+    return rows, t
+
+
+def log(rows):
+    # The writer thread would do this; flushing directly keeps the test synchronous
+    conn = database.connect()
+    try:
+        database.LogWriter()._flush(conn, rows)
+    finally:
+        conn.close()
+
+
+def test_fit_line_from_running_sums():
+    sums = [a + b + c for a, b, c in zip(line_sums(0, 1), line_sums(1, 3), line_sums(2, 5))]
+    slope, intercept = fit_line(*sums)
+    assert (slope, intercept) == pytest.approx((2.0, 1.0))
+    assert fit_line(*line_sums(1, 1)) is None
+    assert fit_line(*[a * 3 for a in line_sums(1, 1)]) is None  # no spread in x
+
+
+def test_merge_sums_matches_one_pass():
+    levels = [(60.0 - i, START + i * 100.0, 3.9 - i * 0.01) for i in range(20)]
+    merged = merge_sums(*(level_sums(*level) for level in levels[:7]),
+                        None, merge_sums(*(level_sums(*level) for level in levels[7:])))
+    assert merged == pytest.approx(merge_sums(*(level_sums(*level) for level in levels)))
+    segment = summarize_segment(-1, levels[0], levels[-1], merged)
+    assert segment["direction"] == "discharge"
+    assert segment["depth"] == 19
+    assert segment["seconds_per_pct"] == 100.0
+    assert segment["volts_at_ref"] == pytest.approx(3.9 - (60 - ANALYTICS_REF_PCT) * 0.01)
+    assert merged[N] == 20 and len(merged) > SUM_PT
+
+
+def test_chunk_levels_collapses_runs_and_marks_gaps():
+    rows = [(1, START, 50, 3.8), (2, START + 10, 50, 3.9), (3, START + 20, 49, None),
+            (4, START + 20 + ANALYTICS_MAX_GAP + 1, 49, 3.7), (5, START + 2000, None, 3.7)]
+    (pct, ts, volt, gap), last_ts = chunk_levels(rows, None)
+    assert pct.tolist() == [50, 49, 49]
+    assert ts.tolist() == [START + 5, START + 20, START + 21 + ANALYTICS_MAX_GAP]
+    assert volt[0] == pytest.approx(3.85) and math.isnan(volt[1])
+    assert gap.tolist() == [False, False, True]
+    assert last_ts == START + 21 + ANALYTICS_MAX_GAP
+    assert chunk_levels([(6, None, None, None)], last_ts) == (None, last_ts)
+
+
+def test_cycles_and_capacity_fade(db):
+    rows, _ = battery_rows(12)
+    log(rows)
+    result = BatteryAnalytics().refresh()
+    assert result["discharges"] == 12
+    assert result["full_cycles"] == 12
+    assert result["equivalent_cycles"] == pytest.approx(12 * 0.8, abs=0.1)
+    assert result["fade_pct_per_100_cycles"] == pytest.approx(FADE_PER_CYCLE * 100 * 100, rel=0.15)
+    assert result["capacity_percent"] < 100
+    assert result["in_progress"]["direction"] == "charge"
+    assert len(result["recent"]) == 10
+    assert result["voltage_at_ref"] == pytest.approx(3.3 + ANALYTICS_REF_PCT / 100, abs=0.01)
+
+
+def test_incremental_refresh_matches_one_pass(db):
+    rows, _ = battery_rows(8)
+    half = len(rows) // 2
+
+    log(rows[:half])
+    BatteryAnalytics(chunk_rows=97).refresh()
+    log(rows[half:])
+    incremental = BatteryAnalytics(chunk_rows=97).refresh()  # new instance: resumes from the saved state
+
+    db.execute("DELETE FROM battery_analytics")
+    db.commit()
+    one_pass = BatteryAnalytics().refresh()
+
+    # Chunk boundaries can split a run of equal percentage into two levels, which moves a fit slightly
+    for key in ("equivalent_cycles", "full_cycles", "charges", "discharges"):
+        assert incremental[key] == one_pass[key], key
+    for key in ("capacity_percent", "fade_pct_per_100_cycles", "voltage_at_ref"):
+        assert incremental[key] == pytest.approx(one_pass[key], rel=1e-3), key
+    for ours, theirs in zip(incremental["recent"], one_pass["recent"]):
+        assert ours["start"] == theirs["start"] and ours["depth"] == theirs["depth"]
+        assert ours["volts_at_ref"] == pytest.approx(theirs["volts_at_ref"], abs=1e-3)
+    assert incremental["last_row_id"] == len(rows)
+
+
+def test_gap_closes_open_segment(db):
+    rows, _ = battery_rows(1)
+    discharge = [r for r in rows if r[0] < START + 80 * SECONDS_PER_PCT]
+    log(discharge)
+    log([(discharge[-1][0] + ANALYTICS_MAX_GAP * 2, 90.0, 4.2, 30.0)])
+    result = BatteryAnalytics().refresh()
+    assert result["discharges"] == 1
+    assert result["in_progress"] is None
+
+
+def test_refresh_rows_bounds_one_refresh(db):
+    rows, _ = battery_rows(2)
+    log(rows)
+    analytics = BatteryAnalytics(chunk_rows=50, refresh_rows=100)
+    first = analytics.refresh()
+    assert first["pending"] and first["last_row_id"] == 100
+    while analytics.refresh()["pending"]:
+        pass
+    assert analytics._state["last_id"] == len(rows)
+
+
+def test_reset_when_log_is_cleared(db):
+    log(battery_rows(2)[0])
+    analytics = BatteryAnalytics()
+    assert analytics.refresh()["discharges"] == 2
+    db.execute("DELETE FROM battery_logs")
+    db.commit()
+    log(battery_rows(1)[0])
+    result = analytics.refresh()
+    assert result["discharges"] == 1
+    assert [s["direction"] for s in result["recent"]] == ["discharge"]  # the charge is still open
@@ -0,0 +1,164 @@
+import json
+import threading
+import pytest
+from serial_handler import CommandQueue, PendingCommand, SerialConnection, encode_frame, FRAME_REPLY, REPLY_STRUCT
+
+
+class FakeConnection:
+    """Stands in for SerialConnection: records what the writer executes, optionally holding the first one."""
+
+    def __init__(self, hold_first=False):
+        self.name = "fake"
+        self.command_stats = {"queued": 0, "coalesced": 0}
+        self.executed = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+        if not hold_first:
+            self.release.set()
+
+    def execute(self, pending):
+        self.executed.append(pending.cmd)
+        self.started.set()
+        self.release.wait(5)
+        return {"success": True, "cmd": pending.cmd, "id": pending.id}
+
+
+class FakePort:
+    """A serial port whose firmware acks every JSON command straight away."""
+
+    is_open = True
+
+    def __init__(self, connection, status="success"):
+        self.connection = connection
+        self.status = status
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+        message = json.loads(data)
+        self.connection.feed(json.dumps({"status": self.status, "id": message["id"]}).encode() + b"\n")
+
+
+def command(cmd, cmd_id):
+    return PendingCommand(cmd_id, cmd, 1.0, 0)
+
+
+def test_identical_queued_command_is_shared():
+    connection = FakeConnection()
+    queue = CommandQueue(connection)
+    first = queue.submit(command("STATUS", 1))
+    assert queue.submit(command("STATUS", 2)) is first
+    assert queue.depth() == 1
+    assert connection.command_stats == {"queued": 1, "coalesced": 1}
+
+
+def test_later_command_supersedes_queued_one_of_same_group():
+    connection = FakeConnection()
+    queue = CommandQueue(connection, min_interval=0)
+    on = queue.submit(command("ON", 1))
+    off = queue.submit(command("OFF", 2))
+    assert on.superseded_by is off
+    queue.start()
+    assert on.wait(2)["cmd"] == "OFF"
+    assert connection.executed == ["OFF"]
+    queue.stop(timeout=2)
+
+
+def test_priority_order_while_writer_is_busy():
+    connection = FakeConnection(hold_first=True)
+    queue = CommandQueue(connection, min_interval=0)
+    queue.start()
+    queue.submit(command("PING", 1))
+    assert connection.started.wait(2)
+    last = queue.submit(command("STATUS", 2))
+    queue.submit(command("MODE:AUTO", 3))
+    queue.submit(command("OFF", 4))
+    connection.release.set()
+    last.wait(2)
+    assert connection.executed == ["PING", "OFF", "MODE:AUTO", "STATUS"]
+    queue.stop(timeout=2)
+
+
+def test_parameterised_commands_share_a_group():
+    queue = CommandQueue(FakeConnection())
+    first = queue.submit(command("INTERVAL:500", 1))
+    second = queue.submit(command("INTERVAL:1000", 2))
+    assert first.superseded_by is second
+
+
+def test_stop_fails_queued_commands_and_ends_writer():
+    connection = FakeConnection(hold_first=True)
+    queue = CommandQueue(connection, min_interval=0)
+    queue.start()
+    running = queue.submit(command("PING", 1))
+    assert connection.started.wait(2)
+    queued = queue.submit(command("STATUS", 2))
+    queue.stop()
+    assert queued.wait(0)["error"] == "connection closed"
+    connection.release.set()
+    assert running.wait(2)["success"]
+    queue._thread.join(2)
+    assert not queue._thread.is_alive()
+    assert connection.executed == ["PING"]
+
+
+def test_restart_after_stop():
+    connection = FakeConnection()
+    queue = CommandQueue(connection, min_interval=0)
+    queue.start()
+    queue.stop(timeout=2)
+    queue.start()
+    assert queue.submit(command("PING", 1)).wait(2)["success"]
+    queue.stop(timeout=2)
+
+
+@pytest.fixture
+def connection():
+    conn = SerialConnection("queue-test")
+    conn.ser = FakePort(conn)
+    conn.reading = True
+    conn.queue.min_interval = 0
+    yield conn
+    conn.queue.stop(timeout=2)
+
+
+def test_send_command_is_acked_by_id(connection):
+    result = connection.send_command("on")
+    assert result["success"] and result["acked"]
+    assert result["response"]["id"] == result["id"]
+    assert json.loads(connection.ser.written[0]) == {"command": "ssr_on", "id": result["id"]}
+    assert connection.command_stats["acked"] == 1
+    assert connection._pending == {}
+
+
+def test_rejected_command_reports_firmware_error(connection):
+    connection.ser.status = "error"
+    result = connection.send_command("MODE:AUTO")
+    assert not result["success"]
+    assert result["error"] == "command rejected by firmware"
+
+
+def test_unacked_command_is_retried_then_times_out(connection):
+    connection.ser.write = connection.ser.written.append  # firmware never answers
+    result = connection.send_command("STATUS", timeout=0.05, retries=1)
+    assert not result["success"]
+    assert len(connection.ser.written) == 2
+    assert connection.command_stats["retries"] == 1
+    assert connection.command_stats["timeouts"] == 1
+
+
+def test_binary_reply_acks_command(connection):
+    connection.protocol = "binary"
+
+    def reply(data):
+        cmd_id = int.from_bytes(data[4:8], "little")
+        connection.feed(encode_frame(FRAME_REPLY, REPLY_STRUCT.pack(cmd_id, 0, 0, 90)))
+
+    connection.ser.write = reply
+    result = connection.send_command("OFF")
+    assert result["success"]
+    assert result["response"]["ssr"] == "off"
+
+
+def test_send_without_port_fails_fast():
+    assert SerialConnection("closed").send_command("ON") == {"success": False, "error": "Serial not connected"}
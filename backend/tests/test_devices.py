@@ -0,0 +1,20 @@
+import os
+import pytest
+import devices as devices_module
+from devices import DeviceManager, same_port
+
+
+def test_same_port_follows_links(tmp_path):
+    tty = tmp_path / "ttyUSB0"
+    tty.touch()
+    link = tmp_path / "usb-board-if00"
+    os.symlink(tty, link)
+    assert same_port(str(link), str(tty))
+    assert not same_port(str(tty), str(tmp_path / "ttyUSB1"))
+    assert not same_port(None, str(tty))
+
+
+def test_main_board_port_is_rejected(monkeypatch, tmp_path):
+    monkeypatch.setattr(devices_module.default_connection, "port", str(tmp_path / "ttyACM0"))
+    with pytest.raises(ValueError, match="main board"):
+        DeviceManager().add_device("bench", str(tmp_path / "ttyACM0"))
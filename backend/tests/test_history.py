@@ -0,0 +1,101 @@
+import time
+import database
+from database import pick_resolution, count_raw_rows, query_history, HISTORY_MAX_POINTS, LogWriter, ROLLUPS
+
+START = 1_699_999_200  # a multiple of 3600, so rollup buckets line up with the samples
+
+
+def stamp(epoch):
+    return time.strftime(database.TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+
+def log_rows(conn, rows):
+    LogWriter()._flush(conn, rows)
+
+
+def test_pick_resolution_from_span():
+    assert pick_resolution(START, START + HISTORY_MAX_POINTS * database.RAW_SAMPLE_SECONDS) == "raw"
+    assert pick_resolution(START, START + 86400) == "minute"
+    assert pick_resolution(START, START + 86400 * 30) == "hour"
+    assert pick_resolution(START, START + 86400 * 3650) == "hour"
+    assert pick_resolution(START, START - 10) == "raw"
+
+
+def test_pick_resolution_prefers_real_row_count():
+    span = 600
+    assert pick_resolution(START, START + span, raw_rows=HISTORY_MAX_POINTS) == "raw"
+    assert pick_resolution(START, START + span, raw_rows=HISTORY_MAX_POINTS + 1) == "minute"
+
+
+def test_count_raw_rows_stops_at_limit(db):
+    log_rows(db, [(START + i, 50.0, 3.8, 25.0) for i in range(20)])
+    assert count_raw_rows(db, START, START + 100) == 20
+    assert count_raw_rows(db, START, START + 100, limit=5) == 5
+    assert count_raw_rows(db, START + 10, START + 14) == 5
+
+
+def test_fast_telemetry_switches_auto_to_rollups(db):
+    # 500 ms telemetry for 50 minutes: the span alone suggests raw, the row count does not
+    rows = [(START + i / 2, 80.0 - i / 1000, 4.0, 30.0) for i in range(6000)]
+    log_rows(db, rows)
+    end = START + 3000
+    assert pick_resolution(START, end) == "raw"
+
+    result = query_history(START, end)
+    assert result["resolution"] == "minute"
+    assert not result["truncated"]
+    assert len(result["points"]) == 50
+    assert sum(p["samples"] for p in result["points"]) == 6000
+    assert result["points"][-1]["timestamp"] == START + 49 * 60
+
+
+def test_raw_keeps_newest_points_when_truncated(db):
+    log_rows(db, [(START + i, float(i % 100), 4.0, 30.0) for i in range(HISTORY_MAX_POINTS + 100)])
+    result = query_history(START, START + HISTORY_MAX_POINTS + 100, resolution="raw")
+    points = result["points"]
+    assert result["truncated"]
+    assert len(points) == HISTORY_MAX_POINTS
+    assert points[0]["timestamp"] == START + 100
+    assert points[-1]["timestamp"] == START + HISTORY_MAX_POINTS + 99
+    assert [p["timestamp"] for p in points] == sorted(p["timestamp"] for p in points)
+
+
+def test_raw_history_within_limit(db):
+    log_rows(db, [(START + i * 2, 50.0, 3.7, 25.0) for i in range(10)])
+    result = query_history(START, START + 60)
+    assert result["resolution"] == "raw"
+    assert not result["truncated"]
+    assert result["points"][0] == {"timestamp": START, "percentage": 50.0, "voltage": 3.7, "temperature": 25.0}
+
+
+def test_aggregate_skips_missing_values():
+    rows = [(START, 50.0, 3.8, None), (START + 30, 52.0, None, None), (START + 60, 40.0, 3.6, 20.0)]
+    first, second = database._aggregate(rows, 60)
+    assert first[:2] == [START, 2]
+    assert first[2:6] == [2, 102.0, 50.0, 52.0]   # percentage count, sum, min, max
+    assert first[6:10] == [1, 3.8, 3.8, 3.8]      # voltage
+    assert first[10:14] == [0, None, None, None]  # temperature never reported
+    assert second[:3] == [START + 60, 1, 1]
+
+
+def test_rollups_merge_across_flushes(db):
+    log_rows(db, [(START, 50.0, 3.8, 25.0), (START + 10, 60.0, 3.9, None)])
+    log_rows(db, [(START + 20, 40.0, 3.7, 27.0)])
+    point = query_history(START, START + 59, resolution="minute")["points"][0]
+    assert point["samples"] == 3
+    assert point["percentage"] == {"min": 40.0, "max": 60.0, "avg": 50.0}
+    assert point["temperature"] == {"min": 25.0, "max": 27.0, "avg": 26.0}
+    hour = query_history(START, START + 3599, resolution="hour")["points"][0]
+    assert hour["timestamp"] == START and hour["samples"] == 3
+
+
+def test_init_db_backfills_rollups_from_raw_rows(db):
+    db.executemany(database.INSERT_SQL, [(stamp(START), 50.0, 3.8, 25.0), (stamp(START + 30), 52.0, 3.8, 25.0)])
+    db.commit()
+    for table, _ in ROLLUPS.values():
+        db.execute(f"DELETE FROM {table}")
+    db.commit()
+    database.init_db()
+    point = query_history(START, START + 59, resolution="minute")["points"][0]
+    assert point["samples"] == 2
+    assert point["percentage"]["avg"] == 51.0
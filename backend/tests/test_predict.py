@@ -0,0 +1,74 @@
+import math
+import pytest
+from predict import RateEstimator, seconds_until_crossing, next_check_in
+from config import PREDICT_LEAD, PREDICT_MIN_INTERVAL, PREDICT_MAX_INTERVAL
+
+
+def test_rate_is_least_squares_slope():
+    estimator = RateEstimator(window=16, min_samples=3, spacing=0, max_age=1e9)
+    now = estimator._epoch
+    for i in range(10):
+        estimator.add("laptop", 80 - i * 0.5, now=now + i * 10)
+    assert estimator.rate("laptop", now=now + 90) == pytest.approx(-0.05)
+
+
+def test_ring_wraps_to_recent_samples():
+    estimator = RateEstimator(window=4, min_samples=3, spacing=0, max_age=1e9)
+    now = estimator._epoch
+    for i in range(20):
+        estimator.add("board", 20 + (i if i < 10 else 10 + 2 * (i - 10)), now=now + i)
+    assert estimator.rate("board", now=now + 19) == pytest.approx(2.0)
+
+
+def test_too_few_samples_and_unchanged_spacing():
+    estimator = RateEstimator(window=8, min_samples=3, spacing=30, max_age=1e9)
+    now = estimator._epoch
+    for i in range(5):
+        estimator.add("sensor", 50, now=now + i)  # unchanged within spacing: kept once
+    assert estimator.rate("sensor", now=now + 5) is None
+    assert estimator.rate("unknown") is None
+
+
+def test_old_samples_age_out():
+    estimator = RateEstimator(window=8, min_samples=2, spacing=0, max_age=60)
+    now = estimator._epoch
+    estimator.add("laptop", 50, now=now)
+    estimator.add("laptop", 51, now=now + 10)
+    assert estimator.rate("laptop", now=now + 20) == pytest.approx(0.1)
+    assert estimator.rate("laptop", now=now + 200) is None
+
+
+def test_rates_for_many_sources_and_row_reuse():
+    estimator = RateEstimator(window=8, min_samples=2, spacing=0, max_age=1e9, rows=2)
+    now = estimator._epoch
+    for n, source in enumerate(("a", "b", "c")):  # a third source grows the buffers
+        for i in range(4):
+            estimator.add(source, 50 + (n + 1) * i, now=now + i)
+    assert estimator.rates(now=now + 4) == pytest.approx({"a": 1.0, "b": 2.0, "c": 3.0})
+
+    estimator.remove("b")
+    estimator.add("d", 10, now=now + 5)
+    assert len(estimator) == 3
+    assert estimator.rate("d", now=now + 5) is None
+    assert set(estimator.rates(now=now + 5)) == {"a", "c"}
+
+    estimator.reset("a")
+    assert estimator.rate("a", now=now + 5) is None
+
+
+def test_seconds_until_crossing():
+    assert seconds_until_crossing(50, -0.1, 20, 80) == pytest.approx(300)
+    assert seconds_until_crossing(50, 0.5, 20, 80) == pytest.approx(60)
+    assert seconds_until_crossing(15, -0.1, 20, 80) == 0
+    assert seconds_until_crossing(50, 0, 20, 80) == math.inf
+    assert seconds_until_crossing(50, None, 20, 80) == math.inf
+
+
+def test_next_check_in():
+    assert next_check_in(None, -0.1, 20, 80, 5) == 5
+    assert next_check_in(50, None, 20, 80, 5) == 5
+    assert next_check_in(10, -0.1, 20, 80, 5) == 5  # already past the threshold
+    eta = 300
+    assert next_check_in(50, -0.1, 20, 80, 5) == min(max(eta * PREDICT_LEAD, PREDICT_MIN_INTERVAL), PREDICT_MAX_INTERVAL)
+    assert next_check_in(20.001, -1.0, 20, 80, 5) == PREDICT_MIN_INTERVAL
+    assert next_check_in(50, -1e-6, 20, 80, 5) == PREDICT_MAX_INTERVAL
@@ -0,0 +1,18 @@
+from sensors import SensorRegistry
+
+
+def test_snapshot_without_ages_depends_only_on_readings():
+    registry = SensorRegistry(history_size=4)
+    registry.update("phone", 55, "phone", timestamp=1000.0)
+    with_ages = registry.snapshot()[0]
+    assert set(with_ages) >= {"age_seconds", "stale"}
+    assert registry.snapshot(ages=False) == registry.snapshot(ages=False)
+    assert "age_seconds" not in registry.snapshot(ages=False)[0]
+
+
+def test_sweep_expires_silent_sensors():
+    registry = SensorRegistry(history_size=4)
+    registry.update("old", 40, timestamp=0.0)
+    registry.update("new", 60)
+    assert registry.sweep(max_age=60) == ["old"]
+    assert "old" not in registry and "new" in registry
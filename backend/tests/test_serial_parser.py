@@ -0,0 +1,131 @@
+import json
+import pytest
+import serial_handler
+from serial_handler import (SerialConnection, encode_frame, encode_command, encode_binary_command,
+                            FRAME_TELEMETRY, FRAME_REPLY, FRAME_COMMAND, TELEMETRY_STRUCT, REPLY_STRUCT,
+                            COMMAND_STRUCT, FLAG_SSR, FLAG_AUTO, FLAG_CHARGING, PendingCommand)
+
+
+@pytest.fixture
+def connection():
+    received = []
+    conn = SerialConnection("test", on_telemetry=lambda snapshot, changed: received.append((snapshot, changed)))
+    conn.received = received
+    return conn
+
+
+def telemetry_frame(pct=85, millivolts=4120, decidegrees=312, flags=FLAG_SSR | FLAG_AUTO):
+    return encode_frame(FRAME_TELEMETRY, TELEMETRY_STRUCT.pack(pct, millivolts, decidegrees, flags))
+
+
+def test_json_telemetry_line(connection):
+    connection.feed(b'{"percentage":72,"voltage":3.9,"temperature":30.5,"isCharging":true,'
+                    b'"ssrStatus":true,"autoCharge":false}\n')
+    snapshot, changed = connection.received[-1]
+    assert changed
+    assert snapshot["percentage"] == 72
+    assert snapshot["ssrStatus"] is True
+    assert connection.telemetry is snapshot
+    assert connection.ready.is_set()
+
+
+def test_json_line_split_across_chunks(connection):
+    line = b'{"percentage":50,"voltage":3.7,"temperature":25}\n'
+    connection.feed(line[:10])
+    assert connection.received == []
+    connection.feed(line[10:] + line)
+    assert [s["percentage"] for s, _ in connection.received] == [50, 50]
+    assert [c for _, c in connection.received] == [True, False]
+
+
+def test_non_telemetry_lines_are_kept_for_read_serial(connection):
+    connection.reading = True
+    connection.feed(b'SSR ON\n{"status":"ready"}\n{not json\n')
+    assert connection.read_serial() == ["SSR ON", '{"status":"ready"}', "{not json"]
+    assert connection.reader_stats["parse_errors"] == 1
+    assert connection.ready.is_set()
+
+
+def test_overlong_line_is_dropped(connection):
+    connection.feed(b"x" * (serial_handler.MAX_LINE_LENGTH + 1))
+    connection.feed(b'{"percentage":10}\n')
+    assert connection.received[-1][0]["percentage"] == 10
+
+
+def test_binary_telemetry_frame(connection):
+    connection.feed(telemetry_frame(flags=FLAG_SSR | FLAG_AUTO | FLAG_CHARGING))
+    snapshot, _ = connection.received[-1]
+    assert snapshot["percentage"] == 85
+    assert snapshot["voltage"] == 4.12
+    assert snapshot["temperature"] == 31.2
+    assert snapshot["isCharging"] and snapshot["ssrStatus"] and snapshot["autoCharge"]
+
+
+def test_binary_frame_split_byte_by_byte(connection):
+    for byte in telemetry_frame():
+        connection.feed(bytes((byte,)))
+    assert len(connection.received) == 1
+    assert connection.reader_stats["parse_errors"] == 0
+
+
+def test_bad_crc_is_rejected_and_parser_resyncs(connection):
+    corrupt = bytearray(telemetry_frame(pct=40))
+    corrupt[5] ^= 0xFF
+    connection.feed(bytes(corrupt) + telemetry_frame(pct=41))
+    assert [s["percentage"] for s, _ in connection.received] == [41]
+    assert connection.reader_stats["parse_errors"] >= 1
+
+
+def test_json_and_frames_interleaved(connection):
+    connection.feed(b'{"percentage":60}\n' + telemetry_frame(pct=61) + b'{"percentage":62}\n'
+                    + telemetry_frame(pct=63))
+    assert [s["percentage"] for s, _ in connection.received] == [60, 61, 62, 63]
+
+
+def test_text_noise_in_front_of_a_frame(connection):
+    connection.feed(b"\x00boot" + telemetry_frame(pct=70))
+    assert [s["percentage"] for s, _ in connection.received] == [70]
+
+
+def test_reply_frame_resolves_pending_command(connection):
+    pending = PendingCommand(7, "ON", 1.0, 0)
+    connection._pending[7] = pending
+    connection.feed(encode_frame(FRAME_REPLY, REPLY_STRUCT.pack(7, 0, FLAG_SSR, 88)))
+    assert pending.event.is_set()
+    assert pending.response == {"id": 7, "status": "success", "ssr": "on", "autoCharge": False, "percentage": 88}
+
+
+def test_json_reply_without_id_matches_oldest_pending(connection):
+    first, second = PendingCommand(1, "ON", 1.0, 0), PendingCommand(2, "STATUS", 1.0, 0)
+    connection._pending[1] = first
+    connection._pending[2] = second
+    connection.feed(b'{"status":"success"}\n')
+    assert first.event.is_set() and not second.event.is_set()
+
+
+def test_unmatched_reply_is_not_swallowed(connection):
+    connection.reading = True
+    connection.feed(b'{"status":"success","id":99}\n')
+    assert connection.read_serial() == ['{"status":"success","id":99}']
+
+
+def test_late_status_reply_is_not_telemetry(connection):
+    connection.reading = True
+    connection.feed(b'{"status":"success","id":12,"percentage":64,"ssr":"on"}\n')
+    assert connection.received == []
+    assert connection.telemetry is None
+    assert connection.command_stats["orphan_replies"] == 1
+    assert connection.read_serial() == ['{"status":"success","id":12,"percentage":64,"ssr":"on"}']
+
+
+def test_encode_command():
+    assert json.loads(encode_command("ON", 5)) == {"command": "ssr_on", "id": 5}
+    assert json.loads(encode_command("INTERVAL:500")) == {"command": "set_interval", "ms": 500}
+
+
+def test_encode_binary_command():
+    frame = encode_binary_command("INTERVAL:500", 3)
+    assert frame[2] == FRAME_COMMAND
+    assert COMMAND_STRUCT.unpack(frame[4:-2]) == (3, serial_handler.OP_SET_INTERVAL, 5)
+    assert encode_binary_command("INTERVAL:250", 3) is None  # not a multiple of 100 ms: sent as JSON
+    assert encode_binary_command("PROTOCOL:BINARY", 3) is None
@@ -0,0 +1,70 @@
+import threading
+import time
+import pytest
+import serial_handler
+from serial_handler import ConnectionSupervisor
+
+
+class FlakyConnection:
+    """Fails to reconnect a given number of times, then comes back."""
+
+    def __init__(self, failures):
+        self.name = "flaky"
+        self.failures = failures
+        self.attempts = []
+        self.closed = 0
+        self.back = threading.Event()
+
+    def reconnect(self):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) <= self.failures:
+            raise OSError("still unplugged")
+        self.back.set()
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture(autouse=True)
+def no_hotplug(monkeypatch):
+    monkeypatch.setattr(serial_handler, "RECONNECT_HOTPLUG", False)
+
+
+def test_backoff_doubles_up_to_the_cap():
+    supervisor = ConnectionSupervisor(initial=0.05, max_delay=0.2)
+    connection = FlakyConnection(failures=4)
+    watched_at = time.monotonic()
+    supervisor.watch(connection)
+    assert connection.back.wait(5)
+
+    gaps = [b - a for a, b in zip([watched_at] + connection.attempts, connection.attempts)]
+    for gap, expected in zip(gaps, (0.05, 0.1, 0.2, 0.2, 0.2)):
+        assert expected - 0.01 <= gap < expected + 0.15
+    assert connection.closed == 4
+    assert supervisor.lost() == []
+
+
+def test_watch_twice_keeps_the_current_backoff():
+    supervisor = ConnectionSupervisor(initial=60, max_delay=60)
+    connection = FlakyConnection(failures=0)
+    supervisor.watch(connection)
+    entry = list(supervisor._lost[connection])
+    supervisor.watch(connection)
+    assert supervisor._lost[connection] == entry
+    assert supervisor.lost() == ["flaky"]
+    supervisor.forget(connection)
+    assert supervisor.lost() == []
+
+
+def test_retry_soon_resets_backoff():
+    supervisor = ConnectionSupervisor(initial=0.05, max_delay=30)
+    connection = FlakyConnection(failures=3)
+    supervisor.watch(connection)
+    deadline = time.monotonic() + 5
+    while supervisor._lost[connection][1] < 0.4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Three failures in, the next try is 0.4 s away; a new port shows up
+    supervisor.retry_soon()
+    retried_at = time.monotonic()
+    assert connection.back.wait(5)
+    assert connection.attempts[-1] - retried_at < 0.3
@@ -0,0 +1,39 @@
+from telemetry_rate import TelemetryRatePolicy
+from config import (TELEMETRY_FAST_MS, TELEMETRY_NORMAL_MS, TELEMETRY_SLOW_MS, TELEMETRY_STEADY_AFTER,
+                    TELEMETRY_RATE_HOLD, TELEMETRY_TEMP_WARN)
+
+T0 = 1000.0
+
+
+def test_near_threshold_is_fast_and_immediate():
+    policy = TelemetryRatePolicy()
+    assert policy.next_interval(None, 22, 30, (20, 80), now=T0) == TELEMETRY_FAST_MS
+    assert policy.next_interval(TELEMETRY_FAST_MS, 22, 30, (20, 80), now=T0 + 1) is None
+
+
+def test_hot_board_is_fast():
+    policy = TelemetryRatePolicy()
+    assert policy.next_interval(TELEMETRY_NORMAL_MS, 50, TELEMETRY_TEMP_WARN, None, now=T0) == TELEMETRY_FAST_MS
+
+
+def test_firmware_default_is_not_rerequested():
+    assert TelemetryRatePolicy().next_interval(None, 50, 30, None, now=T0) is None
+
+
+def test_hold_applies_after_connecting():
+    policy = TelemetryRatePolicy()
+    policy.choose(50, 30, None, now=T0)  # steady for a long time before this connection
+    connected = T0 + TELEMETRY_STEADY_AFTER * 2
+    assert policy.next_interval(None, 50, 30, None, now=connected) is None
+    assert policy.next_interval(None, 50, 30, None, now=connected + TELEMETRY_RATE_HOLD - 1) is None
+    assert policy.next_interval(None, 50, 30, None, now=connected + TELEMETRY_RATE_HOLD) == TELEMETRY_SLOW_MS
+
+
+def test_hold_restarts_when_the_board_resets():
+    policy = TelemetryRatePolicy()
+    policy.choose(50, 30, None, now=T0)
+    later = T0 + TELEMETRY_STEADY_AFTER * 2
+    assert policy.next_interval(TELEMETRY_NORMAL_MS, 50, 30, None, now=later) == TELEMETRY_SLOW_MS
+    reset = later + 100  # board rebooted: back at its default rate
+    assert policy.next_interval(None, 50, 30, None, now=reset) is None
+    assert policy.next_interval(None, 50, 30, None, now=reset + TELEMETRY_RATE_HOLD) == TELEMETRY_SLOW_MS
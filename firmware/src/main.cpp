@@ -31,15 +31,47 @@ const int CHARGE_START = 20;  // Start at 20%
 const int CHARGE_STOP = 95;   // Stop at 95%
 const int TEMP_MAX = 45;      // Max temp 45°C
 
+// Binary frames (enabled by {"command":"set_protocol","protocol":"binary"}):
+//   A5 5A | type | len | payload | crc16 (CCITT 0x1021, init 0xFFFF, little-endian)
+// The CRC covers type, len and payload. JSON commands are always accepted.
+const uint8_t FRAME_SYNC0 = 0xA5;
+const uint8_t FRAME_SYNC1 = 0x5A;
+const uint8_t FRAME_TELEMETRY = 0x01;  // percentage u8, voltage mV u16, temperature 0.1C i16, flags u8
+const uint8_t FRAME_COMMAND = 0x02;    // id u32, opcode u8, arg u8
+const uint8_t FRAME_REPLY = 0x03;      // id u32, status u8 (0 = ok), flags u8, percentage u8
+const uint8_t FLAG_CHARGING = 0x01;
+const uint8_t FLAG_SSR = 0x02;
+const uint8_t FLAG_AUTO = 0x04;
+
+enum Opcode : uint8_t {
+  OP_SSR_ON = 1,
+  OP_SSR_OFF = 2,
+  OP_TOGGLE_AUTO = 3,
+  OP_SET_MODE = 4,   // arg 1 = AUTO, 0 = MANUAL
+  OP_STATUS = 5,
+  OP_PING = 6,
+  OP_SET_INTERVAL = 7  // arg = interval in 100 ms units
+};
+
+// Telemetry interval, set by the backend (set_interval)
+const unsigned long SEND_INTERVAL_DEFAULT = 2000;
+const unsigned long SEND_INTERVAL_MIN = 100;
+const unsigned long SEND_INTERVAL_MAX = 60000;
+
 // Variables
 float voltage = 0;
 float temperature = 0;
 int percentage = 0;
 bool ssrEnabled = false;
-bool autoCharge = true;
+bool autoCharge = true;    // the board's own CHARGE_START/CHARGE_STOP control, for use without a backend
+bool backendAuto = false;  // mode last set by the backend; recorded only, the backend drives the relay
 bool isCharging = false;
 
 String commandBuffer = "";
+bool binaryProtocol = false;
+unsigned long sendInterval = SEND_INTERVAL_DEFAULT;
+uint8_t frameBuffer[40];
+uint8_t frameLength = 0;
 
 void setup() {
   Serial.begin(115200);
@@ -68,9 +100,11 @@ void loop() {
   if (autoCharge) {
     autoControlCharger();
   }
+  // Safety cutoff applies in every mode, MANUAL included
+  overTemperatureCutoff();
   
   static unsigned long lastSend = 0;
-  if (millis() - lastSend >= 2000) {
+  if (millis() - lastSend >= sendInterval) {
     sendData();
     lastSend = millis();
     
@@ -82,9 +116,109 @@ void loop() {
   delay(100);
 }
 
+uint16_t crc16(const uint8_t* data, size_t length) {
+  uint16_t crc = 0xFFFF;
+  while (length--) {
+    crc ^= (uint16_t)(*data++) << 8;
+    for (int i = 0; i < 8; i++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, const uint8_t* payload, uint8_t length) {
+  uint8_t out[6 + 16];
+  out[0] = FRAME_SYNC0;
+  out[1] = FRAME_SYNC1;
+  out[2] = type;
+  out[3] = length;
+  memcpy(out + 4, payload, length);
+  uint16_t crc = crc16(out + 2, length + 2);
+  out[4 + length] = crc & 0xFF;
+  out[5 + length] = crc >> 8;
+  Serial.write(out, length + 6);
+}
+
+uint8_t stateFlags() {
+  return (isCharging ? FLAG_CHARGING : 0) | (ssrEnabled ? FLAG_SSR : 0) | (autoCharge ? FLAG_AUTO : 0);
+}
+
+bool setSendInterval(unsigned long ms) {
+  if (ms < SEND_INTERVAL_MIN || ms > SEND_INTERVAL_MAX) {
+    return false;
+  }
+  sendInterval = ms;
+  return true;
+}
+
+// Applies one command; returns false for unknown opcodes
+bool runCommand(uint8_t op, uint8_t arg) {
+  switch (op) {
+    case OP_SSR_ON:
+      digitalWrite(SSR_CONTROL_PIN, HIGH);
+      ssrEnabled = true;
+      return true;
+    case OP_SSR_OFF:
+      digitalWrite(SSR_CONTROL_PIN, LOW);
+      ssrEnabled = false;
+      return true;
+    case OP_TOGGLE_AUTO:
+      autoCharge = !autoCharge;
+      return true;
+    case OP_SET_MODE:
+      // A backend is driving the relay (its AUTO uses its own thresholds and battery source):
+      // record the mode and keep the board's own control off until the next reset
+      backendAuto = arg == 1;
+      autoCharge = false;
+      return true;
+    case OP_SET_INTERVAL:
+      return setSendInterval(arg * 100UL);
+    case OP_STATUS:
+    case OP_PING:
+      return true;
+  }
+  return false;
+}
+
+void processFrame(const uint8_t* frame, uint8_t length) {
+  uint8_t payloadLength = frame[3];
+  uint16_t crc = frame[length - 2] | (frame[length - 1] << 8);
+  if (crc != crc16(frame + 2, payloadLength + 2) || frame[2] != FRAME_COMMAND || payloadLength < 6) {
+    return;
+  }
+
+  const uint8_t* payload = frame + 4;
+  bool ok = runCommand(payload[4], payload[5]);
+
+  uint8_t reply[7];
+  memcpy(reply, payload, 4);  // id, already little-endian
+  reply[4] = ok ? 0 : 1;
+  reply[5] = stateFlags();
+  reply[6] = percentage;
+  sendFrame(FRAME_REPLY, reply, sizeof(reply));
+}
+
 void handleSerialCommands() {
   while (Serial.available() > 0) {
-    char c = Serial.read();
+    uint8_t c = Serial.read();
+    
+    // Binary frame: starts with the sync byte between text lines
+    if (frameLength > 0 || (c == FRAME_SYNC0 && commandBuffer.length() == 0)) {
+      frameBuffer[frameLength++] = c;
+      if (frameLength == 2 && c != FRAME_SYNC1) {
+        frameLength = 0;
+      } else if (frameLength >= 4) {
+        uint8_t total = frameBuffer[3] + 6;
+        if (total > sizeof(frameBuffer)) {
+          frameLength = 0;
+        } else if (frameLength == total) {
+          processFrame(frameBuffer, total);
+          frameLength = 0;
+        }
+      }
+      continue;
+    }
     
     if (c == '\n' || c == '\r') {
       if (commandBuffer.length() > 0) {
@@ -92,7 +226,7 @@ void handleSerialCommands() {
         commandBuffer = "";
       }
     } else {
-      commandBuffer += c;
+      commandBuffer += (char)c;
     }
   }
 }
@@ -105,23 +239,60 @@ void processCommand(String command) {
   }
   
   String cmd = doc["command"].as<String>();
+  // Optional correlation id, echoed back so the backend can match replies
+  long id = doc["id"] | -1L;
+  
+  StaticJsonDocument<128> reply;
+  reply["status"] = "success";
   
   if (cmd == "ssr_on") {
-    digitalWrite(SSR_CONTROL_PIN, HIGH);
-    ssrEnabled = true;
-    Serial.println("{\"status\":\"success\",\"ssr\":\"on\"}");
+    runCommand(OP_SSR_ON, 0);
+    reply["ssr"] = "on";
     
   } else if (cmd == "ssr_off") {
-    digitalWrite(SSR_CONTROL_PIN, LOW);
-    ssrEnabled = false;
-    Serial.println("{\"status\":\"success\",\"ssr\":\"off\"}");
+    runCommand(OP_SSR_OFF, 0);
+    reply["ssr"] = "off";
     
   } else if (cmd == "toggle_auto") {
-    autoCharge = !autoCharge;
-    Serial.print("{\"status\":\"success\",\"autoCharge\":");
-    Serial.print(autoCharge ? "true" : "false");
-    Serial.println("}");
+    runCommand(OP_TOGGLE_AUTO, 0);
+    reply["autoCharge"] = autoCharge;
+    
+  } else if (cmd == "set_mode") {
+    runCommand(OP_SET_MODE, doc["mode"].as<String>() == "AUTO" ? 1 : 0);
+    reply["mode"] = backendAuto ? "AUTO" : "MANUAL";
+    reply["autoCharge"] = autoCharge;
+    
+  } else if (cmd == "status") {
+    reply["ssr"] = ssrEnabled ? "on" : "off";
+    reply["autoCharge"] = autoCharge;
+    reply["percentage"] = percentage;
+    
+  } else if (cmd == "ping") {
+    reply["pong"] = true;
+    
+  } else if (cmd == "set_interval") {
+    if (setSendInterval(doc["ms"] | 0UL)) {
+      reply["interval"] = sendInterval;
+    } else {
+      reply["status"] = "error";
+      reply["error"] = "interval out of range";
+    }
+    
+  } else if (cmd == "set_protocol") {
+    // Acked in JSON; telemetry switches format from the next sample
+    binaryProtocol = doc["protocol"].as<String>() == "binary";
+    reply["protocol"] = binaryProtocol ? "binary" : "json";
+    
+  } else {
+    reply["status"] = "error";
+    reply["error"] = "unknown command";
   }
+  
+  if (id >= 0) {
+    reply["id"] = id;
+  }
+  serializeJson(reply, Serial);
+  Serial.println();
 }
 
 void readSensors() {
@@ -171,7 +342,9 @@ void autoControlCharger() {
     digitalWrite(SSR_CONTROL_PIN, LOW);
     ssrEnabled = false;
   }
-  
+}
+
+void overTemperatureCutoff() {
   // Stop if temperature too high
   if (temperature > TEMP_MAX && ssrEnabled) {
     digitalWrite(SSR_CONTROL_PIN, LOW);
@@ -180,6 +353,19 @@ void autoControlCharger() {
 }
 
 void sendData() {
+  if (binaryProtocol) {
+    uint16_t millivolts = (uint16_t)(voltage * 1000 + 0.5);
+    int16_t decidegrees = (int16_t)round(temperature * 10);
+    uint8_t payload[6] = {
+      (uint8_t)percentage,
+      (uint8_t)(millivolts & 0xFF), (uint8_t)(millivolts >> 8),
+      (uint8_t)(decidegrees & 0xFF), (uint8_t)((uint16_t)decidegrees >> 8),
+      stateFlags()
+    };
+    sendFrame(FRAME_TELEMETRY, payload, sizeof(payload));
+    return;
+  }
+  
   StaticJsonDocument<256> doc;
   
   doc["percentage"] = percentage;
@@ -34,6 +34,7 @@ let state = {
   },
   activityLog: [],
   pollingTimer: null,
+  eventSource: null,
 };
 
 // ===== DOM Elements =====
@@ -432,6 +433,69 @@ function stopPolling() {
   }
 }
 
+// ===== Live Updates (Server-Sent Events) =====
+
+/**
+ * Subscribe to GET /api/stream; the server pushes current state on
+ * connect and then only changes. Falls back to polling if unavailable.
+ */
+function startStream() {
+  if (typeof EventSource === 'undefined') {
+    startPolling();
+    return;
+  }
+  if (state.eventSource) return;
+
+  const source = new EventSource(`${CONFIG.API_BASE_URL}/stream`);
+  state.eventSource = source;
+
+  source.addEventListener('battery', (ev) => {
+    const data = JSON.parse(ev.data);
+    if (!data) return;
+    const status = data.status || {};
+    state.battery = {
+      ...state.battery,
+      percentage: status.percentage ?? state.battery.percentage,
+      status: status.plugged ? 'charging' : 'discharging',
+      temperature: data.temperature_celsius ?? state.battery.temperature,
+      health: (data.health && data.health.health_percent) ?? state.battery.health,
+    };
+    state.system.apiConnected = true;
+    updateUI();
+  });
+
+  source.addEventListener('telemetry', () => {
+    state.system.arduinoConnected = true;
+    updateSystemInfo();
+  });
+
+  source.addEventListener('ssr', (ev) => {
+    const data = JSON.parse(ev.data);
+    state.relay.isConnected = data.state === 'ON';
+    updateRelayDisplay();
+  });
+
+  source.onerror = () => {
+    state.system.apiConnected = false;
+    updateConnectionStatus();
+    // EventSource retries by itself; only poll once it has given up
+    if (source.readyState === EventSource.CLOSED) {
+      stopStream();
+      startPolling();
+    }
+  };
+
+  console.log('Live updates started: /api/stream');
+}
+
+function stopStream() {
+  if (state.eventSource) {
+    state.eventSource.close();
+    state.eventSource = null;
+    console.log('Live updates stopped');
+  }
+}
+
 // ===== Event Listeners =====
 
 elements.shutoffThreshold.addEventListener('change', updateAutoShutoff);
@@ -439,9 +503,10 @@ elements.shutoffThreshold.addEventListener('change', updateAutoShutoff);
 // Handle page visibility
 document.addEventListener('visibilitychange', () => {
   if (document.hidden) {
+    stopStream();
     stopPolling();
   } else {
-    startPolling();
+    startStream();
   }
 });
 
@@ -475,8 +540,8 @@ function init() {
     type: 'info',
   });
   
-  // Start data polling
-  startPolling();
+  // Start live updates (polling fallback)
+  startStream();
 }
 
 // Start the application
@@ -1,5 +1,5 @@
 import { useState, useEffect, useCallback } from 'react';
-import { BatteryData, RelayStatus, ActivityLog, SystemStatus } from '@/types/battery';
+import { BatteryData, RelayStatus, ActivityLog, SystemStatus, BackendBatteryResponse, BackendModeResponse } from '@/types/battery';
 
 // Mock data generator for demonstration
 const generateMockBatteryData = (): BatteryData => ({
@@ -63,7 +63,7 @@ export const useBatteryData = () => {
   const [systemStatus, setSystemStatus] = useState<SystemStatus>(initialSystemStatus);
   const [powerHistory, setPowerHistory] = useState<{ time: string; power: number; current: number }[]>([]);
 
-  // Poll backend for battery data
+  // Subscribe to backend state changes (SSE), polling as fallback
   useEffect(() => {
     const API_BASE = (import.meta.env.VITE_API_URL as string) || 'http://localhost:5000';
 
@@ -88,69 +88,131 @@ export const useBatteryData = () => {
 
     let mounted = true;
 
-    const fetchData = async () => {
-      try {
-        // Fetch both battery data and mode
-        const [batteryResp, modeResp] = await Promise.all([
-          fetch(`${API_BASE}/api/battery`),
-          fetch(`${API_BASE}/api/mode`)
-        ]);
-        
-        if (!batteryResp.ok) throw new Error(batteryResp.statusText || 'battery fetch failed');
-        if (!modeResp.ok) throw new Error(modeResp.statusText || 'mode fetch failed');
-        
-        const batteryJson = await batteryResp.json();
-        const modeJson = await modeResp.json();
+    const applyMode = (modeJson: BackendModeResponse | null) => {
+      const mode = modeJson?.mode;
+      if (mode) {
+        setSystemStatus(prev => ({ ...prev, mode }));
+      }
+    };
 
-        if (!mounted) return;
+    const applyBattery = (batteryJson: BackendBatteryResponse) => {
+      const status = batteryJson.status || {};
+      const healthObj = batteryJson.health || {};
 
-        // Update mode from backend
-        if (modeJson && modeJson.mode) {
-          setSystemStatus(prev => ({ ...prev, mode: modeJson.mode }));
-        }
+      const newData: BatteryData = {
+        percentage: typeof status.percentage === 'number' ? status.percentage : batteryData.percentage,
+        status: status.plugged ? 'charging' : 'discharging',
+        voltage: typeof batteryJson.voltage === 'number' ? batteryJson.voltage : batteryData.voltage,
+        current: typeof batteryJson.current === 'number' ? batteryJson.current : batteryData.current,
+        power: typeof batteryJson.power === 'number' ? batteryJson.power : batteryData.power,
+        timeRemaining: parseTimeLeft(status.time_left ?? null),
+        health: typeof healthObj.health_percent === 'number' ? healthObj.health_percent : batteryData.health,
+        temperature: typeof batteryJson.temperature_celsius === 'number' ? batteryJson.temperature_celsius : batteryData.temperature,
+        cycleCount: typeof batteryJson.estimated_cycles === 'number' ? batteryJson.estimated_cycles : batteryData.cycleCount,
+      };
 
-        const status = batteryJson.status || {};
-        const healthObj = batteryJson.health || {};
-
-        const newData: BatteryData = {
-          percentage: typeof status.percentage === 'number' ? status.percentage : batteryData.percentage,
-          status: status.plugged ? 'charging' : 'discharging',
-          voltage: typeof batteryJson.voltage === 'number' ? batteryJson.voltage : batteryData.voltage,
-          current: typeof batteryJson.current === 'number' ? batteryJson.current : batteryData.current,
-          power: typeof batteryJson.power === 'number' ? batteryJson.power : batteryData.power,
-          timeRemaining: parseTimeLeft(status.time_left),
-          health: typeof healthObj.health_percent === 'number' ? healthObj.health_percent : batteryData.health,
-          temperature: typeof batteryJson.temperature_celsius === 'number' ? batteryJson.temperature_celsius : batteryData.temperature,
-          cycleCount: typeof batteryJson.estimated_cycles === 'number' ? batteryJson.estimated_cycles : batteryData.cycleCount,
-        };
+      setBatteryData(newData);
+      setSystemStatus(prev => ({ ...prev, lastUpdate: new Date() }));
+
+      setPowerHistory(prev => {
+        const now = new Date();
+        const timeStr = `${now.getHours().toString().padStart(2, '0')}:${now.getMinutes().toString().padStart(2, '0')}:${now.getSeconds().toString().padStart(2, '0')}`;
+        const newHistory = [...prev, { time: timeStr, power: newData.power, current: newData.current }];
+        return newHistory.slice(-20);
+      });
+    };
+
+    const logFetchError = (e: unknown) => {
+      const errLog: ActivityLog = {
+        id: Date.now().toString(),
+        timestamp: new Date(),
+        action: 'Gagal mengambil data baterai',
+        user: 'System',
+        details: String(e),
+        type: 'error',
+      };
+      setActivityLogs(prev => [errLog, ...prev].slice(0, 50));
+    };
 
-        setBatteryData(newData);
-        setSystemStatus(prev => ({ ...prev, lastUpdate: new Date() }));
+    // Polling fallback for browsers without EventSource: one conditional
+    // request for all state; 304 means nothing changed since the last poll
+    let snapshotEtag: string | null = null;
 
-        setPowerHistory(prev => {
-          const now = new Date();
-          const timeStr = `${now.getHours().toString().padStart(2, '0')}:${now.getMinutes().toString().padStart(2, '0')}:${now.getSeconds().toString().padStart(2, '0')}`;
-          const newHistory = [...prev, { time: timeStr, power: newData.power, current: newData.current }];
-          return newHistory.slice(-20);
+    const fetchData = async () => {
+      try {
+        const resp = await fetch(`${API_BASE}/api/snapshot`, {
+          headers: snapshotEtag ? { 'If-None-Match': snapshotEtag } : {},
         });
+
+        if (resp.status === 304) return;
+        if (!resp.ok) throw new Error(resp.statusText || 'snapshot fetch failed');
+
+        snapshotEtag = resp.headers.get('ETag');
+        const snapshot = await resp.json();
+
+        if (!mounted) return;
+
+        applyMode({ mode: snapshot.mode });
+        if (snapshot.battery) applyBattery(snapshot.battery);
       } catch (e) {
-        const errLog: ActivityLog = {
-          id: Date.now().toString(),
-          timestamp: new Date(),
-          action: 'Gagal mengambil data baterai',
-          user: 'System',
-          details: String(e),
-          type: 'error',
-        };
-        setActivityLogs(prev => [errLog, ...prev].slice(0, 50));
+        logFetchError(e);
       }
     };
 
-    fetchData();
-    const interval = setInterval(fetchData, 3000);
+    let interval: ReturnType<typeof setInterval> | null = null;
+    let source: EventSource | null = null;
+
+    const startPolling = () => {
+      if (interval) return;
+      fetchData();
+      interval = setInterval(fetchData, 3000);
+    };
+
+    if (typeof EventSource === 'undefined') {
+      startPolling();
+    } else {
+      // Server pushes the current state on connect, then only changes
+      source = new EventSource(`${API_BASE}/api/stream`);
+
+      source.onopen = () => {
+        setSystemStatus(prev => ({ ...prev, websocketConnected: true }));
+      };
+
+      source.onerror = () => {
+        // EventSource reconnects on its own; fall back to polling only if it gave up
+        setSystemStatus(prev => ({ ...prev, websocketConnected: false }));
+        if (source && source.readyState === EventSource.CLOSED) {
+          startPolling();
+        }
+      };
+
+      source.addEventListener('battery', (ev) => {
+        const batteryJson = JSON.parse((ev as MessageEvent).data);
+        if (!mounted || !batteryJson) return;
+        applyBattery(batteryJson);
+      });
+
+      source.addEventListener('mode', (ev) => {
+        if (!mounted) return;
+        applyMode(JSON.parse((ev as MessageEvent).data));
+      });
+
+      source.addEventListener('ssr', (ev) => {
+        const ssrJson = JSON.parse((ev as MessageEvent).data);
+        if (!mounted || !ssrJson) return;
+        setRelayStatus(prev => ({ ...prev, isConnected: ssrJson.state === 'ON', lastToggle: new Date() }));
+      });
+
+      source.addEventListener('telemetry', () => {
+        if (!mounted) return;
+        setSystemStatus(prev => ({ ...prev, arduinoConnected: true, lastUpdate: new Date() }));
+      });
+    }
+
     return () => {
       mounted = false;
-      clearInterval(interval);
+      if (interval) clearInterval(interval);
+      if (source) source.close();
     };
   }, []);
 
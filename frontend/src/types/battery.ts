@@ -33,3 +33,24 @@ export interface SystemStatus {
   uptime: number;
   mode: 'MANUAL' | 'AUTO';
 }
+
+// Shape of GET /api/battery and the 'battery' stream event
+export interface BackendBatteryResponse {
+  status?: {
+    percentage?: number;
+    plugged?: boolean;
+    time_left?: string | null;
+  };
+  health?: {
+    health_percent?: number | null;
+  };
+  voltage?: number;
+  current?: number;
+  power?: number;
+  estimated_cycles?: number | null;
+  temperature_celsius?: number | null;
+}
+
+export interface BackendModeResponse {
+  mode?: 'MANUAL' | 'AUTO';
+}